@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,4 +138,74 @@ ELASTICSEARCH_DSL = {
 # Nom de l'index Elasticsearch
 ELASTICSEARCH_INDEX_NAMES = {
     'myapp.documents.TransactionDocument': 'transactions',
-}
\ No newline at end of file
+}
+
+# Data lake : dossier par défaut (version 1 du lake)
+DATA_LAKE_PATH = "C:/Users/yanis/OneDrive/Documents/M1 Data/Data integration/TP2_API/data_lake"
+
+# Data lake : nombre maximum d'enregistrements par segment compacté (commande compact_lake)
+DATA_LAKE_SEGMENT_SIZE = 10000
+
+# Data lake : budget mémoire du cache de datasets partagé par le processus (octets)
+DATA_LAKE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Data lake : datasets chauds servis depuis un fichier colonnaire projeté en mémoire, partagé par les workers (commande map_lake)
+DATA_LAKE_MAPPED_DATASETS = ['TRANSACTIONS_COMPLETED']
+# Reconstruction du fichier projeté par le watcher : dès ce nombre de fichiers non couverts, ou quand il est plus ancien que ce délai (secondes)
+DATA_LAKE_MAPPED_REBUILD_FILES = 500
+DATA_LAKE_MAPPED_REBUILD_AGE = 600
+
+# Journaux d'accès : écriture en arrière-plan par paquets (voir myapp/access_log.py)
+ACCESS_LOG_ASYNC = True
+ACCESS_LOG_BATCH_SIZE = 200
+ACCESS_LOG_FLUSH_INTERVAL = 1.0  # secondes
+ACCESS_LOG_QUEUE_SIZE = 10000
+ACCESS_LOG_OVERFLOW = 'drop'  # 'drop' ou 'block'
+ACCESS_LOG_BLOCK_TIMEOUT = 0.5  # secondes, avec 'block'
+
+# Droits d'accès compilés par utilisateur : durée de vie dans le cache Django (secondes)
+DATASET_PERMISSIONS_CACHE_TIMEOUT = 60
+
+# Fenêtre glissante de last_5_minutes_spent : horizon du buffer en mémoire (secondes, une case par seconde)
+SPENDING_WINDOW_HORIZON = 24 * 3600
+# Marge de relecture du journal des dépenses : une écriture validée jusqu'à ce délai après sa création est encore prise en compte (secondes)
+SPENDING_SYNC_MARGIN = 60
+
+# /myapp/transactions/ : total renvoyé par défaut ('exact', 'estimate' ou 'none', surchargeable avec ?count=)
+TRANSACTION_COUNT_MODE = 'exact'
+# Avec 'estimate' sur une requête filtrée : comptage arrêté à cette borne
+TRANSACTION_COUNT_ESTIMATE_LIMIT = 10000
+
+# Encodage JSON du lake et des réponses : 'orjson' (s'il est installé) ou 'json' ; None = choix automatique
+JSON_CODEC = None
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'myapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Mesures par requête (myapp/instrumentation.py) : en-tête Server-Timing et /myapp/metrics/
+PERF_INSTRUMENTATION = True
+PERF_SERVER_TIMING = True
+
+# Vues async du lake (/myapp/async/...) : threads du pool qui lit les fichiers hors de la boucle d'événements
+LAKE_IO_WORKERS = 8
+
+# retrieve_all : échéance (secondes) pour ouvrir les datasets en parallèle ; None = attendre tous les datasets
+LAKE_FANOUT_DEADLINE = 5.0
+# Threads du pool dédié à ces ouvertures (séparé de LAKE_IO_WORKERS : une ouverture abandonnée à l'échéance n'y bloque pas les vues async)
+LAKE_FANOUT_WORKERS = 4
+
+# Watcher du lake (commande watch_lake, myapp/watcher.py)
+LAKE_WATCHER_CONSUMERS = ['catalog', 'ingestion', 'search', 'keys', 'mapped', 'cache']
+LAKE_WATCHER_INGEST_DATASETS = ['TRANSACTIONS_COMPLETED']
+LAKE_WATCHER_BATCH_SIZE = 500  # fichiers
+LAKE_WATCHER_BATCH_DELAY = 2.0  # secondes
+LAKE_WATCHER_POLL_INTERVAL = 1.0  # secondes, sans inotify
+LAKE_WATCHER_STATUS_FILE = BASE_DIR / 'lake_watcher_status.json'
+
+# Index des clés du lake (commande index_lake_keys, route /myapp/data_lake/lookup/)
+LAKE_LOOKUP_DEFAULT_LIMIT = 100
+LAKE_LOOKUP_MAX_LIMIT = 1000
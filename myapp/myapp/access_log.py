@@ -0,0 +1,186 @@
+"""Écriture asynchrone et groupée des journaux d'accès.
+
+Chaque appel d'API produisait un ``AccessLog.objects.create`` synchrone (et
+``get_dataset_version`` un ``DetailedAccessLog`` de plus) : avec SQLite, toutes
+les requêtes se sérialisaient sur le verrou d'écriture. Les entrées sont
+maintenant mises dans une file bornée en mémoire et écrites par un thread de
+fond avec ``bulk_create``, dès que ``ACCESS_LOG_BATCH_SIZE`` entrées sont en
+attente ou au plus tard toutes les ``ACCESS_LOG_FLUSH_INTERVAL`` secondes.
+
+Quand la file est pleine, ``ACCESS_LOG_OVERFLOW`` choisit la politique :
+``'drop'`` abandonne l'entrée (comptée dans ``dropped``), ``'block'`` fait
+attendre la requête au plus ``ACCESS_LOG_BLOCK_TIMEOUT`` secondes avant
+d'abandonner. Les entrées en attente sont écrites à l'arrêt du processus.
+
+Avec ``ACCESS_LOG_ASYNC = False`` (tests, scripts), les entrées sont écrites
+immédiatement, comme avant.
+"""
+import atexit
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import AccessLog, DetailedAccessLog
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BLOCK_TIMEOUT = 0.5
+MAX_LOGGED_BODY = 4096
+
+
+class AccessLogWriter:
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 queue_size=DEFAULT_QUEUE_SIZE, overflow='drop', block_timeout=DEFAULT_BLOCK_TIMEOUT):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def enqueue(self, entry):
+        """Ajoute un ``AccessLog`` ou ``DetailedAccessLog`` non enregistré à la file"""
+        self._ensure_started()
+        try:
+            if self.overflow == 'block':
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._write(batch)
+        close_old_connections()
+
+    def _drain(self, block):
+        """Récupère jusqu'à ``batch_size`` entrées, en attendant au plus ``flush_interval``"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        by_model = {}
+        for entry in batch:
+            by_model.setdefault(type(entry), []).append(entry)
+        close_old_connections()
+        for model, entries in by_model.items():
+            try:
+                model.objects.bulk_create(entries)
+                self.written += len(entries)
+            except Exception as e:
+                self.errors += len(entries)
+                print(f"Erreur lors de l'écriture des journaux d'accès: {str(e)}")
+        self.flushes += 1
+
+    def flush(self):
+        """Écrit immédiatement tout ce qui est en attente (dans le thread appelant)"""
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                break
+            self._write(batch)
+
+    def shutdown(self, timeout=5.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'flushes': self.flushes,
+            'pending': self._queue.qsize(),
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_access_log_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AccessLogWriter(
+                    batch_size=getattr(settings, 'ACCESS_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    flush_interval=getattr(settings, 'ACCESS_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                    queue_size=getattr(settings, 'ACCESS_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+                    overflow=getattr(settings, 'ACCESS_LOG_OVERFLOW', 'drop'),
+                    block_timeout=getattr(settings, 'ACCESS_LOG_BLOCK_TIMEOUT', DEFAULT_BLOCK_TIMEOUT),
+                )
+                atexit.register(_writer.shutdown)
+    return _writer
+
+
+def write_entry(entry):
+    if getattr(settings, 'ACCESS_LOG_ASYNC', True):
+        get_access_log_writer().enqueue(entry)
+    else:
+        entry.save()
+
+
+def request_body(request):
+    """Corps de la requête à journaliser, tronqué à ``MAX_LOGGED_BODY`` octets"""
+    body = request.body
+    if not body:
+        return ''
+    return body[:MAX_LOGGED_BODY].decode('utf-8', errors='replace')
+
+
+def log_request(request):
+    write_entry(AccessLog(
+        user=request.user,
+        request_path=request.path,
+        request_method=request.method,
+        request_body=request_body(request)
+    ))
+
+
+def log_dataset_access(user, dataset_name, access_type, version=None, success=True, error_message=''):
+    write_entry(DetailedAccessLog(
+        user=user,
+        dataset_name=dataset_name,
+        version=version,
+        access_type=access_type,
+        success=success,
+        error_message=error_message
+    ))
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import AccessRight, AccessLog, Transaction, DataLakeVersion, DetailedAccessLog
+from .models import AccessRight, AccessLog, Transaction, DataLakeVersion, DetailedAccessLog, IngestedFile, IndexedFile, CatalogDataset, KeyIndexedFile
 
 @admin.register(DataLakeVersion)
 class DataLakeVersionAdmin(admin.ModelAdmin):
@@ -22,3 +22,31 @@ class AccessLogAdmin(admin.ModelAdmin):
     list_filter = ('request_method', 'user')
     search_fields = ('user__username', 'request_path')
     ordering = ('-timestamp',)
+
+@admin.register(IngestedFile)
+class IngestedFileAdmin(admin.ModelAdmin):
+    list_display = ('version', 'dataset_name', 'filename', 'rows', 'ingested_at')
+    list_filter = ('version', 'dataset_name')
+    search_fields = ('filename',)
+    ordering = ('-ingested_at',)
+
+@admin.register(IndexedFile)
+class IndexedFileAdmin(admin.ModelAdmin):
+    list_display = ('version', 'dataset_name', 'filename', 'indexed_at')
+    list_filter = ('version', 'dataset_name')
+    search_fields = ('filename',)
+    ordering = ('-indexed_at',)
+
+@admin.register(CatalogDataset)
+class CatalogDatasetAdmin(admin.ModelAdmin):
+    list_display = ('version', 'dataset_name', 'files', 'records', 'size', 'max_timestamp', 'scanned_at')
+    list_filter = ('version',)
+    search_fields = ('dataset_name',)
+    ordering = ('version__name', 'dataset_name')
+
+@admin.register(KeyIndexedFile)
+class KeyIndexedFileAdmin(admin.ModelAdmin):
+    list_display = ('version', 'dataset_name', 'filename', 'keys', 'indexed_at')
+    list_filter = ('version', 'dataset_name')
+    search_fields = ('filename',)
+    ordering = ('-indexed_at',)
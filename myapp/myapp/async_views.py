@@ -0,0 +1,205 @@
+"""Variantes async (ASGI) des routes de lecture du data lake.
+
+Mêmes paramètres, mêmes droits et mêmes réponses que ``retrieve_all``,
+``retrieve_projection``, ``get_dataset_version`` et
+``list_data_lake_resources`` de ``views.py``, sous ``/myapp/async/...``. DRF
+n'exécutant pas de vues async, ce sont des vues Django : l'authentification
+Basic passe par ``BasicAuthentication`` de DRF et les réponses sont rendues
+avec le codec du projet.
+
+La boucle d'événements n'est jamais bloquée : les lectures de fichiers passent
+par le pool borné de ``lake/executor.py`` (plusieurs datasets sont lus en
+parallèle), le rendu JSON aussi, et l'ORM est appelé en async (``aget``,
+``async for``) ou via ``sync_to_async`` pour le code partagé avec les vues
+synchrones. Servies par un serveur ASGI (uvicorn, daphne), elles permettent à
+un seul worker de traiter de nombreuses lectures simultanées.
+"""
+import functools
+import os
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+
+from . import codec, instrumentation, views
+from .access_log import log_dataset_access, log_request
+from .lake.executor import gather_in_lake_executor, run_in_lake_executor
+from .lake.fanout import aopen_pagers
+from .lake.paging import DatasetPager
+from .lake import timeindex
+from .lake.query import InvalidQuery, LakeQuery, TimeWindow
+from .models import DataLakeVersion
+from .permissions import get_permissions
+
+
+def _render(data):
+    with instrumentation.phase('render'):
+        return codec.dumps(data)
+
+
+async def json_response(data, status=status.HTTP_200_OK):
+    """Réponse JSON, sérialisée hors de la boucle d'événements"""
+    body = await run_in_lake_executor(_render, data)
+    return HttpResponse(body, content_type='application/json', status=status)
+
+
+async def from_drf_response(response, headers=None):
+    """Réponse Django équivalente à une ``Response`` de DRF produite par le code partagé"""
+    converted = await json_response(response.data, status=response.status_code)
+    for name, value in (headers or {}).items():
+        converted[name] = value
+    return converted
+
+
+async def authenticate(request):
+    """Authentification Basic comme les vues DRF ; retourne None ou la réponse 401"""
+    authenticator = BasicAuthentication()
+    try:
+        result = await sync_to_async(authenticator.authenticate)(request)
+    except AuthenticationFailed as e:
+        detail = e.detail
+    else:
+        if result is not None:
+            request.user = result[0]
+            return None
+        detail = NotAuthenticated.default_detail
+
+    response = await json_response({"detail": detail}, status=status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+    return response
+
+
+def async_api_view(view):
+    """Équivalent async de ``@api_view(['GET'])`` + ``BasicAuthentication`` + ``IsAuthenticated``"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            response = await json_response(
+                {"detail": f'Method "{request.method}" not allowed.'},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED
+            )
+            response['Allow'] = 'GET, HEAD'
+            return response
+
+        error = await authenticate(request)
+        if error is not None:
+            return error
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def log_access(request):
+    await sync_to_async(log_request)(request)
+
+
+@async_api_view
+async def retrieve_all(request):
+    await log_access(request)
+
+    permissions = await sync_to_async(get_permissions)(request.user)
+    user_datasets = permissions.datasets
+    if not user_datasets:
+        return await json_response(
+            {"detail": "You don't have access to any datasets"}, status=status.HTTP_403_FORBIDDEN
+        )
+
+    # Datasets ouverts en parallèle avec la même échéance que la vue synchrone, puis page lue dans le pool
+    pagers, skipped = await aopen_pagers(views.DATA_LAKE_PATH, user_datasets)
+    error = views.skipped_cursor_response(request.GET, skipped)
+    if error is not None:
+        return await from_drf_response(error, headers={'Retry-After': error['Retry-After']})
+    response = await run_in_lake_executor(
+        views.paginated_lake_response, request.GET, pagers, {"skipped_datasets": skipped} if skipped else {}
+    )
+    return await from_drf_response(response)
+
+
+@async_api_view
+async def retrieve_projection(request, dataset_name):
+    await log_access(request)
+
+    permissions = await sync_to_async(get_permissions)(request.user)
+    if not permissions.can_access(dataset_name):
+        return await json_response(
+            {"detail": f"Access Denied: You don't have permission to access dataset '{dataset_name}'."},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    base_path = views.DATA_LAKE_PATH
+    if not await run_in_lake_executor(os.path.isdir, os.path.join(base_path, dataset_name)):
+        return await json_response({"detail": f"Dataset '{dataset_name}' not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        query = LakeQuery.from_params(
+            fields=request.GET.get('fields'),
+            where=request.GET.getlist('where'),
+            start=request.GET.get('from'),
+            end=request.GET.get('to')
+        )
+    except InvalidQuery as e:
+        return await json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    index = await sync_to_async(timeindex.get_time_index)(base_path, dataset_name) if query.window else None
+    pager = await run_in_lake_executor(DatasetPager, base_path, dataset_name, window=query.window, index=index)
+    response = await run_in_lake_executor(
+        views.paginated_lake_response, request.GET, [pager], {"dataset": dataset_name}, query=query
+    )
+    return await from_drf_response(response)
+
+
+@async_api_view
+async def list_data_lake_resources(request):
+    """Liste toutes les ressources disponibles dans le data lake avec leurs versions"""
+    await log_access(request)
+
+    versions = [version async for version in DataLakeVersion.objects.prefetch_related('catalog_datasets')]
+    entries = await gather_in_lake_executor(views.version_resources, versions)
+    resources = {
+        version.name: entry
+        for version, entry in zip(versions, entries)
+        if entry is not None
+    }
+    return await json_response(resources)
+
+
+@async_api_view
+async def get_dataset_version(request, dataset_name, version_name):
+    """Obtient une version spécifique d'un dataset"""
+    await log_access(request)
+
+    try:
+        version = await DataLakeVersion.objects.aget(name=version_name)
+    except DataLakeVersion.DoesNotExist:
+        await sync_to_async(log_dataset_access)(
+            request.user,
+            dataset_name,
+            'version_check',
+            success=False,
+            error_message=f"Version {version_name} not found"
+        )
+        return await json_response({"error": f"Version {version_name} not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    error = await sync_to_async(views.check_version_access)(request.user, dataset_name, version)
+    if error is not None:
+        return await from_drf_response(error)
+
+    try:
+        window = TimeWindow.from_params(request.GET.get('from'), request.GET.get('to'))
+    except InvalidQuery as e:
+        return await json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if window is None:
+        data = await run_in_lake_executor(views.load_data_for_dataset, dataset_name, base_path=version.path)
+    else:
+        index = await sync_to_async(timeindex.get_time_index)(version.path, dataset_name)
+        data = await run_in_lake_executor(views.load_window_for_dataset, dataset_name, window, version.path, index=index)
+
+    await sync_to_async(log_dataset_access)(request.user, dataset_name, 'read', version=version, success=True)
+
+    return await json_response({
+        "version": version_name,
+        "dataset": dataset_name,
+        "data": data
+    })
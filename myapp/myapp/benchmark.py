@@ -0,0 +1,255 @@
+"""Banc d'essai des routes de l'API sur un data lake synthétique (commande ``benchmark_api``).
+
+- ``write_synthetic_lake`` écrit des datasets au schéma des transactions du
+  lake (``TRANSACTION_ID``, ``LOCATION``, ``DEVICE_INFO``...) : la masse dans
+  des segments compactés (ce qui permet d'aller jusqu'à des millions
+  d'enregistrements) et une queue de fichiers JSON unitaires comme ceux du
+  sink KSQL ;
+- ``populate_transactions`` remplit la table Transaction et les agrégats ;
+- ``route_cases`` associe à chaque route de ``myapp/urls.py`` les requêtes à
+  mesurer, et ``measure`` en tire les percentiles de latence et le débit.
+"""
+import gzip
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.urls import reverse
+from django.utils import timezone
+
+from . import codec, rollups, views
+from .lake import segments
+from .models import Transaction
+
+COUNTRIES = {
+    'India': ['Bangalore', 'Mumbai', 'Delhi'],
+    'Germany': ['Hamburg', 'Berlin', 'Munich'],
+    'France': ['Paris', 'Lyon', 'Marseille'],
+    'USA': ['New York', 'Chicago', 'Austin'],
+    'Japan': ['Tokyo', 'Osaka', 'Kyoto'],
+}
+PAYMENT_METHODS = ['credit_card', 'debit_card', 'paypal', 'bank_transfer', 'crypto']
+CATEGORIES = ['electronics', 'food', 'clothing', 'books', 'home', 'toys']
+STATUSES = ['completed', 'cancelled', 'pending', 'processing', 'failed']
+TRANSACTION_TYPES = ['purchase', 'refund', 'withdrawal', 'transfer']
+CURRENCIES = ['EUR', 'USD', 'AUD', 'INR', 'JPY']
+OSES = ['Linux', 'Windows', 'macOS', 'Android', 'iOS']
+BROWSERS = ['Chrome', 'Firefox', 'Edge', 'Safari']
+NAMES = ['Benjamin', 'Scarlett', 'Yanis', 'Amelia', 'Noah', 'Olivia', 'Liam', 'Emma']
+
+DEFAULT_DATASETS = ['TRANSACTIONS_COMPLETED', 'TRANSACTIONS_CANCELLED', 'TRANSACTIONS_PENDING']
+PERCENTILES = (50, 90, 95, 99)
+
+
+def synthetic_record(rng, index, now, status=None):
+    """Un enregistrement au schéma des fichiers TRANSACTIONS_* du lake"""
+    country = rng.choice(list(COUNTRIES))
+    city = rng.choice(COUNTRIES[country])
+    moment = now - timedelta(seconds=rng.randrange(24 * 3600))
+    amount = round(rng.uniform(1, 1000), 2)
+    return {
+        'TRANSACTION_ID': f'TXN-{index:010x}',
+        'TIMESTAMP': moment.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'USER_ID': f'USER-{rng.randrange(10000)}',
+        'USER_NAME': rng.choice(NAMES),
+        'PRODUCT_ID': f'PROD-{rng.randrange(1000)}',
+        'AMOUNT': amount,
+        'CURRENCY': rng.choice(CURRENCIES),
+        'TRANSACTION_TYPE': rng.choice(TRANSACTION_TYPES),
+        'STATUS': status or rng.choice(STATUSES),
+        'LOCATION': {'CITY': city, 'COUNTRY': country},
+        'PAYMENT_METHOD': rng.choice(PAYMENT_METHODS),
+        'PRODUCT_CATEGORY': rng.choice(CATEGORIES),
+        'QUANTITY': rng.randrange(1, 10),
+        'SHIPPING_ADDRESS': {
+            'STREET': f'{rng.randrange(1, 999)} Main St',
+            'ZIP': f'{rng.randrange(10000, 99999)}',
+            'CITY': city,
+            'COUNTRY': country,
+        },
+        'DEVICE_INFO': {
+            'OS': rng.choice(OSES),
+            'BROWSER': rng.choice(BROWSERS),
+            'IP_ADDRESS': '.'.join(str(rng.randrange(256)) for _ in range(4)),
+        },
+        'CUSTOMER_RATING': rng.choice([None, 1, 2, 3, 4, 5]),
+        'DISCOUNT_CODE': rng.choice([None, f'DISCOUNT-{rng.randrange(1000)}']),
+        'TAX_AMOUNT': round(amount * 0.15, 2),
+        'THREAD': rng.randrange(4),
+        'MESSAGE_NUMBER': index,
+        'TIMESTAMP_OF_RECEPTION_LOG': moment.strftime('%d/%m/%Y %H:%M:%S'),
+    }
+
+
+def _file_name(now, index):
+    # Même forme que les fichiers du sink : YYYYMMDD_HHMMSSffffff.json, croissants
+    return (now + timedelta(microseconds=index)).strftime('%Y%m%d_%H%M%S%f') + '.json'
+
+
+def write_synthetic_lake(base_path, records, datasets=None, segment_size=segments.DEFAULT_SEGMENT_SIZE,
+                         tail_files=100, seed=0):
+    """Écrit ``records`` enregistrements par dataset sous ``base_path``.
+
+    Tout est compacté en segments sauf les ``tail_files`` derniers
+    enregistrements, écrits un par fichier JSON (la queue non compactée).
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    datasets = datasets or DEFAULT_DATASETS
+    for dataset_name in datasets:
+        folder_path = os.path.join(base_path, dataset_name)
+        seg_dir = segments.segment_dir(folder_path)
+        os.makedirs(seg_dir, exist_ok=True)
+        status = dataset_name.rsplit('_', 1)[-1].lower() if dataset_name.startswith('TRANSACTIONS_') else None
+        compacted = max(0, records - tail_files)
+
+        manifest = {'version': segments.SEGMENT_FORMAT_VERSION, 'segments': []}
+        for segment_id, start in enumerate(range(0, compacted, segment_size), start=1):
+            stop = min(start + segment_size, compacted)
+            batch = [synthetic_record(rng, index, now, status) for index in range(start, stop)]
+            files = [_file_name(now, index) for index in range(start, stop)]
+            name = f'seg-{segment_id:06d}.json.gz'
+            segments.write_atomic(os.path.join(seg_dir, name),
+                                  segments.encode_segment(files, [1] * len(files), batch),
+                                  opener=gzip.open)
+            manifest['segments'].append({
+                'id': segment_id, 'name': name, 'files': files, 'counts': [1] * len(files),
+            })
+        segments.write_atomic(os.path.join(seg_dir, segments.MANIFEST_NAME), manifest)
+
+        for index in range(compacted, records):
+            with open(os.path.join(folder_path, _file_name(now, index)), 'wb') as f:
+                f.write(codec.dumps(synthetic_record(rng, index, now, status)))
+
+
+def populate_transactions(rows, batch_size=5000, seed=0):
+    """Remplit la table Transaction avec ``rows`` lignes synthétiques et recalcule les agrégats"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    batch = []
+    for index in range(rows):
+        record = synthetic_record(rng, index, now)
+        batch.append(Transaction(
+            transaction_id=record['TRANSACTION_ID'],
+            payment_method=record['PAYMENT_METHOD'],
+            country=record['LOCATION']['COUNTRY'],
+            product_category=record['PRODUCT_CATEGORY'],
+            status=record['STATUS'],
+            amount=Decimal(str(record['AMOUNT'])),
+            customer_rating=record['CUSTOMER_RATING'],
+            timestamp=now - timedelta(seconds=rng.randrange(24 * 3600)),
+            user_id=record['USER_ID'],
+            user_name=record['USER_NAME'],
+            product_id=record['PRODUCT_ID'],
+        ))
+        if len(batch) >= batch_size:
+            Transaction.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Transaction.objects.bulk_create(batch)
+    rollups.rebuild_rollups()
+
+
+def route_cases(dataset_name, version_name, transaction_pk, lake_records):
+    """Requêtes mesurées, par nom de route de ``myapp/urls.py`` : ``{route: [(cas, url, params, headers)]}``
+
+    ``lake_records`` est le nombre d'enregistrements parcourus par
+    ``retrieve_all`` (tous les datasets générés) : le cas ``last-page`` en
+    demande la dernière page, quelle que soit la taille du lake.
+    """
+    last_page = max(1, -(-lake_records // views.PAGE_SIZE))
+    dataset = {'dataset_name': dataset_name}
+    version = {'dataset_name': dataset_name, 'version_name': version_name}
+    return {
+        'api-root': [('root', reverse('api-root'), {}, {})],
+        'transaction-list': [
+            ('first-page', reverse('transaction-list'), {}, {}),
+            ('filtered-ordered', reverse('transaction-list'), {'status': 'completed', 'ordering': '-amount'}, {}),
+            ('no-count', reverse('transaction-list'), {'ordering': 'timestamp', 'count': 'none'}, {}),
+        ],
+        'transaction-detail': [('by-pk', reverse('transaction-detail', kwargs={'pk': transaction_pk}), {}, {})],
+        'access-right-list': [('list', reverse('access-right-list'), {}, {})],
+        'retrieve-all': [
+            ('first-page', reverse('retrieve-all'), {}, {}),
+            ('last-page', reverse('retrieve-all'), {'page': last_page}, {}),
+        ],
+        'retrieve-projection': [
+            ('first-page', reverse('retrieve-projection', kwargs=dataset), {}, {}),
+            ('fields-where', reverse('retrieve-projection', kwargs=dataset),
+             {'fields': 'TRANSACTION_ID,AMOUNT,LOCATION.COUNTRY', 'where': 'AMOUNT>=500'}, {}),
+        ],
+        'last-5-minutes-spent': [
+            ('5m', reverse('last-5-minutes-spent'), {}, {}),
+            ('24h', reverse('last-5-minutes-spent'), {'window': '24h'}, {}),
+        ],
+        'total-by-user': [('all', reverse('total-by-user'), {}, {})],
+        'top-products': [('top-10', reverse('top-products'), {'limit': 10}, {})],
+        'list-resources': [('all', reverse('list-resources'), {}, {})],
+        'lookup-lake-keys': [
+            ('transaction-id', reverse('lookup-lake-keys'), {'transaction_id': 'TXN-0000000000'}, {}),
+            ('user-id', reverse('lookup-lake-keys'), {'user_id': 'USER-42', 'limit': 10}, {}),
+        ],
+        'data-lake-cache-stats': [('stats', reverse('data-lake-cache-stats'), {}, {})],
+        'performance-metrics': [('prometheus', reverse('performance-metrics'), {}, {})],
+        'get-dataset-version': [('full', reverse('get-dataset-version', kwargs=version), {}, {})],
+        'export-dataset-version': [
+            ('ndjson', reverse('export-dataset-version', kwargs=version), {}, {}),
+            ('csv-gzip', reverse('export-dataset-version', kwargs=version), {'output': 'csv'},
+             {'HTTP_ACCEPT_ENCODING': 'gzip'}),
+        ],
+        'dataset-access-history': [('history', reverse('dataset-access-history', kwargs=dataset), {}, {})],
+        'full-text-search': [('query', reverse('full-text-search'), {'query': 'completed'}, {})],
+        'async-retrieve-all': [('first-page', reverse('async-retrieve-all'), {}, {})],
+        'async-retrieve-projection': [
+            ('fields-where', reverse('async-retrieve-projection', kwargs=dataset),
+             {'fields': 'TRANSACTION_ID,AMOUNT,LOCATION.COUNTRY', 'where': 'AMOUNT>=500'}, {}),
+        ],
+        'async-list-resources': [('all', reverse('async-list-resources'), {}, {})],
+        'async-get-dataset-version': [('full', reverse('async-get-dataset-version', kwargs=version), {}, {})],
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def measure(client, url, params=None, headers=None, iterations=20, warmup=2):
+    """Latences (ms) d'une requête GET répétée ; le corps des réponses en flux est consommé"""
+    headers = headers or {}
+
+    def call():
+        response = client.get(url, params or {}, **headers)
+        size = len(b''.join(response.streaming_content)) if response.streaming else len(response.content)
+        return response.status_code, size
+
+    for _ in range(warmup):
+        call()
+    latencies, statuses, size = [], {}, 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        status_code, size = call()
+        latencies.append((time.perf_counter() - begin) * 1000)
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'iterations': iterations,
+        'status_codes': statuses,
+        'response_bytes': size,
+        'mean_ms': statistics.fmean(latencies) if latencies else None,
+        'max_ms': latencies[-1] if latencies else None,
+        'throughput_rps': iterations / elapsed if elapsed else None,
+    }
+    for pct in PERCENTILES:
+        result[f'p{pct}_ms'] = percentile(latencies, pct)
+    return result
@@ -0,0 +1,124 @@
+"""Encodage/décodage JSON du lake et des réponses de l'API.
+
+Utilise orjson s'il est installé (analyse et sérialisation plusieurs fois
+plus rapides que le module ``json``), sinon la bibliothèque standard. Le
+choix peut être forcé avec le réglage ``JSON_CODEC`` (``'orjson'`` ou
+``'json'``) ; la commande ``benchmark_codec`` compare les deux sur les
+datasets ``TRANSACTIONS_*``.
+
+``dumps`` retourne toujours des ``bytes`` UTF-8 compacts. Les types que
+orjson ne connaît pas (Decimal, chaînes paresseuses...) sont convertis comme
+le fait l'encodeur de DRF. Une séquence ``LazyRecords`` placée dans un dict
+de premier niveau (``{"data": records}``) est encodée paquet par paquet, sans
+jamais construire la liste complète des enregistrements.
+"""
+import json
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import instrumentation
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    orjson = None
+
+
+class JSONCodec:
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonCodec(JSONCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        self._default = JSONEncoder().default
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj, default=self._default, option=orjson.OPT_UTC_Z)
+        except orjson.JSONEncodeError:
+            # Clés non textuelles, entiers de plus de 64 bits... : laisser faire le module json
+            return super().dumps(obj)
+
+
+class LazyRecords:
+    """Séquence d'enregistrements reconstruits à la demande (voir ``lake/mapped.py``).
+
+    Les sous-classes fournissent ``iter_batches()`` : des listes de dicts.
+    """
+
+    def iter_batches(self):
+        raise NotImplementedError
+
+
+CODECS = {'json': JSONCodec}
+if orjson is not None:
+    CODECS['orjson'] = OrjsonCodec
+
+_codec = None
+
+
+def get_codec():
+    global _codec
+    if _codec is None:
+        name = getattr(settings, 'JSON_CODEC', None) or ('orjson' if orjson is not None else 'json')
+        if name not in CODECS:
+            name = 'json'
+        _codec = CODECS[name]()
+    return _codec
+
+
+def loads(data):
+    return get_codec().loads(data)
+
+
+def dumps(obj):
+    if isinstance(obj, dict) and any(isinstance(value, LazyRecords) for value in obj.values()):
+        return _dumps_lazy(obj)
+    return get_codec().dumps(obj)
+
+
+def _dumps_lazy(obj):
+    """Dict dont certaines valeurs sont des ``LazyRecords``, encodées par paquets"""
+    current = get_codec()
+    parts = [b'{']
+    for position, (key, value) in enumerate(obj.items()):
+        if position:
+            parts.append(b',')
+        parts.append(current.dumps(str(key)) + b':')
+        if not isinstance(value, LazyRecords):
+            parts.append(current.dumps(value))
+            continue
+        parts.append(b'[')
+        first = True
+        for batch in value.iter_batches():
+            if not batch:
+                continue
+            if not first:
+                parts.append(b',')
+            parts.append(current.dumps(batch)[1:-1])
+            first = False
+        parts.append(b']')
+    parts.append(b'}')
+    return b''.join(parts)
+
+
+def load_file(file_path):
+    """Lit et décode un fichier JSON (lu en bytes, sans passer par un décodage texte)"""
+    with instrumentation.phase('io'):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    instrumentation.record_file(len(data))
+    with instrumentation.phase('parse'):
+        return loads(data)
@@ -36,6 +36,8 @@ class TransactionDocument(Document):
     product_id = Keyword()
     dataset_source = Keyword()  
     version = Keyword()  
+    # Fichier du lake d'origine, pour retirer les documents des fichiers supprimés
+    lake_file = Keyword()
 
     class Index:
         name = 'transactions'
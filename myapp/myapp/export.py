@@ -0,0 +1,144 @@
+"""Export en flux d'une version de dataset, en NDJSON ou en CSV.
+
+Les enregistrements sont lus paquet par paquet avec
+``DatasetPager.iter_records`` et écrits au fil de l'eau dans une
+``StreamingHttpResponse`` : la mémoire utilisée ne dépend pas de la taille du
+dataset et le premier octet part dès le premier paquet lu. En CSV, l'en-tête
+doit précéder les lignes : un premier parcours de la plage demandée collecte
+l'union des colonnes aplaties, puis un second écrit les lignes.
+
+La reprise d'un téléchargement interrompu se fait par position
+d'enregistrement, avec l'en-tête ``Range: records=<début>-[<fin>]`` (ou
+``?offset=``). La réponse est alors un 206 avec
+``Content-Range: records <début>-<fin>/<total>``.
+"""
+import csv
+import io
+import json
+import re
+import zlib
+
+from . import codec
+
+CHUNK_SIZE = 64 * 1024
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+RANGE_PATTERN = re.compile(r'^\s*records\s*=\s*(\d+)\s*-\s*(\d*)\s*$')
+
+
+class InvalidRange(ValueError):
+    pass
+
+
+def parse_range(header, offset_param, total):
+    """``(début, fin exclue, partiel ?)`` à partir de l'en-tête ``Range`` ou de ``?offset=``.
+
+    Sur un dataset vide, seule une plage commençant à 0 est acceptée (réponse
+    vide complète) ; toute autre position lève InvalidRange.
+    """
+    if header:
+        match = RANGE_PATTERN.match(header)
+        if not match:
+            raise InvalidRange(header)
+        start = int(match.group(1))
+        stop = int(match.group(2)) + 1 if match.group(2) else total
+        if match.group(2) and stop <= start:
+            raise InvalidRange(header)
+    elif offset_param is not None:
+        if not offset_param.isdigit():
+            raise InvalidRange(offset_param)
+        start, stop = int(offset_param), total
+    else:
+        return 0, total, False
+    if total == 0:
+        if start > 0:
+            raise InvalidRange(header or offset_param)
+        return 0, 0, False
+    if start >= total:
+        raise InvalidRange(header or offset_param)
+    return start, max(min(stop, total), start), True
+
+
+def flatten(record, prefix=''):
+    """Aplatit les objets imbriqués en colonnes pointées (``LOCATION.COUNTRY``)"""
+    row = {}
+    for key, value in record.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            row.update(flatten(value, prefix=f'{name}.'))
+        elif isinstance(value, list):
+            row[name] = json.dumps(value, ensure_ascii=False)
+        else:
+            row[name] = value
+    return row
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield codec.dumps(record) + b'\n'
+
+
+def csv_columns(records):
+    """Union des colonnes aplaties des enregistrements, dans l'ordre d'apparition"""
+    columns = {}
+    for record in records:
+        for name in flatten(record):
+            columns.setdefault(name, None)
+    return list(columns)
+
+
+def csv_lines(open_records):
+    """Lignes CSV ; ``open_records()`` est appelé deux fois (colonnes, puis lignes).
+
+    Un enregistrement qui aurait une colonne absente du premier parcours
+    (fichier réécrit entre les deux) lève ValueError plutôt que d'être tronqué.
+    """
+    columns = csv_columns(open_records())
+    if not columns:
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for record in open_records():
+        writer.writerow(flatten(record))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def chunked(lines, chunk_size=CHUNK_SIZE):
+    """Regroupe les lignes (str ou bytes) en blocs d'environ ``chunk_size`` octets"""
+    parts, size = [], 0
+    for line in lines:
+        data = line if isinstance(line, bytes) else line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(open_records, export_format, compress=False):
+    """Flux d'octets de l'export ; ``open_records()`` retourne un nouvel itérateur des enregistrements"""
+    lines = csv_lines(open_records) if export_format == 'csv' else ndjson_lines(open_records())
+    chunks = chunked(lines)
+    return gzipped(chunks) if compress else chunks
+
+
+def accepts_gzip(request):
+    encodings = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return any(part.split(';')[0].strip() == 'gzip' for part in encodings.split(','))
@@ -0,0 +1,428 @@
+"""Indexation en masse du data lake dans Elasticsearch.
+
+Les fichiers des datasets sont lus en parallèle par un pool de threads (la
+lecture disque libère le GIL) qui alimente une file bornée ; le thread
+principal envoie les documents par paquets avec ``helpers.streaming_bulk``.
+Le rafraîchissement de l'index est désactivé pendant le chargement puis
+rétabli à la valeur lue avant.
+
+Deux modes évitent de tout renvoyer à chaque exécution :
+
+- incrémental : la table ``IndexedFile`` garde la taille et le mtime de chaque
+  fichier indexé par version/dataset (pour un fichier compacté dont la source
+  a été supprimée, ceux du manifest ou de son segment), seuls les fichiers
+  nouveaux ou modifiés sont renvoyés. Les documents des fichiers qui ont
+  disparu du lake sont supprimés (champ ``lake_file``) ;
+- reconstruction : tout le lake est indexé dans un nouvel index horodaté,
+  puis l'alias ``transactions`` est basculé atomiquement dessus. Les
+  recherches continuent sur l'ancien index pendant toute la reconstruction ;
+  si des documents n'ont pas pu être indexés, l'alias n'est pas basculé et
+  le nouvel index incomplet est supprimé (``RebuildFailed``).
+
+Le client Elasticsearch est un paramètre : on peut passer un client factice
+(ou un ``Elasticsearch`` avec un transport mocké) pour tester sans serveur.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils import timezone
+
+from elasticsearch import helpers
+from elasticsearch_dsl.connections import connections
+
+from .documents import TransactionDocument
+from .ingestion import parse_timestamps
+from .lake import segments
+from .models import IndexedFile
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_WORKERS = 4
+QUEUE_SIZE = 10000
+# Fichiers par requête delete_by_query
+DELETE_BATCH_FILES = 500
+
+_DONE = object()
+
+
+class RebuildFailed(RuntimeError):
+    """Reconstruction abandonnée : des documents n'ont pas été indexés, l'alias n'a pas bougé"""
+
+    def __init__(self, new_index, stats):
+        super().__init__(f"{stats.errors} errors while indexing {new_index}; alias left unchanged")
+        self.new_index = new_index
+        self.stats = stats
+
+
+class IndexingStats:
+    def __init__(self):
+        self.indexed = 0
+        self.errors = 0
+        self.files = 0
+        self.files_read = []  # [(version, dataset_name, filename)]
+        self.failed_files = set()
+        self.by_dataset = {}
+        self.error_samples = []
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add_file(self, source, records):
+        version, dataset_name, _filename = source
+        key = f'{version.name}/{dataset_name}'
+        with self._lock:
+            self.files += 1
+            self.files_read.append(source)
+            self.by_dataset[key] = self.by_dataset.get(key, 0) + records
+
+    @property
+    def succeeded_files(self):
+        return [source for source in self.files_read if source not in self.failed_files]
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started_at
+
+    @property
+    def docs_per_second(self):
+        return self.indexed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.indexed} documents from {self.files} files in {self.elapsed:.2f}s "
+                f"({self.docs_per_second:.0f} docs/s, {self.errors} errors)")
+
+
+def index_name():
+    return TransactionDocument._index._name
+
+
+def build_actions(records, version_name, dataset_name, target_index, filename=''):
+    """Actions bulk pour un paquet d'enregistrements du lake (lus dans ``filename``)"""
+    timestamps = parse_timestamps([item.get('TIMESTAMP') for item in records])
+    actions = []
+    for item, timestamp in zip(records, timestamps):
+        actions.append({
+            '_index': target_index,
+            '_id': f"{version_name}_{dataset_name}_{item.get('TRANSACTION_ID', '')}",
+            '_source': {
+                'transaction_id': item.get('TRANSACTION_ID', ''),
+                'payment_method': item.get('PAYMENT_METHOD', ''),
+                'country': (item.get('LOCATION') or {}).get('COUNTRY', ''),
+                'product_category': item.get('PRODUCT_CATEGORY', ''),
+                'status': item.get('STATUS', ''),
+                'amount': float(item.get('AMOUNT', 0)),
+                'customer_rating': item.get('CUSTOMER_RATING', 0),
+                'timestamp': timestamp.isoformat() if timestamp else None,
+                'user_id': item.get('USER_ID', ''),
+                'user_name': item.get('USER_NAME', ''),
+                'product_id': item.get('PRODUCT_ID', ''),
+                'dataset_source': dataset_name,
+                'version': version_name,
+                'lake_file': filename,
+            },
+        })
+    return actions
+
+
+def list_datasets(versions):
+    """Couples ``(version, dataset_name)`` à indexer"""
+    tasks = []
+    for version in versions:
+        if not os.path.isdir(version.path):
+            continue
+        for dataset_name in sorted(os.listdir(version.path)):
+            if os.path.isdir(os.path.join(version.path, dataset_name)):
+                tasks.append((version, dataset_name))
+    return tasks
+
+
+def _read_dataset(version, dataset_name, target_index, out, stats, stop, entries=None):
+    folder_path = os.path.join(version.path, dataset_name)
+    for filename, records in segments.iter_entries(folder_path, entries):
+        if stop.is_set():
+            return
+        source = (version, dataset_name, filename)
+        stats.add_file(source, len(records))
+        for action in build_actions(records, version.name, dataset_name, target_index, filename):
+            out.put((source, action))
+
+
+def parallel_actions(tasks, target_index, stats, workers=DEFAULT_WORKERS, sources=None):
+    """Générateur d'actions bulk alimenté par ``workers`` threads de lecture.
+
+    ``tasks`` est une liste de ``(version, dataset_name)`` ou de
+    ``(version, dataset_name, entries)`` pour n'indexer que certains fichiers.
+    Si ``sources`` (un dict) est fourni, le fichier d'origine de chaque action
+    produite y est ajouté sous son ``_id`` jusqu'à réception du résultat.
+    """
+    out = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+
+    def run(task):
+        try:
+            _read_dataset(task[0], task[1], target_index, out, stats, stop, *task[2:])
+        except Exception as e:
+            with stats._lock:
+                stats.errors += 1
+                stats.error_samples.append(f'{task[0].name}/{task[1]}: {e}')
+
+    def produce():
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(run, tasks))
+        out.put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                break
+            source, action = item
+            if sources is not None:
+                sources.setdefault(action['_id'], deque()).append(source)
+            yield action
+    finally:
+        stop.set()
+        # Vider la file pour débloquer les lecteurs si le consommateur s'arrête en cours de route
+        while producer.is_alive():
+            try:
+                out.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def get_refresh_intervals(client, target_index):
+    """``{index concret: refresh_interval}`` ; None pour un index resté sur la valeur par défaut"""
+    response = client.indices.get_settings(index=target_index, name='index.refresh_interval')
+    return {
+        name: body.get('settings', {}).get('index', {}).get('refresh_interval')
+        for name, body in response.items()
+    }
+
+
+def set_refresh_interval(client, target_index, interval):
+    """Fixe ``refresh_interval`` (None rétablit la valeur par défaut d'Elasticsearch)"""
+    client.indices.put_settings(index=target_index, settings={'index': {'refresh_interval': interval}})
+
+
+def bulk_index(tasks, client=None, target_index=None, chunk_size=DEFAULT_CHUNK_SIZE,
+               workers=DEFAULT_WORKERS, max_retries=2):
+    """Indexe les datasets donnés avec l'API bulk et retourne un ``IndexingStats``"""
+    client = client or connections.get_connection()
+    target_index = target_index or index_name()
+    stats = IndexingStats()
+    # Fichier d'origine des actions en vol, pour rattacher chaque échec à son fichier
+    sources = {}
+
+    previous = get_refresh_intervals(client, target_index)
+    set_refresh_interval(client, target_index, '-1')
+    try:
+        for ok, info in helpers.streaming_bulk(
+            client,
+            parallel_actions(tasks, target_index, stats, workers=workers, sources=sources),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+            max_retries=max_retries,
+        ):
+            _op, result = next(iter(info.items()))
+            pending = sources.get(result.get('_id'))
+            source = pending.popleft() if pending else None
+            if pending is not None and not pending:
+                del sources[result.get('_id')]
+            if ok:
+                stats.indexed += 1
+            else:
+                stats.errors += 1
+                if source is not None:
+                    stats.failed_files.add(source)
+                if len(stats.error_samples) < 10:
+                    stats.error_samples.append(str(info))
+    finally:
+        for name, interval in previous.items():
+            set_refresh_interval(client, name, interval)
+        client.indices.refresh(index=target_index)
+
+    stats.stop()
+    return stats
+
+
+def _stamps(folder_path, entries):
+    """``{filename: (taille, mtime)}`` des entrées (voir ``segments.file_stamps``)"""
+    return {
+        filename: (size, mtime_ns / 1e9)
+        for filename, (size, mtime_ns) in segments.file_stamps(folder_path, entries).items()
+    }
+
+
+def changed_files(version, dataset_name):
+    """Entrées du dataset nouvelles ou modifiées depuis la dernière indexation"""
+    folder_path = os.path.join(version.path, dataset_name)
+    known = {
+        row.filename: (row.size, row.mtime)
+        for row in IndexedFile.objects.filter(version=version, dataset_name=dataset_name)
+    }
+    # Relevé complet : une source réécrite sur place doit être vue même si le dossier n'a pas bougé
+    entries = segments.list_entries(folder_path, fresh=True)
+    stamps = _stamps(folder_path, entries)
+    return [entry for entry in entries if entry[0] in stamps and known.get(entry[0]) != stamps[entry[0]]]
+
+
+def incremental_tasks(versions):
+    """Tâches d'indexation limitées aux fichiers changés ; les datasets inchangés sont omis"""
+    tasks = []
+    for version, dataset_name in list_datasets(versions):
+        entries = changed_files(version, dataset_name)
+        if entries:
+            tasks.append((version, dataset_name, entries))
+    return tasks
+
+
+def record_indexed_files(sources, reset=False):
+    """Enregistre dans ``IndexedFile`` les fichiers indexés sans erreur"""
+    if reset:
+        IndexedFile.objects.all().delete()
+    by_dataset = {}
+    for version, dataset_name, filename in sources:
+        by_dataset.setdefault((version, dataset_name), []).append(filename)
+    rows = []
+    for (version, dataset_name), filenames in by_dataset.items():
+        folder_path = os.path.join(version.path, dataset_name)
+        try:
+            stamps = _stamps(folder_path, segments.list_entries(folder_path))
+        except OSError:
+            continue
+        for filename in filenames:
+            if filename not in stamps:
+                continue
+            size, mtime = stamps[filename]
+            rows.append(IndexedFile(
+                version=version,
+                dataset_name=dataset_name,
+                filename=filename,
+                size=size,
+                mtime=mtime,
+            ))
+    IndexedFile.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['version', 'dataset_name', 'filename'],
+        update_fields=['size', 'mtime', 'indexed_at'],
+    )
+
+
+def removed_files(versions, dataset_name=None):
+    """Fichiers enregistrés dans ``IndexedFile`` qui ne sont plus dans le lake : ``[(version, dataset_name, filename)]``"""
+    removed = []
+    for version in versions:
+        rows = IndexedFile.objects.filter(version=version)
+        if dataset_name is not None:
+            rows = rows.filter(dataset_name=dataset_name)
+        listed = {}
+        for name, filename in rows.order_by('dataset_name', 'filename').values_list('dataset_name', 'filename'):
+            if name not in listed:
+                folder_path = os.path.join(version.path, name)
+                try:
+                    listed[name] = {entry[0] for entry in segments.list_entries(folder_path)}
+                except OSError:
+                    listed[name] = set()
+            if filename not in listed[name]:
+                removed.append((version, name, filename))
+    return removed
+
+
+def delete_removed_files(removed, client=None, target_index=None):
+    """Supprime de l'index les documents des fichiers ``removed`` puis leur ligne ``IndexedFile``.
+
+    Un document réécrit depuis par un autre fichier (même ``TRANSACTION_ID``)
+    appartient à ce fichier et est gardé. Retourne le nombre de documents supprimés.
+    """
+    client = client or connections.get_connection()
+    target_index = target_index or index_name()
+    by_dataset = {}
+    for version, dataset_name, filename in removed:
+        by_dataset.setdefault((version, dataset_name), []).append(filename)
+
+    deleted = 0
+    for (version, dataset_name), filenames in by_dataset.items():
+        for start in range(0, len(filenames), DELETE_BATCH_FILES):
+            batch = filenames[start:start + DELETE_BATCH_FILES]
+            response = client.delete_by_query(
+                index=target_index,
+                query={'bool': {'filter': [
+                    {'term': {'version': version.name}},
+                    {'term': {'dataset_source': dataset_name}},
+                    {'terms': {'lake_file': batch}},
+                ]}},
+                conflicts='proceed',
+                refresh=True,
+            )
+            deleted += response.get('deleted', 0)
+            IndexedFile.objects.filter(version=version, dataset_name=dataset_name, filename__in=batch).delete()
+    return deleted
+
+
+def ensure_index(client=None):
+    """Crée l'index (ou l'alias) de recherche s'il n'existe pas encore"""
+    client = client or connections.get_connection()
+    if not client.indices.exists(index=index_name()):
+        TransactionDocument.init(using=client)
+
+
+def alias_targets(client, alias):
+    """Index concrets derrière ``alias`` (vide si l'alias n'existe pas)"""
+    if not client.indices.exists_alias(name=alias):
+        return []
+    return sorted(client.indices.get_alias(name=alias).keys())
+
+
+def new_index_name(client, alias):
+    """Nom libre pour un nouvel index de ``alias`` : ``<alias>-<date à la microseconde>``"""
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+    name = f"{alias}-{stamp}"
+    suffix = 1
+    while client.indices.exists(index=name):
+        suffix += 1
+        name = f"{alias}-{stamp}-{suffix}"
+    return name
+
+
+def rebuild_index(tasks, client=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS, keep_old=False):
+    """Réindexe tout dans un nouvel index horodaté puis bascule l'alias dessus.
+
+    Retourne ``(nom du nouvel index, IndexingStats)``. Si un index concret
+    porte encore le nom de l'alias (ancienne installation), il est supprimé
+    dans la même opération atomique que la création de l'alias. Si des
+    documents ou des fichiers n'ont pas pu être indexés, le nouvel index est
+    supprimé, l'alias et les anciens index restent en place et
+    ``RebuildFailed`` est levée.
+    """
+    client = client or connections.get_connection()
+    alias = index_name()
+    new_index = new_index_name(client, alias)
+
+    TransactionDocument._index.clone(name=new_index).create(using=client)
+    try:
+        stats = bulk_index(tasks, client=client, target_index=new_index, chunk_size=chunk_size, workers=workers)
+    except BaseException:
+        client.indices.delete(index=new_index)
+        raise
+    if stats.errors:
+        client.indices.delete(index=new_index)
+        raise RebuildFailed(new_index, stats)
+
+    old_indices = alias_targets(client, alias)
+    actions = [{'add': {'index': new_index, 'alias': alias}}]
+    actions += [{'remove': {'index': name, 'alias': alias}} for name in old_indices]
+    if not old_indices and client.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    client.indices.update_aliases(actions=actions)
+
+    if not keep_old:
+        for name in old_indices:
+            client.indices.delete(index=name)
+
+    return new_index, stats
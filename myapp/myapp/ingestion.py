@@ -0,0 +1,228 @@
+"""Chargement en masse des transactions du data lake dans la table Transaction.
+
+L'import ne se fait plus à la première requête sur ``/myapp/transactions/`` :
+il est lancé par la commande ``ingest_transactions`` (ou en appelant
+``ingest_transactions`` directement). Les fichiers sont lus au fil de l'eau et
+les lignes sont insérées par paquets avec ``bulk_create``.
+
+L'import est incrémental : la table ``IngestedFile`` garde, par version du
+lake, la taille, le mtime et le SHA-256 de chaque fichier importé. Une
+nouvelle exécution ne relit que les fichiers nouveaux ou modifiés, et les
+lignes sont upsertées sur ``transaction_id`` : relancer l'import ne crée
+jamais de doublon. Les tables d'agrégats (``rollups.py``) sont mises à jour
+dans la même transaction que chaque paquet.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+
+from . import rollups
+from .lake import segments
+from .models import IngestedFile, Transaction
+
+DEFAULT_BATCH_SIZE = 1000
+TRANSACTIONS_DATASET = 'TRANSACTIONS_COMPLETED'
+
+
+class IngestionStats:
+    def __init__(self):
+        self.files = 0
+        self.skipped_files = 0
+        self.rows = 0
+        self.errors = 0
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started_at
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.rows} rows from {self.files} files in {self.elapsed:.2f}s "
+                f"({self.rows_per_second:.0f} rows/s, {self.skipped_files} unchanged files skipped, "
+                f"{self.errors} errors)")
+
+
+def parse_timestamps(values):
+    """Convertit un paquet de TIMESTAMP ISO 8601 (``...Z``) en datetimes UTC.
+
+    Les valeurs identiques ne sont converties qu'une fois ; une valeur absente
+    ou invalide donne None.
+    """
+    parsed = {}
+    result = []
+    for value in values:
+        if value not in parsed:
+            try:
+                moment = datetime.fromisoformat(value)
+                if moment.tzinfo is None:
+                    moment = moment.replace(tzinfo=dt_timezone.utc)
+                parsed[value] = moment
+            except (TypeError, ValueError):
+                parsed[value] = None
+        result.append(parsed[value])
+    return result
+
+
+def transaction_from_record(item, timestamp):
+    """Construit (sans l'enregistrer) une Transaction à partir d'un enregistrement du lake"""
+    location = item.get('LOCATION') or {}
+
+    customer_rating = item.get('CUSTOMER_RATING')
+    if customer_rating is None:
+        customer_rating = 0
+
+    return Transaction(
+        transaction_id=item.get('TRANSACTION_ID'),
+        payment_method=item.get('PAYMENT_METHOD', 'Unknown'),
+        country=location.get('COUNTRY', 'Unknown'),
+        product_category=item.get('PRODUCT_CATEGORY', 'Unknown'),
+        status=item.get('STATUS', 'Unknown'),
+        amount=float(item.get('AMOUNT', 0)),
+        customer_rating=customer_rating,
+        timestamp=timestamp or datetime.now(dt_timezone.utc),
+        user_id=item.get('USER_ID', 'Unknown'),
+        user_name=item.get('USER_NAME', 'Unknown'),
+        product_id=item.get('PRODUCT_ID', 'Unknown')
+    )
+
+
+def build_transactions(records, stats):
+    timestamps = parse_timestamps([item.get('TIMESTAMP') for item in records])
+    objects = {}
+    anonymous = []
+    for item, timestamp in zip(records, timestamps):
+        try:
+            obj = transaction_from_record(item, timestamp)
+        except Exception as e:
+            stats.errors += 1
+            print(f"Erreur lors de la création de la transaction: {str(e)}")
+            continue
+        if obj.transaction_id:
+            # Une même transaction présente deux fois dans le paquet : la dernière version gagne
+            objects[obj.transaction_id] = obj
+        else:
+            anonymous.append(obj)
+    return list(objects.values()) + anonymous
+
+
+UPSERT_FIELDS = [
+    'payment_method', 'country', 'product_category', 'status', 'amount',
+    'customer_rating', 'timestamp', 'user_id', 'user_name', 'product_id',
+]
+
+
+def upsert_transactions(objects, batch_size=DEFAULT_BATCH_SIZE):
+    return Transaction.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['transaction_id'],
+        update_fields=UPSERT_FIELDS,
+    )
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pending_files(version, dataset_name, folder_path):
+    """Retourne ``(entries, ledger)`` : les entrées du dataset à (ré)importer.
+
+    ``ledger`` associe chaque fichier à importer à un ``IngestedFile`` non
+    enregistré décrivant son état actuel. Un fichier dont la taille et le mtime
+    n'ont pas changé est ignoré sans être relu ; si seuls les métadonnées ont
+    changé mais pas le contenu (même SHA-256), seule la ligne du registre est
+    mise à jour.
+    """
+    known = {
+        row.filename: row
+        for row in IngestedFile.objects.filter(version=version, dataset_name=dataset_name)
+    }
+    entries = []
+    ledger = {}
+    touched = []
+    for entry in segments.list_entries(folder_path):
+        filename = entry[0]
+        file_path = os.path.join(folder_path, filename)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        previous = known.get(filename)
+        if previous is not None and previous.size == stat.st_size and previous.mtime == stat.st_mtime:
+            continue
+        sha256 = file_sha256(file_path)
+        if previous is not None and previous.sha256 == sha256:
+            previous.size, previous.mtime = stat.st_size, stat.st_mtime
+            touched.append(previous)
+            continue
+        entries.append(entry)
+        ledger[filename] = IngestedFile(
+            version=version,
+            dataset_name=dataset_name,
+            filename=filename,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            sha256=sha256,
+        )
+    if touched:
+        IngestedFile.objects.bulk_update(touched, ['size', 'mtime'])
+    return entries, ledger
+
+
+def ingest_transactions(version, dataset_name=TRANSACTIONS_DATASET, batch_size=DEFAULT_BATCH_SIZE):
+    """Importe les fichiers nouveaux ou modifiés d'un dataset d'une version du lake.
+
+    Chaque paquet de fichiers est importé dans sa propre transaction, avec ses
+    lignes de registre : une interruption ne perd que le paquet en cours, qui
+    sera repris à l'exécution suivante. Retourne un ``IngestionStats``.
+    """
+    stats = IngestionStats()
+    folder_path = os.path.join(version.path, dataset_name)
+    if not os.path.isdir(folder_path):
+        raise FileNotFoundError(f"Le dossier {dataset_name} n'existe pas dans {version.path}")
+
+    entries, ledger = pending_files(version, dataset_name, folder_path)
+    stats.skipped_files = len(segments.list_entries(folder_path)) - len(entries)
+
+    records, files = [], []
+
+    def flush():
+        objects = build_transactions(records, stats)
+        with transaction.atomic():
+            # Les agrégats lisent les anciennes valeurs : à faire avant l'upsert
+            rollups.apply_batch(objects)
+            upsert_transactions(objects, batch_size=batch_size)
+            IngestedFile.objects.bulk_create(
+                [ledger[filename] for filename in files],
+                update_conflicts=True,
+                unique_fields=['version', 'dataset_name', 'filename'],
+                update_fields=['size', 'mtime', 'sha256', 'rows', 'ingested_at'],
+            )
+        stats.rows += len(objects)
+        records.clear()
+        files.clear()
+
+    for filename, file_records in segments.iter_entries(folder_path, entries):
+        stats.files += 1
+        ledger[filename].rows = len(file_records)
+        records.extend(file_records)
+        files.append(filename)
+        if len(records) >= batch_size:
+            flush()
+    if files:
+        flush()
+
+    stats.stop()
+    return stats
@@ -0,0 +1,279 @@
+"""Mesures de performance par requête.
+
+``PerformanceMiddleware`` ouvre un profil pour chaque requête ; le code
+instrumenté y ajoute ses mesures :
+
+- ``phase(nom)`` chronomètre un bloc (``io`` et ``parse`` pour la lecture des
+  fichiers du lake, ``load`` pour ``load_data_for_dataset``, ``render`` pour
+  le rendu JSON, ``db`` pour les requêtes SQL, via un ``execute_wrapper``
+  posé sur chaque connexion à son ouverture) ;
+- ``record_file(octets)`` compte les fichiers ouverts et les octets lus.
+
+À la fin de la requête, le profil est renvoyé dans l'en-tête
+``Server-Timing`` et ajouté aux agrégats par route du processus, exposés au
+format texte de Prometheus par ``/myapp/metrics/``. Les agrégats sont propres à
+chaque processus (un par worker gunicorn).
+
+Les tâches confiées aux pools du lake (``lake/executor.py``) mesurent dans
+un profil enfant, fusionné dans celui de la requête quand elles se terminent
+(``run_in_child_profile``) : des tâches parallèles ne se masquent pas leurs
+phases, et une tâche abandonnée à l'échéance qui finit après la réponse
+n'écrit plus rien (le profil est fermé).
+
+Sans profil actif (commandes, threads de fond), les appels ne font rien.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+# Bornes (secondes) de l'histogramme des durées de requête
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # nom -> [secondes, appels]
+        self.queries = 0
+        self.files = 0
+        self.bytes_read = 0
+        self.closed = False
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, calls=1):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def count_query(self):
+        with self._lock:
+            self.queries += 1
+
+    def count_file(self, nbytes):
+        with self._lock:
+            self.files += 1
+            self.bytes_read += nbytes
+
+    def merge(self, child):
+        """Ajoute les mesures d'un profil enfant, sauf si la réponse est déjà partie"""
+        with self._lock:
+            if self.closed:
+                return
+            for name, (seconds, calls) in child.phases.items():
+                entry = self.phases.setdefault(name, [0.0, 0])
+                entry[0] += seconds
+                entry[1] += calls
+            self.queries += child.queries
+            self.files += child.files
+            self.bytes_read += child.bytes_read
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        metrics = [f'total;dur={total * 1000:.2f}']
+        for name, (seconds, calls) in self.phases.items():
+            desc = f'{self.queries} queries' if name == 'db' else f'{calls} calls'
+            metrics.append(f'{name};dur={seconds * 1000:.2f};desc="{desc}"')
+        metrics.append(f'files;desc="{self.files}"')
+        metrics.append(f'bytes;desc="{self.bytes_read}"')
+        return ', '.join(metrics)
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Chronomètre un bloc dans le profil de la requête en cours.
+
+    Une phase imbriquée dans elle-même (appels récursifs) n'est comptée qu'une fois.
+    """
+    profile = _current.get()
+    if profile is None or name in profile._active:
+        yield
+        return
+    profile._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile._active.discard(name)
+        profile.add(name, time.perf_counter() - started)
+
+
+def record_file(nbytes):
+    profile = _current.get()
+    if profile is not None:
+        profile.count_file(nbytes)
+
+
+def run_in_child_profile(func, *args, **kwargs):
+    """Exécute ``func`` avec son propre profil, fusionné dans celui de la requête à la fin.
+
+    À appeler dans une copie du contexte de la requête (thread d'un pool).
+    """
+    parent = _current.get()
+    if parent is None:
+        return func(*args, **kwargs)
+    child = RequestProfile()
+    token = _current.set(child)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _current.reset(token)
+        parent.merge(child)
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    profile.count_query()
+    with phase('db'):
+        return execute(sql, params, many, context)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Receiver de ``connection_created`` : les connexions sont propres à chaque thread,
+    y compris ceux de ``sync_to_async`` qu'utilisent les vues async
+    """
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_wrapper)
+
+
+class Metrics:
+    """Agrégats par ``(route, méthode)`` depuis le démarrage du processus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (route, méthode, statut) -> nombre
+        self.durations = {}  # (route, méthode) -> [compteurs par borne..., somme, nombre]
+        self.phases = {}  # (route, phase) -> secondes
+        self.queries = {}
+        self.files = {}
+        self.bytes_read = {}
+
+    def observe(self, route, method, status_code, total, profile):
+        with self._lock:
+            key = (route, method, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault((route, method), [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    histogram[index] += 1
+            histogram[-2] += total
+            histogram[-1] += 1
+            for name, (seconds, _calls) in profile.phases.items():
+                self.phases[(route, name)] = self.phases.get((route, name), 0.0) + seconds
+            self.queries[route] = self.queries.get(route, 0) + profile.queries
+            self.files[route] = self.files.get(route, 0) + profile.files
+            self.bytes_read[route] = self.bytes_read.get(route, 0) + profile.bytes_read
+
+    def render(self):
+        """Texte au format d'exposition de Prometheus"""
+        def labels(**values):
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in values.values())
+            return '{' + ','.join(f'{k}="{v}"' for k, v in zip(values, escaped)) + '}'
+
+        lines = []
+        with self._lock:
+            lines += ['# HELP myapp_requests_total Requests handled.', '# TYPE myapp_requests_total counter']
+            for (route, method, code), count in sorted(self.requests.items()):
+                lines.append(f'myapp_requests_total{labels(route=route, method=method, status=code)} {count}')
+
+            lines += ['# HELP myapp_request_duration_seconds Request duration.',
+                      '# TYPE myapp_request_duration_seconds histogram']
+            for (route, method), histogram in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f'myapp_request_duration_seconds_bucket{labels(route=route, method=method, le=bound)} {count}')
+                lines.append(f'myapp_request_duration_seconds_bucket{labels(route=route, method=method, le="+Inf")} {histogram[-1]}')
+                lines.append(f'myapp_request_duration_seconds_sum{labels(route=route, method=method)} {histogram[-2]:.6f}')
+                lines.append(f'myapp_request_duration_seconds_count{labels(route=route, method=method)} {histogram[-1]}')
+
+            lines += ['# HELP myapp_phase_seconds_total Time spent per phase (io, parse, load, db, render).',
+                      '# TYPE myapp_phase_seconds_total counter']
+            for (route, name), seconds in sorted(self.phases.items()):
+                lines.append(f'myapp_phase_seconds_total{labels(route=route, phase=name)} {seconds:.6f}')
+
+            for metric, help_text, values in (
+                ('myapp_db_queries_total', 'SQL queries executed.', self.queries),
+                ('myapp_lake_files_opened_total', 'Data lake files opened.', self.files),
+                ('myapp_lake_bytes_read_total', 'Bytes read from data lake files.', self.bytes_read),
+            ):
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+                for route, value in sorted(values.items()):
+                    lines.append(f'{metric}{labels(route=route)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route or match.view_name or 'unmatched'
+
+
+class PerformanceMiddleware:
+    """Compatible WSGI et ASGI : sous ASGI, les vues async ne repassent pas par un thread"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'PERF_INSTRUMENTATION', True):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'PERF_INSTRUMENTATION', True):
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, profile)
+
+    def _finish(self, request, response, profile):
+        profile.close()
+        total = profile.elapsed()
+        if getattr(settings, 'PERF_SERVER_TIMING', True):
+            response['Server-Timing'] = profile.server_timing(total)
+        _metrics.observe(route_of(request), request.method, response.status_code, total, profile)
+        return response
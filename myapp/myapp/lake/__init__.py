@@ -0,0 +1 @@
+"""Couche de stockage du data lake (segments compactés, lecture des datasets)."""
@@ -0,0 +1,260 @@
+"""Cache en mémoire des datasets du data lake, partagé par tout le processus.
+
+Les datasets sont indexés par ``(chemin de la version, nom du dataset)``. Une
+entrée est revalidée à chaque accès avec le mtime du dossier du dataset : tant
+qu'il ne change pas, aucune lecture disque n'est faite. Quand il change, seuls
+les fichiers arrivés depuis le dernier chargement sont lus et ajoutés. Les
+entrées les moins récemment utilisées sont évincées dès que la taille estimée
+du cache dépasse ``DATA_LAKE_CACHE_MAX_BYTES``.
+
+Un dataset qui a un fichier projeté (``mapped.py``, commande ``map_lake``)
+est servi depuis ce fichier au lieu d'une liste de dicts : ses colonnes
+restent dans le cache de pages du système, partagé par tous les workers, et
+seuls les fichiers arrivés depuis la construction du fichier sont gardés en
+dicts (et comptés dans la taille du cache). Le fichier n'est utilisé que si
+aucune de ses sources n'a été réécrite (``mapped.covers``), et une entrée est
+rechargée dès qu'il est reconstruit (watcher ou ``map_lake``), ce qui vide
+ces dicts.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import mapped, segments
+from .segments import MTIME_GRANULARITY
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SIZE_SAMPLE = 20
+
+
+def _deep_sizeof(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + _deep_sizeof(item)
+    elif isinstance(value, list):
+        for item in value:
+            size += _deep_sizeof(item)
+    return size
+
+
+def estimate_size(records):
+    """Estimation de l'empreinte mémoire d'une liste d'enregistrements"""
+    if not records:
+        return sys.getsizeof(records)
+    step = max(1, len(records) // _SIZE_SAMPLE)
+    sample = records[::step][:_SIZE_SAMPLE]
+    average = sum(_deep_sizeof(record) for record in sample) / len(sample)
+    return int(sys.getsizeof(records) + average * len(records))
+
+
+class CachedDataset:
+    def __init__(self, folder_path, mtime_ns):
+        self.folder_path = folder_path
+        self.mtime_ns = mtime_ns
+        self.checked_at = time.time()
+        self.records = []
+        self.files = []  # [(filename, count)] dans l'ordre de chargement
+        self.filenames = set()
+        self.nbytes = 0
+
+    @property
+    def count(self):
+        return len(self.records)
+
+    @property
+    def is_mapped(self):
+        return isinstance(self.records, mapped.MappedRecords)
+
+    def attach(self, store):
+        """Sert les fichiers couverts par ``store`` (un ``MappedStore``) depuis le fichier projeté"""
+        self.records = mapped.MappedRecords(store, self.records)
+        self.files = list(store.files) + self.files
+        self.filenames.update(filename for filename, _count in store.files)
+        self._measure()
+
+    def add(self, loaded):
+        for filename, records in loaded:
+            self.files.append((filename, len(records)))
+            self.filenames.add(filename)
+            self.records.extend(records)
+        self._measure()
+
+    def _measure(self):
+        if self.is_mapped:
+            # Les colonnes projetées ne sont pas dans la mémoire propre du processus
+            self.nbytes = self.records.store.header_bytes + estimate_size(self.records.extra)
+        else:
+            self.nbytes = estimate_size(self.records)
+
+
+class DatasetCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.incremental_loads = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def get_entry(self, base_path, dataset_name):
+        """Retourne le ``CachedDataset`` à jour, ou None si le dataset n'existe pas"""
+        folder_path = os.path.join(base_path, dataset_name)
+        try:
+            stat = os.stat(folder_path)
+        except OSError:
+            self.invalidate(base_path, dataset_name)
+            return None
+        if not os.path.isdir(folder_path):
+            return None
+
+        key = (base_path, dataset_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry, stat):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if entry is not None:
+            entry = self._refresh(entry, stat)
+        else:
+            entry = self._load(folder_path, stat.st_mtime_ns, segments.list_entries(folder_path))
+            with self._lock:
+                self.misses += 1
+
+        self._store(key, entry)
+        return entry
+
+    def peek(self, base_path, dataset_name):
+        """Retourne l'entrée en cache si elle est à jour, sans jamais charger le dataset"""
+        try:
+            stat = os.stat(os.path.join(base_path, dataset_name))
+        except OSError:
+            return None
+        key = (base_path, dataset_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(entry, stat):
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get(self, base_path, dataset_name):
+        """Retourne les enregistrements du dataset (à ne pas modifier).
+
+        Une liste, ou pour un dataset projeté une séquence ``MappedRecords`` :
+        ``codec.dumps`` l'encode par paquets sans la matérialiser.
+        """
+        entry = self.get_entry(base_path, dataset_name)
+        return entry.records if entry is not None else None
+
+    def _load(self, folder_path, mtime_ns, entries):
+        """Chargement complet : fichier projeté s'il ne couvre que des fichiers encore présents, puis le reste"""
+        entry = CachedDataset(folder_path, mtime_ns)
+        store = mapped.open_store(folder_path)
+        if store is not None and mapped.covers(store, folder_path, entries):
+            entry.attach(store)
+            entries = [item for item in entries if item[0] not in entry.filenames]
+        entry.add(segments.read_entries(folder_path, entries))
+        return entry
+
+    def _is_fresh(self, entry, stat):
+        if stat.st_mtime_ns != entry.mtime_ns:
+            return False
+        if entry.is_mapped and mapped.store_stamp(entry.folder_path) != entry.records.store.stamp:
+            # Fichier projeté reconstruit ou supprimé depuis le chargement
+            return False
+        # mtime identique : fiable seulement si le dossier n'a pas bougé juste avant la dernière vérification
+        return entry.checked_at - stat.st_mtime > MTIME_GRANULARITY
+
+    def _refresh(self, entry, stat):
+        entries = segments.list_entries(entry.folder_path)
+        current = {filename for filename, _segment, _count in entries}
+
+        store_changed = entry.is_mapped and mapped.store_stamp(entry.folder_path) != entry.records.store.stamp
+        if store_changed or not entry.filenames <= current:
+            # Des fichiers ont disparu, ou le fichier projeté a changé : rechargement complet
+            fresh = self._load(entry.folder_path, stat.st_mtime_ns, entries)
+            with self._lock:
+                self.misses += 1
+            return fresh
+
+        new_entries = [item for item in entries if item[0] not in entry.filenames]
+        # Copie : les appelants peuvent encore parcourir l'ancienne liste
+        refreshed = CachedDataset(entry.folder_path, stat.st_mtime_ns)
+        refreshed.records = entry.records.copy()
+        refreshed.files = list(entry.files)
+        refreshed.filenames = set(entry.filenames)
+        if new_entries:
+            refreshed.add(segments.read_entries(entry.folder_path, new_entries))
+        else:
+            refreshed.nbytes = entry.nbytes
+        with self._lock:
+            if new_entries:
+                self.incremental_loads += 1
+            else:
+                self.hits += 1
+        return refreshed
+
+    def _store(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            if entry.nbytes > self.max_bytes:
+                # Dataset plus gros que tout le budget : servi sans être gardé en cache
+                return
+            self._entries[key] = entry
+            self.bytes += entry.nbytes
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _key, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, base_path=None, dataset_name=None):
+        """Invalide un dataset, tous les datasets d'une version, ou tout le cache"""
+        with self._lock:
+            for key in list(self._entries):
+                if base_path is not None and key[0] != base_path:
+                    continue
+                if dataset_name is not None and key[1] != dataset_name:
+                    continue
+                self.bytes -= self._entries.pop(key).nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'incremental_loads': self.incremental_loads,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'mapped_entries': sum(1 for entry in self._entries.values() if entry.is_mapped),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_dataset_cache = None
+_dataset_cache_lock = threading.Lock()
+
+
+def get_dataset_cache():
+    """Instance unique du cache pour le processus, dimensionnée par les settings"""
+    global _dataset_cache
+    if _dataset_cache is None:
+        with _dataset_cache_lock:
+            if _dataset_cache is None:
+                _dataset_cache = DatasetCache(
+                    max_bytes=getattr(settings, 'DATA_LAKE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+                )
+    return _dataset_cache
@@ -0,0 +1,214 @@
+"""Catalogue des métadonnées du data lake (tables ``CatalogDataset`` et ``CatalogFile``).
+
+Pour chaque version et chaque dataset, le catalogue garde la liste des
+fichiers avec leur nombre d'enregistrements, leur taille, la plage de
+``TIMESTAMP`` de leurs enregistrements et l'empreinte de leur schéma (liste
+triée des champs de premier niveau), ainsi que les totaux du dataset. Les
+listings (``/myapp/data_lake/resources/``) deviennent une simple requête
+SQL, sans ``os.listdir`` à chaque appel.
+
+Le catalogue est tenu à jour par ``scan_version`` (commande ``scan_lake``) :
+le scan est incrémental comme l'import, seuls les fichiers dont la taille ou
+le mtime a changé sont relus ; les fichiers et datasets disparus sont retirés.
+"""
+import hashlib
+import os
+import time
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+
+from ..ingestion import parse_timestamps
+from ..models import CatalogDataset, CatalogFile
+from . import segments
+
+
+class ScanStats:
+    def __init__(self):
+        self.datasets = 0
+        self.files = 0
+        self.read_files = 0
+        self.removed_files = 0
+        self.removed_datasets = 0
+        self.records = 0
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def __str__(self):
+        return (f"{self.datasets} datasets, {self.files} files ({self.read_files} read, "
+                f"{self.removed_files} removed), {self.records} records in {self.elapsed:.2f}s")
+
+
+def schema_fingerprint(fields):
+    return hashlib.sha256(','.join(fields).encode('utf-8')).hexdigest()[:16]
+
+
+def describe(records):
+    """``(nombre, TIMESTAMP min, TIMESTAMP max, champs triés)`` d'une liste d'enregistrements"""
+    fields = set()
+    for record in records:
+        fields.update(record)
+    timestamps = [moment for moment in parse_timestamps([record.get('TIMESTAMP') for record in records]) if moment]
+    return (
+        len(records),
+        min(timestamps) if timestamps else None,
+        max(timestamps) if timestamps else None,
+        sorted(fields),
+    )
+
+
+def _stat(file_path):
+    # Les fichiers compactés dont la source a été supprimée n'ont plus de taille
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return 0, 0.0
+    return stat.st_size, stat.st_mtime
+
+
+def scan_dataset(version, dataset_name, rebuild=False, stats=None):
+    """Met à jour le catalogue d'un dataset ; retourne son ``CatalogDataset``"""
+    stats = stats or ScanStats()
+    folder_path = os.path.join(version.path, dataset_name)
+    known = {
+        row.filename: row
+        for row in CatalogFile.objects.filter(version=version, dataset_name=dataset_name)
+    }
+
+    entries = segments.list_entries(folder_path)
+    pending, fresh, moved = [], {}, []
+    for entry in entries:
+        filename, segment_name, _count = entry
+        size, mtime = _stat(os.path.join(folder_path, filename))
+        previous = known.get(filename)
+        if not rebuild and previous is not None and previous.size == size and previous.mtime == mtime:
+            # Fichier inchangé : seul son segment a pu changer (compaction)
+            if previous.segment_name != (segment_name or ''):
+                previous.segment_name = segment_name or ''
+                moved.append(previous)
+            continue
+        pending.append(entry)
+        fresh[filename] = CatalogFile(
+            version=version, dataset_name=dataset_name, filename=filename,
+            segment_name=segment_name or '', size=size, mtime=mtime,
+        )
+
+    schemas = {}
+    rows = []
+    for filename, records in segments.iter_entries(folder_path, pending):
+        row = fresh[filename]
+        row.records, row.min_timestamp, row.max_timestamp, fields = describe(records)
+        row.schema_fingerprint = schema_fingerprint(fields)
+        schemas[row.schema_fingerprint] = fields
+        rows.append(row)
+        stats.read_files += 1
+
+    present = {entry[0] for entry in entries}
+    removed = [filename for filename in known if filename not in present]
+
+    with transaction.atomic():
+        if removed:
+            CatalogFile.objects.filter(version=version, dataset_name=dataset_name, filename__in=removed).delete()
+        if moved:
+            CatalogFile.objects.bulk_update(moved, ['segment_name'])
+        CatalogFile.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['version', 'dataset_name', 'filename'],
+            update_fields=['segment_name', 'size', 'mtime', 'records', 'min_timestamp', 'max_timestamp', 'schema_fingerprint'],
+        )
+        dataset = refresh_dataset(version, dataset_name, schemas)
+
+    stats.datasets += 1
+    stats.files += dataset.files
+    stats.records += dataset.records
+    stats.removed_files += len(removed)
+    return dataset
+
+
+def refresh_dataset(version, dataset_name, new_schemas=None):
+    """Recalcule les totaux d'un dataset à partir de ses ``CatalogFile``"""
+    files = CatalogFile.objects.filter(version=version, dataset_name=dataset_name)
+    totals = files.aggregate(
+        files=Count('id'), records=Sum('records'), size=Sum('size'),
+        min_timestamp=Min('min_timestamp'), max_timestamp=Max('max_timestamp'),
+    )
+    dataset, _created = CatalogDataset.objects.get_or_create(version=version, dataset_name=dataset_name)
+
+    # Schémas encore utilisés par au moins un fichier, et empreinte de leur union
+    used = set(files.values_list('schema_fingerprint', flat=True).distinct())
+    schemas = {**dataset.schemas, **(new_schemas or {})}
+    dataset.schemas = {fingerprint: fields for fingerprint, fields in schemas.items() if fingerprint in used}
+    union = sorted({field for fields in dataset.schemas.values() for field in fields})
+
+    dataset.files = totals['files']
+    dataset.records = totals['records'] or 0
+    dataset.size = totals['size'] or 0
+    dataset.min_timestamp = totals['min_timestamp']
+    dataset.max_timestamp = totals['max_timestamp']
+    dataset.schema_fingerprint = schema_fingerprint(union) if union else ''
+    dataset.save()
+    return dataset
+
+
+def scan_version(version, dataset_names=None, rebuild=False):
+    """Met à jour le catalogue d'une version (tous ses datasets, ou ``dataset_names``).
+
+    Les datasets qui n'existent plus sont retirés du catalogue. Retourne un
+    ``ScanStats`` ; lève FileNotFoundError si le dossier de la version n'existe
+    pas (son catalogue est alors vidé).
+    """
+    stats = ScanStats()
+    if not os.path.isdir(version.path):
+        forget(version)
+        raise FileNotFoundError(f"Le dossier {version.path} de la version {version.name} n'existe pas")
+
+    present = sorted(
+        item for item in os.listdir(version.path)
+        if os.path.isdir(os.path.join(version.path, item))
+    )
+    if dataset_names is None:
+        stats.removed_datasets = forget(version, exclude=present)
+        targets = present
+    else:
+        missing = [name for name in dataset_names if name not in present]
+        if missing:
+            stats.removed_datasets = forget(version, dataset_names=missing)
+        targets = [name for name in dataset_names if name in present]
+
+    for dataset_name in targets:
+        scan_dataset(version, dataset_name, rebuild=rebuild, stats=stats)
+    stats.stop()
+    return stats
+
+
+def forget(version, dataset_names=None, exclude=None):
+    """Retire du catalogue des datasets d'une version ; retourne le nombre de datasets retirés"""
+    datasets = CatalogDataset.objects.filter(version=version)
+    files = CatalogFile.objects.filter(version=version)
+    if dataset_names is not None:
+        datasets = datasets.filter(dataset_name__in=dataset_names)
+        files = files.filter(dataset_name__in=dataset_names)
+    if exclude is not None:
+        datasets = datasets.exclude(dataset_name__in=exclude)
+        files = files.exclude(dataset_name__in=exclude)
+    with transaction.atomic():
+        files.delete()
+        removed, _details = datasets.delete()
+    return removed
+
+
+def dataset_summary(dataset):
+    return {
+        'files': dataset.files,
+        'records': dataset.records,
+        'size': dataset.size,
+        'min_timestamp': dataset.min_timestamp,
+        'max_timestamp': dataset.max_timestamp,
+        'schema_fingerprint': dataset.schema_fingerprint,
+        'scanned_at': dataset.scanned_at,
+    }
@@ -0,0 +1,72 @@
+"""Pool de threads borné pour les lectures bloquantes du lake depuis les vues async.
+
+Les vues de ``async_views.py`` ne lisent jamais le disque dans la boucle
+d'événements : chaque lecture (listage d'un dossier, chargement d'un dataset,
+page d'un ``DatasetPager``) est confiée à ce pool de ``LAKE_IO_WORKERS``
+threads, partagé par tout le processus. Un worker ASGI sert ainsi de
+nombreuses requêtes en parallèle sans ouvrir plus de fichiers à la fois que
+le pool ne le permet.
+
+L'ouverture en parallèle des datasets de ``retrieve_all`` (voir
+``fanout.py``) a son propre pool de ``LAKE_FANOUT_WORKERS`` threads : une
+ouverture lente, abandonnée à l'échéance de la requête, continue sans
+occuper le pool des lectures async.
+
+Le contexte (``contextvars``) de l'appelant est copié dans le thread, et
+chaque tâche mesure dans un profil enfant fusionné dans celui de la requête
+(``instrumentation.run_in_child_profile``).
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from ..instrumentation import run_in_child_profile
+
+DEFAULT_WORKERS = 8
+DEFAULT_FANOUT_WORKERS = 4
+
+# Pools du processus : {nom: (setting, défaut)}
+POOLS = {
+    'lake-io': ('LAKE_IO_WORKERS', DEFAULT_WORKERS),
+    'lake-fanout': ('LAKE_FANOUT_WORKERS', DEFAULT_FANOUT_WORKERS),
+}
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def get_lake_executor(name='lake-io'):
+    """Instance unique du pool ``name`` pour le processus, dimensionnée par les settings"""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                setting, default = POOLS[name]
+                executor = _executors[name] = ThreadPoolExecutor(
+                    max_workers=getattr(settings, setting, default),
+                    thread_name_prefix=name
+                )
+    return executor
+
+
+def submit_to_lake_executor(func, *args, pool='lake-io', **kwargs):
+    """Soumet ``func(*args, **kwargs)`` au pool depuis du code synchrone ; retourne un Future"""
+    context = contextvars.copy_context()
+    return get_lake_executor(pool).submit(context.run, run_in_child_profile, func, *args, **kwargs)
+
+
+async def run_in_lake_executor(func, *args, pool='lake-io', **kwargs):
+    """Exécute ``func(*args, **kwargs)`` dans le pool et attend son résultat"""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, run_in_child_profile, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_lake_executor(pool), call)
+
+
+async def gather_in_lake_executor(func, items):
+    """``[func(item) for item in items]`` en parallèle dans le pool, dans l'ordre de ``items``"""
+    return await asyncio.gather(*(run_in_lake_executor(func, item) for item in items))
@@ -0,0 +1,98 @@
+"""Ouverture en parallèle des datasets d'une requête multi-datasets (``retrieve_all``).
+
+Ouvrir un ``DatasetPager`` liste le dossier, lit le manifest des segments et
+compte les enregistrements des fichiers non compactés : c'est l'essentiel du
+coût de ``retrieve_all`` quand un dataset n'est pas en cache. Les datasets
+sont donc ouverts en même temps dans le pool ``lake-fanout`` de
+``executor.py`` (les lectures de fichiers libèrent le GIL), puis remis dans
+l'ordre demandé, quel que soit l'ordre dans lequel ils ont fini.
+
+La requête a une échéance (``LAKE_FANOUT_DEADLINE``) : un dataset qui n'est
+pas ouvert à temps est laissé de côté et renvoyé dans ``skipped``. Les
+ouvertures pas encore commencées sont annulées ; celles en cours continuent
+en arrière-plan dans le pool dédié (sans bloquer les lectures des vues async)
+et remplissent les mémos de comptage, si bien qu'une requête suivante trouve
+en général le dataset prêt. Leurs mesures ne sont plus rattachées à la
+requête une fois la réponse partie.
+
+Un dataset dont l'ouverture échoue (segment ou fichier illisible) est lui
+aussi renvoyé dans ``skipped`` : les autres datasets restent servis.
+"""
+import asyncio
+import os
+from concurrent.futures import wait
+
+from django.conf import settings
+
+from .executor import run_in_lake_executor, submit_to_lake_executor
+from .paging import DatasetPager
+
+DEFAULT_DEADLINE = 5.0  # secondes
+FANOUT_POOL = 'lake-fanout'
+_FAILED = object()
+
+
+def fanout_deadline():
+    """Échéance en secondes, None pour attendre tous les datasets"""
+    return getattr(settings, 'LAKE_FANOUT_DEADLINE', DEFAULT_DEADLINE)
+
+
+def open_pager(base_path, dataset_name):
+    """``DatasetPager`` du dataset, ou None si son dossier n'existe pas"""
+    if not os.path.isdir(os.path.join(base_path, dataset_name)):
+        return None
+    return DatasetPager(base_path, dataset_name)
+
+
+def _outcome(dataset_name, future):
+    """Résultat d'une ouverture terminée ; une erreur écarte le dataset au lieu de faire échouer la requête"""
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Erreur lors de l'ouverture du dataset {dataset_name}: {str(e)}")
+        return _FAILED
+
+
+def _collect(dataset_names, outcomes):
+    """``(pagers, skipped)`` dans l'ordre de ``dataset_names``.
+
+    ``outcomes`` associe à chaque dataset terminé son pager (None si le
+    dossier n'existe pas, ``_FAILED`` si l'ouverture a échoué) ; les absents
+    sont ceux que l'échéance a écartés.
+    """
+    pagers, skipped = [], []
+    for dataset_name in dataset_names:
+        if dataset_name not in outcomes or outcomes[dataset_name] is _FAILED:
+            skipped.append(dataset_name)
+        elif outcomes[dataset_name] is not None:
+            pagers.append(outcomes[dataset_name])
+    return pagers, skipped
+
+
+def open_pagers(base_path, dataset_names, deadline=None):
+    """Ouvre les datasets en parallèle ; retourne ``(pagers, datasets écartés par l'échéance ou en erreur)``"""
+    if deadline is None:
+        deadline = fanout_deadline()
+    futures = {
+        submit_to_lake_executor(open_pager, base_path, dataset_name, pool=FANOUT_POOL): dataset_name
+        for dataset_name in dataset_names
+    }
+    done, pending = wait(futures, timeout=deadline)
+    for future in pending:
+        future.cancel()
+    return _collect(dataset_names, {futures[future]: _outcome(futures[future], future) for future in done})
+
+
+async def aopen_pagers(base_path, dataset_names, deadline=None):
+    """Équivalent async de ``open_pagers``, pour ``async_views``"""
+    if deadline is None:
+        deadline = fanout_deadline()
+    tasks = {
+        asyncio.ensure_future(run_in_lake_executor(open_pager, base_path, dataset_name, pool=FANOUT_POOL)): dataset_name
+        for dataset_name in dataset_names
+    }
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        # Annule l'ouverture si elle n'a pas encore commencé dans le pool
+        task.cancel()
+    return _collect(dataset_names, {tasks[task]: _outcome(tasks[task], task) for task in done})
@@ -0,0 +1,303 @@
+"""Index secondaire des clés du data lake (tables ``LakeKey`` et ``KeyIndexedFile``).
+
+Chaque enregistrement est indexé par ses ``TRANSACTION_ID``, ``USER_ID`` et
+``PRODUCT_ID`` : une ligne ``LakeKey`` donne la version, le dataset, le
+fichier et la position de l'enregistrement dans ce fichier. L'index B-tree
+``(field, value)`` résout une clé en O(log n) ; seul le fichier qui contient
+l'enregistrement est ensuite lu, sans charger le dataset ni passer par
+Elasticsearch.
+
+Pour un fichier compacté dont la source a été supprimée, l'enregistrement
+est lu dans le fichier projeté du dataset (``lake/mapped.py``) s'il le
+couvre : seule sa ligne est reconstruite. Sinon il faut lire et décompresser
+tout le segment qui le contient (un JSON gzippé d'un seul bloc) : une
+recherche dans un dataset compacté non projeté coûte la lecture d'un segment
+complet par segment touché.
+
+Les valeurs sont indexées tronquées à ``MAX_VALUE_LENGTH`` caractères ; la
+valeur complète est vérifiée sur l'enregistrement relu.
+
+L'indexation est incrémentale comme l'import : ``KeyIndexedFile`` garde la
+taille et le mtime de chaque fichier indexé (pour un fichier compacté sans
+source, ceux du manifest ou de son segment), seuls les fichiers nouveaux ou
+modifiés sont relus (leurs anciennes clés sont remplacées) et les clés des
+fichiers disparus sont retirées. Commande ``index_lake_keys`` ; le watcher du
+lake (consommateur ``keys``) la tient à jour au fil de l'eau.
+"""
+import os
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from ..models import KeyIndexedFile, LakeKey
+from . import mapped, segments
+
+KEY_FIELDS = [field for field, _label in LakeKey.FIELD_CHOICES]
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_VALUE_LENGTH = LakeKey._meta.get_field('value').max_length
+
+# Fichiers écrits par transaction lors de l'indexation d'un dataset
+BATCH_FILES = 500
+
+
+class KeyIndexStats:
+    def __init__(self):
+        self.datasets = 0
+        self.files = 0
+        self.read_files = 0
+        self.removed_files = 0
+        self.removed_datasets = 0
+        self.keys = 0
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def __str__(self):
+        return (f"{self.datasets} datasets, {self.files} files ({self.read_files} read, "
+                f"{self.removed_files} removed), {self.keys} keys written in {self.elapsed:.2f}s")
+
+
+def _stamped(folder_path, entries):
+    """``(entrée, (taille, mtime))`` ; un fichier compacté sans source garde le relevé
+    du manifest ou de son segment, qui change si le segment est reconstruit"""
+    stamps = segments.file_stamps(folder_path, entries)
+    for entry in entries:
+        size, mtime_ns = stamps.get(entry[0], (0, 0))
+        yield entry, (size, mtime_ns / 1e9)
+
+
+def key_value(value):
+    """Forme indexée d'une valeur de clé (tronquée à la taille de la colonne)"""
+    return str(value)[:MAX_VALUE_LENGTH]
+
+
+def record_keys(records):
+    """``(position, champ, valeur)`` des clés présentes dans une liste d'enregistrements"""
+    keys = []
+    for offset, record in enumerate(records):
+        for field in KEY_FIELDS:
+            value = record.get(field)
+            if value is not None and value != '':
+                keys.append((offset, field, key_value(value)))
+    return keys
+
+
+def _write_batch(version, dataset_name, loaded, stamps):
+    """Remplace les clés des fichiers ``loaded`` (``[(filename, records)]``) et met à jour le registre"""
+    filenames = [filename for filename, _records in loaded]
+    keys = []
+    ledger = []
+    for filename, records in loaded:
+        file_keys = [
+            LakeKey(version=version, dataset_name=dataset_name, filename=filename,
+                    offset=offset, field=field, value=value)
+            for offset, field, value in record_keys(records)
+        ]
+        keys.extend(file_keys)
+        size, mtime = stamps[filename]
+        ledger.append(KeyIndexedFile(
+            version=version, dataset_name=dataset_name, filename=filename,
+            size=size, mtime=mtime, keys=len(file_keys),
+        ))
+
+    with transaction.atomic():
+        LakeKey.objects.filter(version=version, dataset_name=dataset_name, filename__in=filenames).delete()
+        LakeKey.objects.bulk_create(keys, batch_size=2000)
+        KeyIndexedFile.objects.bulk_create(
+            ledger,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['version', 'dataset_name', 'filename'],
+            update_fields=['size', 'mtime', 'keys', 'indexed_at'],
+        )
+    return len(keys)
+
+
+def index_dataset(version, dataset_name, rebuild=False, stats=None):
+    """Met à jour les clés d'un dataset ; seuls les fichiers nouveaux ou modifiés sont relus"""
+    stats = stats or KeyIndexStats()
+    folder_path = os.path.join(version.path, dataset_name)
+    known = {
+        row.filename: (row.size, row.mtime)
+        for row in KeyIndexedFile.objects.filter(version=version, dataset_name=dataset_name)
+    }
+
+    # Relevé complet : une source réécrite sur place doit être vue même si le dossier n'a pas bougé
+    entries = segments.list_entries(folder_path, fresh=True)
+    pending, stamps = [], {}
+    for entry, stamp in _stamped(folder_path, entries):
+        filename = entry[0]
+        if rebuild or known.get(filename) != stamp:
+            pending.append(entry)
+            stamps[filename] = stamp
+
+    loaded = []
+    for filename, records in segments.iter_entries(folder_path, pending):
+        loaded.append((filename, records))
+        stats.read_files += 1
+        if len(loaded) >= BATCH_FILES:
+            stats.keys += _write_batch(version, dataset_name, loaded, stamps)
+            loaded = []
+    if loaded:
+        stats.keys += _write_batch(version, dataset_name, loaded, stamps)
+
+    present = {entry[0] for entry in entries}
+    removed = [filename for filename in known if filename not in present]
+    if removed:
+        with transaction.atomic():
+            LakeKey.objects.filter(version=version, dataset_name=dataset_name, filename__in=removed).delete()
+            KeyIndexedFile.objects.filter(version=version, dataset_name=dataset_name, filename__in=removed).delete()
+
+    stats.datasets += 1
+    stats.files += len(entries)
+    stats.removed_files += len(removed)
+    return stats
+
+
+def index_version(version, dataset_names=None, rebuild=False):
+    """Met à jour les clés d'une version (tous ses datasets, ou ``dataset_names``).
+
+    Les clés des datasets qui n'existent plus sont retirées. Retourne un
+    ``KeyIndexStats`` ; lève FileNotFoundError si le dossier de la version
+    n'existe pas (ses clés sont alors retirées).
+    """
+    stats = KeyIndexStats()
+    if not os.path.isdir(version.path):
+        forget(version)
+        raise FileNotFoundError(f"Le dossier {version.path} de la version {version.name} n'existe pas")
+
+    present = sorted(
+        item for item in os.listdir(version.path)
+        if os.path.isdir(os.path.join(version.path, item))
+    )
+    if dataset_names is None:
+        stats.removed_datasets = forget(version, exclude=present)
+        targets = present
+    else:
+        missing = [name for name in dataset_names if name not in present]
+        if missing:
+            stats.removed_datasets = forget(version, dataset_names=missing)
+        targets = [name for name in dataset_names if name in present]
+
+    for dataset_name in targets:
+        index_dataset(version, dataset_name, rebuild=rebuild, stats=stats)
+    stats.stop()
+    return stats
+
+
+def forget(version, dataset_names=None, exclude=None):
+    """Retire les clés de datasets d'une version ; retourne le nombre de datasets retirés"""
+    keys = LakeKey.objects.filter(version=version)
+    files = KeyIndexedFile.objects.filter(version=version)
+    if dataset_names is not None:
+        keys = keys.filter(dataset_name__in=dataset_names)
+        files = files.filter(dataset_name__in=dataset_names)
+    if exclude is not None:
+        keys = keys.exclude(dataset_name__in=exclude)
+        files = files.exclude(dataset_name__in=exclude)
+    removed = len(set(files.values_list('dataset_name', flat=True)))
+    with transaction.atomic():
+        keys.delete()
+        files.delete()
+    return removed
+
+
+def permitted(permissions):
+    """Filtre sur ``LakeKey`` limité aux datasets et versions autorisés"""
+    allowed = Q(pk__in=[])
+    for dataset_name, (all_versions, version_ids) in permissions.rights.items():
+        if all_versions:
+            allowed |= Q(dataset_name=dataset_name)
+        elif version_ids:
+            allowed |= Q(dataset_name=dataset_name, version_id__in=version_ids)
+    return allowed
+
+
+def lookup(field, values, permissions, version=None, dataset_name=None, limit=DEFAULT_LIMIT):
+    """Emplacements des enregistrements dont ``field`` vaut l'une des ``values``.
+
+    Retourne ``(hits, truncated)`` ; ``hits`` est une liste de ``LakeKey``
+    (avec leur version), au plus ``limit``. Pour une valeur plus longue que
+    ``MAX_VALUE_LENGTH``, les emplacements retournés partagent seulement son
+    préfixe : ``resolve(hits, values)`` écarte ceux qui ne correspondent pas.
+    """
+    indexed = sorted({key_value(value) for value in values})
+    keys = LakeKey.objects.filter(permitted(permissions), field=field, value__in=indexed)
+    if version is not None:
+        keys = keys.filter(version=version)
+    if dataset_name is not None:
+        keys = keys.filter(dataset_name=dataset_name)
+    keys = keys.select_related('version').order_by('value', 'version__name', 'dataset_name', 'filename', 'offset')
+    hits = list(keys[:limit + 1])
+    return hits[:limit], len(hits) > limit
+
+
+def _entries_for(folder_path, filenames):
+    """Entrées ``(filename, segment, count)`` pour lire ``filenames`` : fichier source, sinon son segment"""
+    entries = []
+    manifest = None
+    for filename in filenames:
+        if os.path.exists(os.path.join(folder_path, filename)):
+            entries.append((filename, None, None))
+            continue
+        if manifest is None:
+            manifest = segments.read_manifest(folder_path) or {'segments': []}
+        for segment in manifest['segments']:
+            if filename in segment['files']:
+                entries.append((filename, segment['name'], None))
+                break
+    return entries
+
+
+def resolve(hits, values=None):
+    """Lit les enregistrements désignés par ``hits`` ; retourne ``[(hit, enregistrement)]``.
+
+    Un fichier compacté couvert par le fichier projeté du dataset y est lu
+    ligne par ligne ; les autres fichiers sont lus une fois chacun (un segment
+    une fois par dataset, en entier). Un emplacement devenu invalide depuis la
+    dernière indexation (fichier disparu ou réécrit) est omis, ainsi qu'un
+    enregistrement dont la clé n'est pas exactement l'une des ``values``.
+    """
+    by_folder = {}
+    for hit in hits:
+        folder_path = os.path.join(hit.version.path, hit.dataset_name)
+        by_folder.setdefault(folder_path, {}).setdefault(hit.filename, []).append(hit)
+
+    found = {}
+    for folder_path, by_file in by_folder.items():
+        filenames = sorted(by_file)
+        store = None
+        if any(not os.path.exists(os.path.join(folder_path, filename)) for filename in filenames):
+            store = mapped.open_store(folder_path)
+
+        unmapped = []
+        for filename in filenames:
+            span = store.file_span(folder_path, filename) if store is not None else None
+            if span is None:
+                unmapped.append(filename)
+                continue
+            start, count = span
+            for hit in by_file[filename]:
+                if hit.offset < count:
+                    found[hit.pk] = store.rows(start + hit.offset, start + hit.offset + 1)[0]
+
+        for filename, records in segments.read_entries(folder_path, _entries_for(folder_path, unmapped)):
+            for hit in by_file[filename]:
+                if hit.offset < len(records):
+                    found[hit.pk] = records[hit.offset]
+
+    wanted = {str(value) for value in values} if values is not None else None
+    resolved = []
+    for hit in hits:
+        record = found.get(hit.pk)
+        if record is None or record.get(hit.field) is None:
+            continue
+        value = record[hit.field]
+        if key_value(value) != hit.value or (wanted is not None and str(value) not in wanted):
+            continue
+        resolved.append((hit, record))
+    return resolved
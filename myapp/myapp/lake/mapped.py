@@ -0,0 +1,464 @@
+"""Stockage colonnaire compact des datasets chauds, projeté en mémoire (mmap).
+
+Un dataset gardé dans le cache sous forme de liste de dicts coûte plusieurs
+centaines d'octets par champ, et chaque worker gunicorn en garde sa propre
+copie. ``build_store`` (commande ``map_lake``) écrit à la place un fichier
+binaire ``<DATASET>/.segments/mapped.bin`` où chaque champ feuille
+(``LOCATION.COUNTRY``...) est une colonne à type fixe :
+
+- ``int`` / ``float`` / ``bool`` : tableau d'entiers 64 bits, de doubles ou d'octets ;
+- ``dict`` : chaînes encodées par dictionnaire (codes 16 bits), pour
+  ``COUNTRY``, ``PAYMENT_METHOD``, ``PRODUCT_CATEGORY``, ``STATUS`` et toute
+  colonne de chaînes à faible cardinalité ;
+- ``str`` : autres chaînes, en un tas UTF-8 avec un tableau de positions ;
+- ``json`` : valeurs de types mélangés, encodées une à une en JSON.
+
+Un masque d'un octet par ligne (absent / null / présent) n'est écrit que
+pour les colonnes qui en ont besoin. Le fichier commence par un en-tête JSON
+(colonnes, dictionnaires, fichiers source couverts) ; les tableaux sont
+alignés sur 8 octets et lus directement dans le mmap (``memoryview.cast``).
+
+Le fichier est ouvert en lecture seule : ses pages sont celles du cache du
+système, partagées par tous les processus qui l'ouvrent. Le cache de
+datasets (``cache.py``) l'utilise quand il existe ; les enregistrements sont
+reconstruits à la demande, par tranches, et les fichiers arrivés après la
+construction du fichier sont ajoutés à part, comme dans le cache habituel.
+
+L'en-tête garde la taille et le mtime de chaque fichier source couvert : un
+fichier projeté dont une source a été réécrite sur place n'est plus utilisé
+(``covers``). Le watcher du lake (consommateur ``mapped``) reconstruit le
+fichier quand assez de fichiers sont arrivés depuis (``needs_rebuild``).
+"""
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from .. import codec
+from ..codec import LazyRecords
+from . import segments
+
+STORE_NAME = 'mapped.bin'
+STORE_FORMAT = 'lake-mapped'
+STORE_FORMAT_VERSION = 2
+MAGIC = b'LAKEMAP1'
+_PREFIX = struct.Struct('<8sQ')  # signature, taille de l'en-tête JSON
+ALIGNMENT = 8
+
+DICTIONARY_FIELDS = {'COUNTRY', 'PAYMENT_METHOD', 'PRODUCT_CATEGORY', 'STATUS'}
+MAX_DICTIONARY_SIZE = 65535
+# Une colonne de chaînes est encodée par dictionnaire si elle a au plus une valeur distincte pour N lignes
+DICTIONARY_RATIO = 4
+ITER_BATCH = 5000
+
+# États des cellules dans le masque d'une colonne
+MISSING, NULL, PRESENT = 0, 1, 2
+
+_MISSING = object()
+
+
+def store_path(folder_path):
+    return os.path.join(segments.segment_dir(folder_path), STORE_NAME)
+
+
+def _align(offset):
+    return offset + (-offset % ALIGNMENT)
+
+
+def _leaves(record, prefix=()):
+    """``{chemin: valeur}`` des champs feuilles d'un enregistrement (les objets non vides sont dépliés)"""
+    leaves = {}
+    for key, value in record.items():
+        path = prefix + (key,)
+        if isinstance(value, dict) and value:
+            leaves.update(_leaves(value, path))
+        else:
+            leaves[path] = value
+    return leaves
+
+
+def _column_paths(flat_records):
+    """Chemins des colonnes dans l'ordre d'apparition.
+
+    Un champ qui est un objet dans certains enregistrements et une valeur
+    simple dans d'autres est gardé entier dans une seule colonne (de
+    premier niveau).
+    """
+    paths = {}
+    for leaves in flat_records:
+        for path in leaves:
+            paths.setdefault(path, None)
+    prefixes = {path[:depth] for path in paths for depth in range(1, len(path))}
+    conflicts = {path[0] for path in paths if path in prefixes}
+
+    columns = {}
+    for path in paths:
+        columns.setdefault((path[0],) if path[0] in conflicts else path, None)
+    return list(columns), conflicts
+
+
+def _kind(path, values):
+    present = [value for value in values if value is not _MISSING and value is not None]
+    if all(isinstance(value, bool) for value in present):
+        return 'bool'
+    if all(type(value) is int and -2 ** 63 <= value < 2 ** 63 for value in present):
+        return 'int'
+    if all(type(value) is float for value in present):
+        return 'float'
+    if all(isinstance(value, str) for value in present):
+        distinct = len(set(present))
+        if distinct <= MAX_DICTIONARY_SIZE and (path[-1] in DICTIONARY_FIELDS or distinct * DICTIONARY_RATIO <= len(present)):
+            return 'dict'
+        return 'str'
+    return 'json'
+
+
+def _heap(encoded):
+    """Tas d'octets + tableau des positions (``n + 1`` valeurs)"""
+    offsets = array('Q', [0])
+    total = 0
+    for item in encoded:
+        total += len(item)
+        offsets.append(total)
+    return offsets, b''.join(encoded)
+
+
+def _encode_column(path, values):
+    """``(spec, {partie: array ou bytes})`` d'une colonne"""
+    kind = _kind(path, values)
+    states = array('B', (MISSING if value is _MISSING else NULL if value is None else PRESENT for value in values))
+    parts = {}
+    spec = {'path': list(path), 'kind': kind}
+
+    if kind == 'dict':
+        dictionary = {}
+        for value in values:
+            if isinstance(value, str):
+                dictionary.setdefault(value, len(dictionary))
+        spec['dictionary'] = list(dictionary)
+        parts['values'] = array('H', (dictionary.get(value, 0) if isinstance(value, str) else 0 for value in values))
+    elif kind in ('str', 'json'):
+        encode = (lambda value: value.encode('utf-8')) if kind == 'str' else codec.dumps
+        parts['values'], parts['heap'] = _heap([
+            encode(value) if states[index] == PRESENT else b'' for index, value in enumerate(values)
+        ])
+    else:
+        typecode = {'bool': 'B', 'int': 'q', 'float': 'd'}[kind]
+        filler = 0.0 if kind == 'float' else 0
+        parts['values'] = array(typecode, (value if states[index] == PRESENT else filler for index, value in enumerate(values)))
+
+    if any(state != PRESENT for state in states):
+        parts['mask'] = states
+    return spec, parts
+
+
+def encode_store(files, records):
+    """Contenu binaire du fichier pour ``records``.
+
+    ``files`` liste les fichiers source ``(filename, count)`` ou
+    ``(filename, count, taille, mtime_ns)`` (taille et mtime à None pour un
+    fichier compacté dont la source a été supprimée).
+    """
+    flat_records = [_leaves(record) for record in records]
+    paths, conflicts = _column_paths(flat_records)
+
+    columns = []
+    buffers = []
+    offset = 0
+    for path in paths:
+        if path[0] in conflicts:
+            values = [record.get(path[0], _MISSING) for record in records]
+        else:
+            values = [leaves.get(path, _MISSING) for leaves in flat_records]
+        spec, parts = _encode_column(path, values)
+        for name, part in parts.items():
+            data = part.tobytes() if isinstance(part, array) else part
+            spec[name] = {
+                'offset': offset,
+                'length': len(data),
+                'typecode': part.typecode if isinstance(part, array) else 'B',
+            }
+            buffers.append((offset, data))
+            offset = _align(offset + len(data))
+        columns.append(spec)
+
+    header = codec.dumps({
+        'format': STORE_FORMAT,
+        'version': STORE_FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'records': len(records),
+        'files': [list(item) + [None] * (4 - len(item)) for item in files],
+        'columns': columns,
+    })
+    base = _align(_PREFIX.size + len(header))
+    content = bytearray(base + offset)
+    content[:_PREFIX.size] = _PREFIX.pack(MAGIC, len(header))
+    content[_PREFIX.size:_PREFIX.size + len(header)] = header
+    for position, data in buffers:
+        content[base + position:base + position + len(data)] = data
+    return bytes(content)
+
+
+def _source_stamp(folder_path, filename):
+    """``(taille, mtime_ns)`` du fichier source, ``(None, None)`` s'il n'existe plus (compacté)"""
+    try:
+        stat = os.stat(os.path.join(folder_path, filename))
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_store(folder_path):
+    """Écrit le fichier projeté d'un dataset (segments + queue) ; retourne ``(enregistrements, octets)``"""
+    entries = segments.list_entries(folder_path)
+    # Relevés avant la lecture : une source réécrite pendant la construction invalide le fichier
+    stamps = {entry[0]: _source_stamp(folder_path, entry[0]) for entry in entries}
+    files, records = [], []
+    for filename, file_records in segments.read_entries(folder_path, entries):
+        files.append((filename, len(file_records)) + stamps[filename])
+        records.extend(file_records)
+
+    content = encode_store(files, records)
+    os.makedirs(segments.segment_dir(folder_path), exist_ok=True)
+    path = store_path(folder_path)
+    # Fichier temporaire propre à l'écrivain, comme ``segments.write_atomic`` : le
+    # watcher et ``map_lake`` peuvent reconstruire le même dataset en même temps
+    tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        # Remplacement atomique : les processus qui ont projeté l'ancien fichier le gardent
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(records), len(content)
+
+
+def remove_store(folder_path):
+    try:
+        os.remove(store_path(folder_path))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def covers(store, folder_path, entries):
+    """Vrai si les fichiers couverts par ``store`` sont tous encore là, sans avoir été réécrits.
+
+    Une source supprimée après compaction reste valable tant que le fichier
+    figure dans un segment (``entries`` de ``segments.list_entries``).
+    """
+    listed = {entry[0] for entry in entries}
+    for filename, _count in store.files:
+        if filename not in listed:
+            return False
+        size, mtime_ns = store.stamps[filename]
+        current = _source_stamp(folder_path, filename)
+        if current != (None, None) and current != (size, mtime_ns):
+            return False
+    return True
+
+
+def needs_rebuild(folder_path, min_files, max_age):
+    """Vrai si le fichier projeté manque, n'est plus valable, ou ne couvre pas ``min_files``
+    fichiers arrivés depuis (ou ``max_age`` secondes depuis sa construction)"""
+    store = open_store(folder_path)
+    if store is None:
+        return True
+    entries = segments.list_entries(folder_path)
+    if not covers(store, folder_path, entries):
+        return True
+    uncovered = len(entries) - len(store.files)
+    if uncovered >= min_files:
+        return True
+    return uncovered > 0 and time.time() - store.built_at >= max_age
+
+
+class _Column:
+    def __init__(self, spec, view, base):
+        self.path = tuple(spec['path'])
+        self.kind = spec['kind']
+        self.dictionary = spec.get('dictionary')
+
+        def part(name, cast=True):
+            location = spec.get(name)
+            if location is None:
+                return None
+            start = base + location['offset']
+            data = view[start:start + location['length']]
+            return data.cast(location['typecode']) if cast else data
+
+        self.values = part('values')
+        self.mask = part('mask')
+        self.heap = part('heap', cast=False)
+
+    def decode(self, start, stop):
+        """Valeurs des lignes ``[start:stop]`` (``_MISSING`` pour un champ absent)"""
+        if self.kind == 'dict':
+            dictionary = self.dictionary
+            values = [dictionary[code] if dictionary else None for code in self.values[start:stop].tolist()]
+        elif self.kind in ('str', 'json'):
+            offsets = self.values[start:stop + 1].tolist()
+            heap = self.heap
+            if self.kind == 'str':
+                values = [str(heap[a:b], 'utf-8') for a, b in zip(offsets, offsets[1:])]
+            else:
+                values = [codec.loads(bytes(heap[a:b])) if b > a else None for a, b in zip(offsets, offsets[1:])]
+        elif self.kind == 'bool':
+            values = [bool(value) for value in self.values[start:stop].tolist()]
+        else:
+            values = self.values[start:stop].tolist()
+
+        if self.mask is not None:
+            values = [
+                value if state == PRESENT else (None if state == NULL else _MISSING)
+                for value, state in zip(values, self.mask[start:stop].tolist())
+            ]
+        return values
+
+
+class MappedStore:
+    """Fichier ``mapped.bin`` d'un dataset, projeté en lecture seule"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Identité du fichier ouvert : une reconstruction le remplace (os.replace)
+        self.stamp = (stat.st_ino, stat.st_mtime_ns)
+        self.built_at = stat.st_mtime
+        magic, header_length = _PREFIX.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} n'est pas un fichier projeté du lake")
+        header = codec.loads(self._map[_PREFIX.size:_PREFIX.size + header_length])
+        if header.get('format') != STORE_FORMAT or header.get('version') != STORE_FORMAT_VERSION:
+            raise ValueError(f"{path} au format inconnu")
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} a été écrit sur une machine d'un autre boutisme")
+
+        self.path = path
+        self.size = len(self._map)
+        self.header_bytes = header_length
+        self.count = header['records']
+        self.files = [(filename, count) for filename, count, _size, _mtime_ns in header['files']]
+        self.stamps = {filename: (size, mtime_ns) for filename, _count, size, mtime_ns in header['files']}
+        self.spans = {}
+        position = 0
+        for filename, count in self.files:
+            self.spans[filename] = (position, count)
+            position += count
+        view = memoryview(self._map)
+        base = _align(_PREFIX.size + header_length)
+        self.columns = [_Column(spec, view, base) for spec in header['columns']]
+
+    def __len__(self):
+        return self.count
+
+    def file_span(self, folder_path, filename):
+        """``(première ligne, nombre de lignes)`` de ``filename`` dans le fichier projeté,
+        ou None s'il n'est pas couvert ou si sa source a été réécrite depuis"""
+        span = self.spans.get(filename)
+        if span is None:
+            return None
+        current = _source_stamp(folder_path, filename)
+        if current != (None, None) and current != self.stamps[filename]:
+            return None
+        return span
+
+    def rows(self, start, stop):
+        """Enregistrements ``[start:stop]``, reconstruits colonne par colonne"""
+        start, stop = max(0, start), min(stop, self.count)
+        if start >= stop:
+            return []
+        records = [{} for _ in range(stop - start)]
+        for column in self.columns:
+            path = column.path
+            values = column.decode(start, stop)
+            if len(path) == 1:
+                key = path[0]
+                for record, value in zip(records, values):
+                    if value is not _MISSING:
+                        record[key] = value
+                continue
+            parents, leaf = path[:-1], path[-1]
+            for record, value in zip(records, values):
+                if value is _MISSING:
+                    continue
+                target = record
+                for key in parents:
+                    target = target.setdefault(key, {})
+                target[leaf] = value
+        return records
+
+
+def open_store(folder_path):
+    """``MappedStore`` du dataset, ou None s'il n'a pas de fichier projeté valide"""
+    try:
+        return MappedStore(store_path(folder_path))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def store_stamp(folder_path):
+    """Identité du fichier projeté actuel sur disque, None s'il n'existe pas"""
+    try:
+        stat = os.stat(store_path(folder_path))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class MappedRecords(LazyRecords):
+    """Séquence des enregistrements d'un ``MappedStore`` suivis de ``extra``.
+
+    ``extra`` contient les enregistrements des fichiers arrivés après la
+    construction du fichier projeté. Une tranche renvoie une nouvelle liste de
+    dicts ; un indice, un dict reconstruit. ``codec.dumps`` encode la séquence
+    par paquets de ``ITER_BATCH`` (``iter_batches``).
+    """
+
+    def __init__(self, store, extra=None):
+        self.store = store
+        self.extra = extra if extra is not None else []
+
+    def __len__(self):
+        return len(self.store) + len(self.extra)
+
+    def __getitem__(self, index):
+        mapped = len(self.store)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[position] for position in range(start, stop, step)]
+            head = self.store.rows(start, min(stop, mapped)) if start < mapped else []
+            return head + self.extra[max(start - mapped, 0):max(stop - mapped, 0)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        if index < mapped:
+            return self.store.rows(index, index + 1)[0]
+        return self.extra[index - mapped]
+
+    def iter_batches(self):
+        for start in range(0, len(self.store), ITER_BATCH):
+            yield self.store.rows(start, start + ITER_BATCH)
+        for start in range(0, len(self.extra), ITER_BATCH):
+            yield self.extra[start:start + ITER_BATCH]
+
+    def __iter__(self):
+        for batch in self.iter_batches():
+            yield from batch
+
+    def extend(self, records):
+        self.extra.extend(records)
+
+    def copy(self):
+        return MappedRecords(self.store, list(self.extra))
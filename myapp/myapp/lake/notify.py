@@ -0,0 +1,178 @@
+"""Détection des nouveaux fichiers du data lake : inotify, ou scrutation périodique.
+
+Les deux sources ont la même interface, utilisée par ``watcher.LakeWatcher`` :
+
+- ``watch_version(path)`` / ``watch_dataset(path)`` ajoutent un dossier de
+  version (pour voir apparaître de nouveaux datasets) ou de dataset ;
+- ``poll(timeout)`` attend au plus ``timeout`` secondes et retourne une liste
+  d'événements ``(dossier, nom, est_un_dossier)``, ou ``RESCAN`` si des
+  événements ont pu être perdus (débordement de la file inotify).
+
+``InotifySource`` utilise directement l'API inotify de la libc (Linux) via
+ctypes ; seuls les fichiers terminés sont signalés (``IN_CLOSE_WRITE``, ou
+``IN_MOVED_TO`` pour les écritures par renommage). Ailleurs, ou si inotify
+n'est pas utilisable (limite de watches atteinte...), ``open_source`` se
+rabat sur ``PollingSource``, qui compare la taille et le mtime des fichiers
+d'un passage à l'autre.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+RESCAN = 'rescan'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def is_lake_file(name):
+    return name.endswith('.json') and not name.startswith('.')
+
+
+class InotifySource:
+    name = 'inotify'
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = {}  # wd -> (dossier, est une version)
+        self._paths = {}
+
+    def _add_watch(self, path, mask, is_version):
+        if path in self._paths:
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+        self._watches[wd] = (path, is_version)
+        self._paths[path] = wd
+
+    def watch_version(self, path):
+        self._add_watch(path, IN_CREATE | IN_MOVED_TO, True)
+
+    def watch_dataset(self, path):
+        self._add_watch(path, IN_CLOSE_WRITE | IN_MOVED_TO, False)
+
+    def poll(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            raw_name = data[offset + _EVENT.size:offset + _EVENT.size + length]
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return RESCAN
+            watched = self._watches.get(wd)
+            if watched is None:
+                continue
+            path, is_version = watched
+            if mask & IN_IGNORED:
+                # Dossier supprimé ou démonté
+                del self._watches[wd]
+                self._paths.pop(path, None)
+                continue
+            name = os.fsdecode(raw_name.rstrip(b'\0'))
+            is_dir = bool(mask & IN_ISDIR)
+            if is_version and is_dir:
+                events.append((path, name, True))
+            elif not is_version and not is_dir and is_lake_file(name):
+                events.append((path, name, False))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingSource:
+    name = 'polling'
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._versions = {}  # dossier -> {sous-dossiers}
+        self._datasets = {}  # dossier -> {fichier: (taille, mtime_ns)}
+        self._next = time.monotonic() + interval
+
+    @staticmethod
+    def _subdirs(path):
+        try:
+            return {entry.name for entry in os.scandir(path) if entry.is_dir() and not entry.name.startswith('.')}
+        except OSError:
+            return set()
+
+    @staticmethod
+    def _files(path):
+        files = {}
+        try:
+            for entry in os.scandir(path):
+                if is_lake_file(entry.name) and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            pass
+        return files
+
+    def watch_version(self, path):
+        self._versions.setdefault(path, self._subdirs(path))
+
+    def watch_dataset(self, path):
+        self._datasets.setdefault(path, self._files(path))
+
+    def poll(self, timeout):
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(0.0, timeout))
+            return []
+        time.sleep(max(0.0, wait))
+        self._next = time.monotonic() + self.interval
+
+        events = []
+        for path, known in self._versions.items():
+            current = self._subdirs(path)
+            events += [(path, name, True) for name in sorted(current - known)]
+            self._versions[path] = current
+        for path, known in self._datasets.items():
+            current = self._files(path)
+            events += [
+                (path, name, False)
+                for name, stamp in sorted(current.items())
+                if known.get(name) != stamp
+            ]
+            self._datasets[path] = current
+        return events
+
+    def close(self):
+        pass
+
+
+def open_source(polling=False, interval=1.0):
+    """``InotifySource`` si possible, sinon ``PollingSource``"""
+    if not polling:
+        try:
+            return InotifySource()
+        except (OSError, AttributeError):
+            pass
+    return PollingSource(interval=interval)
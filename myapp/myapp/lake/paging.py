@@ -0,0 +1,419 @@
+"""Pagination paresseuse des datasets du data lake.
+
+Au lieu de charger tous les enregistrements puis de découper ``[start:end]``,
+la pagination parcourt la liste ordonnée des fichiers de chaque dataset avec
+leur nombre d'enregistrements et ne lit que les fichiers qui tombent dans la
+page demandée. Le nombre d'enregistrements par fichier vient du manifest des
+segments (fichiers compactés) ou, pour la queue non compactée, de relevés
+persistés dans ``.segments/tail.json`` (taille, mtime, nombre
+d'enregistrements et plage de TIMESTAMP de chaque fichier), ce qui donne le
+``total`` sans recharger le dataset : seul un fichier nouveau ou modifié est
+relu, une fois pour tous les processus. Comme pour le cache, tant que le mtime
+du dossier n'a pas changé depuis la dernière vérification, les relevés sont
+repris sans ``stat`` des fichiers de la queue.
+
+Les curseurs (``?cursor=``) sont opaques : ils encodent le dataset, le fichier
+et la position dans ce fichier du premier enregistrement de la page suivante.
+"""
+import base64
+import json
+import os
+import threading
+import time
+
+from .. import codec
+from . import segments
+from .cache import MTIME_GRANULARITY, get_dataset_cache
+from .query import parse_moment
+
+
+# Taille des paquets lus par DatasetPager.iter_records
+ITER_BATCH_FILES = 500
+ITER_BATCH_RECORDS = 5000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+TAIL_STATS_NAME = 'tail.json'
+TAIL_STATS_VERSION = 2
+
+# Contenu de tail.json par dataset : {dossier: (mtime_ns de tail.json, contenu)}. Le contenu
+# associe ``files`` ({filename: [taille, mtime_ns, count, min, max]}) au mtime du dossier
+# (``folder_mtime_ns``) et à l'heure (``checked_at``) de la dernière vérification complète.
+_tail_counts = {}
+_tail_counts_lock = threading.Lock()
+
+
+def tail_stats_path(folder_path):
+    return os.path.join(segments.segment_dir(folder_path), TAIL_STATS_NAME)
+
+
+def _load_tail_stats(folder_path):
+    """Relevés persistés du dataset (relus seulement quand ``tail.json`` a changé)"""
+    path = tail_stats_path(folder_path)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return {'files': {}}
+    with _tail_counts_lock:
+        cached = _tail_counts.get(folder_path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        content = codec.load_file(path)
+        if content.get('version') != TAIL_STATS_VERSION or not isinstance(content['files'], dict):
+            content = {'files': {}}
+    except (OSError, ValueError, AttributeError, KeyError):
+        # Fichier absent, en cours de remplacement ou corrompu : tout est relu puis réécrit
+        content = {'files': {}}
+    with _tail_counts_lock:
+        _tail_counts[folder_path] = (mtime_ns, content)
+    return content
+
+
+def _read_tail_file(file_path):
+    """``[count, TIMESTAMP min, TIMESTAMP max]`` d'un fichier non compacté (dates en ISO 8601)"""
+    try:
+        records = segments.read_json_file(file_path)
+    except Exception:
+        records = []
+    moments = [moment for moment in (parse_moment(record.get('TIMESTAMP')) for record in records) if moment]
+    low, high = min(moments, default=None), max(moments, default=None)
+    return [len(records), low and low.isoformat(), high and high.isoformat()]
+
+
+def tail_stats(folder_path, filenames, tail=None):
+    """``{filename: (count, TIMESTAMP min, TIMESTAMP max)}`` des fichiers non compactés ``filenames``.
+
+    Seuls les fichiers absents de ``tail.json`` ou modifiés depuis (taille,
+    mtime) sont lus ; les relevés sont alors réécrits. Si le mtime du dossier
+    est celui de la dernière vérification complète, les fichiers connus ne
+    sont même pas examinés. ``tail`` (tous les fichiers non compactés du
+    dataset) permet d'en retirer les fichiers compactés ou supprimés
+    entre-temps et d'enregistrer la vérification.
+    """
+    try:
+        folder_stat = os.stat(folder_path)
+    except OSError:
+        folder_stat = None
+    content = _load_tail_stats(folder_path)
+    known = content['files']
+    # Même règle que ``DatasetCache._is_fresh`` : un mtime trop proche de la vérification n'est pas fiable
+    trusted = (
+        folder_stat is not None
+        and content.get('folder_mtime_ns') == folder_stat.st_mtime_ns
+        and content.get('checked_at', 0) - folder_stat.st_mtime > MTIME_GRANULARITY
+    )
+    updated = {}
+    stats = {}
+    for filename in filenames:
+        entry = known.get(filename) if trusted else None
+        if entry is None:
+            try:
+                stat = os.stat(os.path.join(folder_path, filename))
+            except OSError:
+                stats[filename] = (0, None, None)
+                continue
+            entry = known.get(filename)
+            if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                entry = [stat.st_size, stat.st_mtime_ns] + _read_tail_file(os.path.join(folder_path, filename))
+                updated[filename] = entry
+        stats[filename] = (entry[2], parse_moment(entry[3]), parse_moment(entry[4]))
+
+    keep = set(tail) if tail is not None else None
+    stale = keep is not None and any(filename not in keep for filename in known)
+    # Vérification complète d'un dossier stable : les appels suivants peuvent s'y fier
+    checked = (keep is not None and not trusted and folder_stat is not None
+               and time.time() - folder_stat.st_mtime > MTIME_GRANULARITY)
+    if updated or stale or checked:
+        files = {
+            filename: entry for filename, entry in known.items()
+            if keep is None or filename in keep
+        }
+        files.update(updated)
+        payload = {'version': TAIL_STATS_VERSION, 'files': files}
+        if checked:
+            payload['folder_mtime_ns'] = folder_stat.st_mtime_ns
+            payload['checked_at'] = time.time()
+        elif trusted:
+            payload['folder_mtime_ns'] = content['folder_mtime_ns']
+            payload['checked_at'] = content['checked_at']
+        try:
+            os.makedirs(segments.segment_dir(folder_path), exist_ok=True)
+            segments.write_atomic(tail_stats_path(folder_path), payload)
+        except OSError:
+            # Lake en lecture seule : les fichiers seront relus au prochain appel
+            pass
+    return stats
+
+
+class DatasetPager:
+    """Vue paginable d'un dataset : liste ordonnée ``(filename, count)`` + lecture ciblée.
+
+    Avec une fenêtre ``window`` (``TimeWindow``), les fichiers dont la plage de
+    TIMESTAMP (d'après ``index``, un ``TimeIndex``, ou les relevés des fichiers
+    non compactés) ne recoupe pas la fenêtre sont écartés avant toute lecture.
+    """
+
+    def __init__(self, base_path, dataset_name, window=None, index=None):
+        self.dataset_name = dataset_name
+        self.folder_path = os.path.join(base_path, dataset_name)
+        self.pruned = 0
+        self._cached = get_dataset_cache().peek(base_path, dataset_name)
+        if self._cached is not None:
+            # Position de chaque fichier dans les enregistrements du cache
+            self.files, self._starts = [], []
+            start = 0
+            for filename, count in self._cached.files:
+                if window is None or self._in_window(window, index, filename):
+                    self.files.append((filename, count))
+                    self._starts.append(start)
+                start += count
+            self._entries = None
+        else:
+            entries = segments.list_entries(self.folder_path)
+            if window is not None:
+                entries = [entry for entry in entries if self._in_window(window, index, entry[0])]
+            tail = [filename for filename, segment_name, _count in entries if segment_name is None]
+            stats = tail_stats(self.folder_path, tail, tail=tail if window is None else None) if tail else {}
+            self._entries = []
+            self.files = []
+            for filename, segment_name, count in entries:
+                if count is None:
+                    count, low, high = stats[filename]
+                    if window is not None and not window.overlaps(low, high):
+                        self.pruned += 1
+                        continue
+                self._entries.append((filename, segment_name, count))
+                self.files.append((filename, count))
+        self._positions = {filename: index for index, (filename, _count) in enumerate(self.files)}
+        self.total = sum(count for _filename, count in self.files)
+
+    def _in_window(self, window, index, filename):
+        """Faux si la plage connue du fichier est hors de la fenêtre (fichier écarté)"""
+        known = index.get(filename) if index is not None else None
+        if known is None or window.overlaps(*known):
+            return True
+        self.pruned += 1
+        return False
+
+    def _cached_records(self, first, last):
+        """Enregistrements en cache des fichiers ``first`` à ``last``, par tranches contiguës"""
+        records = []
+        run_start = run_stop = None
+        for position in range(first, last + 1):
+            start = self._starts[position]
+            if start != run_stop:
+                if run_start is not None:
+                    records.extend(self._cached.records[run_start:run_stop])
+                run_start = start
+            run_stop = start + self.files[position][1]
+        if run_start is not None:
+            records.extend(self._cached.records[run_start:run_stop])
+        return records
+
+    def position_of(self, filename):
+        return self._positions.get(filename)
+
+    def read(self, first, last, query=None):
+        """Enregistrements des fichiers d'indices ``first`` à ``last`` inclus.
+
+        Avec un ``LakeQuery`` (sans filtre), seules ses colonnes sont lues et
+        les enregistrements sont projetés.
+        """
+        if self._cached is not None:
+            records = self._cached_records(first, last)
+            return records if query is None else [query.project(record) for record in records]
+        fields = query.columns if query is not None else None
+        records = []
+        for _filename, file_records in segments.read_entries(self.folder_path, self._entries[first:last + 1], fields=fields):
+            records.extend(file_records)
+        if query is not None and query.paths is not None:
+            records = [query.project(record) for record in records]
+        return records
+
+    def scan(self, query, file_index=0, in_file=0):
+        """Parcourt les enregistrements retenus par ``query`` à partir d'une position.
+
+        Produit des ``(indice de fichier, position dans le fichier, enregistrement
+        projeté)``. Les filtres sont évalués pendant la lecture (voir
+        ``segments.scan_entries``).
+        """
+        index = file_index
+        while index < len(self.files):
+            last = self._batch_end(index)
+            if self._cached is not None:
+                batch = self._cached_records(index, last)
+                matched = []
+                start = 0
+                for position in range(index, last + 1):
+                    count = self.files[position][1]
+                    matched.append((position, query.apply(batch[start:start + count])))
+                    start += count
+            else:
+                matched = [
+                    (self._positions[filename], rows)
+                    for filename, rows in segments.scan_entries(self.folder_path, self._entries[index:last + 1], query)
+                ]
+            for position, rows in matched:
+                for in_position, record in rows:
+                    if position == file_index and in_position < in_file:
+                        continue
+                    yield position, in_position, record
+            index = last + 1
+
+    def _batch_end(self, first):
+        """Dernier fichier du paquet commençant à ``first`` : un segment, ou une tranche bornée"""
+        last = first
+        if self._cached is not None:
+            covered = self.files[first][1]
+            while last + 1 < len(self.files) and covered < ITER_BATCH_RECORDS:
+                last += 1
+                covered += self.files[last][1]
+            return last
+        segment_name = self._entries[first][1]
+        while (last + 1 < len(self.files) and self._entries[last + 1][1] == segment_name
+               and (segment_name is not None or last + 1 - first < ITER_BATCH_FILES)):
+            last += 1
+        return last
+
+    def iter_records(self, offset=0):
+        """Parcourt les enregistrements à partir de la position ``offset``.
+
+        Les fichiers sont lus par paquets (un segment à la fois, ou
+        ``ITER_BATCH_FILES`` fichiers non compactés) : la mémoire utilisée ne
+        dépend pas de la taille du dataset.
+        """
+        index, in_file = _locate(self, offset)
+        while index < len(self.files):
+            last = self._batch_end(index)
+            records = self.read(index, last)
+            for position in range(in_file, len(records)):
+                yield records[position]
+            index, in_file = last + 1, 0
+
+
+def encode_cursor(dataset_name, filename, index):
+    payload = json.dumps({'d': dataset_name, 'f': filename, 'i': index}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return payload['d'], payload['f'], int(payload['i'])
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def _locate(pager, offset):
+    """Convertit une position absolue dans le dataset en (indice de fichier, position dans le fichier)"""
+    for index, (_filename, count) in enumerate(pager.files):
+        if offset < count:
+            return index, offset
+        offset -= count
+    return len(pager.files), 0
+
+
+def _paginate_filtered(pagers, page_size, query, offset=None, cursor=None):
+    """Pagination avec filtres : ``offset`` compte les enregistrements retenus,
+    le curseur pointe sur le prochain enregistrement retenu."""
+    if cursor is not None:
+        pager_index, file_index, in_file = _cursor_position(pagers, cursor)
+        skip = 0
+    else:
+        pager_index, file_index, in_file = 0, 0, 0
+        skip = offset or 0
+
+    results = []
+    for pager in pagers[pager_index:]:
+        for position, in_position, record in pager.scan(query, file_index, in_file):
+            if skip:
+                skip -= 1
+                continue
+            if len(results) == page_size:
+                return results, encode_cursor(pager.dataset_name, pager.files[position][0], in_position)
+            results.append(record)
+        file_index, in_file = 0, 0
+    return results, None
+
+
+def _cursor_position(pagers, cursor):
+    dataset_name, filename, in_file = decode_cursor(cursor)
+    names = [pager.dataset_name for pager in pagers]
+    if dataset_name not in names:
+        raise InvalidCursor("Invalid cursor")
+    pager_index = names.index(dataset_name)
+    file_index = pagers[pager_index].position_of(filename)
+    if file_index is None:
+        raise InvalidCursor("Invalid cursor")
+    return pager_index, file_index, in_file
+
+
+def paginate(pagers, page_size, offset=None, cursor=None, query=None):
+    """Retourne ``(results, next_cursor)`` pour une page.
+
+    ``pagers`` est la liste ordonnée des ``DatasetPager`` à parcourir comme un
+    seul flux. La page démarre soit à la position absolue ``offset``, soit au
+    curseur opaque ``cursor``. Seuls les fichiers couvrant la page sont lus.
+    ``query`` (un ``LakeQuery``) projette les enregistrements ; s'il filtre,
+    les fichiers sont parcourus jusqu'à remplir la page.
+    """
+    if query is not None and query.filtered:
+        return _paginate_filtered(pagers, page_size, query, offset=offset, cursor=cursor)
+    if cursor is not None:
+        pager_index, file_index, in_file = _cursor_position(pagers, cursor)
+    else:
+        pager_index = 0
+        remaining = offset or 0
+        while pager_index < len(pagers) and remaining >= pagers[pager_index].total:
+            remaining -= pagers[pager_index].total
+            pager_index += 1
+        if pager_index == len(pagers):
+            return [], None
+        file_index, in_file = _locate(pagers[pager_index], remaining)
+
+    results = []
+    next_cursor = None
+    while pager_index < len(pagers) and len(results) < page_size:
+        pager = pagers[pager_index]
+        wanted = in_file + page_size - len(results)
+
+        # Choisir la plage de fichiers qui couvre la fin de la page
+        last = file_index
+        covered = 0
+        while last < len(pager.files):
+            covered += pager.files[last][1]
+            if covered >= wanted:
+                break
+            last += 1
+        last = min(last, len(pager.files) - 1)
+
+        if file_index < len(pager.files):
+            records = pager.read(file_index, last, query=query)
+            take = records[in_file:in_file + page_size - len(results)]
+            results.extend(take)
+
+            if len(results) >= page_size:
+                # Position du prochain enregistrement à renvoyer
+                consumed = in_file + len(take)
+                next_index, next_in_file = file_index, consumed
+                while next_index < len(pager.files) and next_in_file >= pager.files[next_index][1]:
+                    next_in_file -= pager.files[next_index][1]
+                    next_index += 1
+                if next_index < len(pager.files):
+                    next_cursor = encode_cursor(pager.dataset_name, pager.files[next_index][0], next_in_file)
+                else:
+                    for following in pagers[pager_index + 1:]:
+                        if following.files and following.total:
+                            next_cursor = encode_cursor(following.dataset_name, following.files[0][0], 0)
+                            break
+                break
+
+        pager_index += 1
+        file_index, in_file = 0, 0
+
+    return results, next_cursor
@@ -0,0 +1,230 @@
+"""Projection (``?fields=``) et filtres (``?where=``) appliqués pendant la lecture du lake.
+
+``fields`` est une liste de chemins séparés par des virgules, avec des points
+pour les objets imbriqués : ``TRANSACTION_ID,AMOUNT,LOCATION.COUNTRY``. Les
+enregistrements renvoyés gardent leur structure (``{"LOCATION": {"COUNTRY":
+...}}``) mais ne contiennent que ces chemins.
+
+``where`` (répétable, combiné en ET) est une comparaison ``chemin op valeur``
+avec ``op`` parmi ``=``, ``!=``, ``>``, ``>=``, ``<``, ``<=`` :
+``where=STATUS=completed&where=AMOUNT>=500``. La valeur est comparée comme un
+nombre si elle en est un, sinon comme une chaîne ; un champ absent ne vérifie
+aucun filtre.
+
+``from`` / ``to`` (dates ou horodatages ISO 8601, UTC si sans fuseau)
+restreignent les enregistrements à ``from <= TIMESTAMP < to`` ; la fenêtre
+sert aussi à écarter les fichiers hors plage avant de les ouvrir (voir
+``timeindex.py``).
+
+Dans les segments colonnaires, seules les colonnes utiles sont lues et les
+filtres sont évalués colonne par colonne avant de construire un
+enregistrement : les enregistrements écartés ne sont jamais reconstruits.
+"""
+import operator
+import re
+from datetime import datetime, timezone
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+PREDICATE_PATTERN = re.compile(r'^\s*([A-Za-z0-9_.]+)\s*(!=|>=|<=|=|>|<)\s*(.*?)\s*$')
+_MISSING = object()
+
+
+def parse_path(value):
+    path = tuple(part for part in value.strip().split('.'))
+    if not path or not all(path):
+        raise InvalidQuery(f"Invalid field '{value}'")
+    return path
+
+
+def _coerce(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def lookup(value, path):
+    """Valeur au chemin ``path`` (sans le premier niveau) dans ``value``"""
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return value
+
+
+class Predicate:
+    def __init__(self, path, op, value):
+        self.path = path
+        self.op = op
+        self.value = _coerce(value)
+        self._compare = OPERATORS[op]
+
+    def test(self, top_value):
+        """Évalue le filtre sur la valeur de la colonne de premier niveau ``path[0]``"""
+        value = lookup(top_value, self.path[1:])
+        if value is _MISSING or value is None or isinstance(value, (dict, list)):
+            return False
+        if isinstance(self.value, float):
+            if isinstance(value, bool):
+                return False
+            if isinstance(value, str):
+                try:
+                    value = float(value)
+                except ValueError:
+                    return False
+            return self._compare(value, self.value)
+        return self._compare(str(value), self.value)
+
+
+def parse_moment(value):
+    """Datetime UTC d'un TIMESTAMP ISO 8601, ou None s'il est absent ou invalide"""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+class TimeWindow:
+    """Fenêtre ``[start, end[`` sur le champ TIMESTAMP ; une borne peut manquer"""
+
+    path = ('TIMESTAMP',)
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_params(cls, start=None, end=None):
+        """Fenêtre des paramètres ``from`` / ``to``, ou None s'ils sont absents"""
+        bounds = []
+        for name, value in (('from', start), ('to', end)):
+            moment = parse_moment(value.strip()) if value else None
+            if value and moment is None:
+                raise InvalidQuery(f"Invalid '{name}' timestamp '{value}'")
+            bounds.append(moment)
+        if bounds == [None, None]:
+            return None
+        if None not in bounds and bounds[0] >= bounds[1]:
+            raise InvalidQuery("'from' must be before 'to'")
+        return cls(*bounds)
+
+    def contains(self, moment):
+        return (moment is not None
+                and (self.start is None or moment >= self.start)
+                and (self.end is None or moment < self.end))
+
+    def overlaps(self, low, high):
+        """Vrai si un fichier dont les TIMESTAMP vont de ``low`` à ``high`` peut avoir des enregistrements dans la fenêtre"""
+        if low is None or high is None:
+            return False
+        return (self.start is None or high >= self.start) and (self.end is None or low < self.end)
+
+    def test(self, top_value):
+        """Utilisée comme filtre de ``LakeQuery`` sur la colonne TIMESTAMP"""
+        return self.contains(parse_moment(top_value))
+
+
+def parse_predicate(value):
+    match = PREDICATE_PATTERN.match(value)
+    if not match:
+        raise InvalidQuery(f"Invalid predicate '{value}'")
+    return Predicate(parse_path(match.group(1)), match.group(2), match.group(3))
+
+
+class LakeQuery:
+    def __init__(self, paths=None, predicates=(), window=None):
+        self.paths = paths
+        self.window = window
+        self.predicates = list(predicates) + ([window] if window is not None else [])
+
+    @classmethod
+    def from_params(cls, fields=None, where=(), start=None, end=None):
+        paths = [parse_path(part) for part in fields.split(',') if part.strip()] if fields else None
+        if fields is not None and not paths:
+            raise InvalidQuery("Empty field list")
+        return cls(
+            paths,
+            [parse_predicate(value) for value in where if value],
+            window=TimeWindow.from_params(start, end),
+        )
+
+    @property
+    def filtered(self):
+        return bool(self.predicates)
+
+    @property
+    def columns(self):
+        """Colonnes de premier niveau à lire, ou None pour toutes"""
+        if self.paths is None:
+            return None
+        return {path[0] for path in self.paths} | {p.path[0] for p in self.predicates}
+
+    def _project_columns(self, get):
+        """Construit l'enregistrement projeté à partir de ``get(colonne)``"""
+        if self.paths is None:
+            return None
+        record = {}
+        for path in self.paths:
+            value = get(path[0])
+            if value is _MISSING:
+                continue
+            value = lookup(value, path[1:])
+            if value is _MISSING:
+                continue
+            target = record
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        return record
+
+    def matches(self, record):
+        return all(p.test(record.get(p.path[0], _MISSING)) for p in self.predicates)
+
+    def project(self, record):
+        if self.paths is None:
+            return record
+        return self._project_columns(lambda name: record.get(name, _MISSING))
+
+    def apply(self, records):
+        """``[(position, enregistrement projeté)]`` des enregistrements retenus"""
+        return [
+            (position, self.project(record))
+            for position, record in enumerate(records)
+            if self.matches(record)
+        ]
+
+    def scan_segment(self, segment, start, stop):
+        """Comme ``apply`` sur les lignes ``[start:stop]`` d'un segment, colonne par colonne"""
+        columns = segment['columns']
+        missing = {name: set(indexes) for name, indexes in segment['missing'].items()}
+
+        def cell(name, index):
+            if name not in columns or index in missing.get(name, ()):
+                return _MISSING
+            return columns[name][index]
+
+        result = []
+        for index in range(start, stop):
+            if not all(p.test(cell(p.path[0], index)) for p in self.predicates):
+                continue
+            if self.paths is None:
+                record = {name: columns[name][index] for name in columns if index not in missing.get(name, ())}
+            else:
+                record = self._project_columns(lambda name: cell(name, index))
+            result.append((index - start, record))
+        return result
@@ -0,0 +1,450 @@
+"""Compaction des datasets du data lake en segments colonnaires.
+
+Le sink KSQL écrit un enregistrement par fichier JSON. Pour éviter un
+``open`` + décodage JSON par enregistrement à chaque lecture, les fichiers
+d'un dataset sont regroupés dans des segments stockés dans le sous-dossier
+``.segments`` du dataset :
+
+    <version.path>/<DATASET>/.segments/manifest.json
+    <version.path>/<DATASET>/.segments/seg-000001.json.gz
+
+Un segment est un JSON gzippé au format colonnaire (une liste de valeurs par
+champ de premier niveau). Le manifest liste les segments et, pour chacun, les
+fichiers source qu'il contient avec leur nombre d'enregistrements et leur
+``(taille, mtime_ns)`` au moment de la compaction. Les fichiers source ne sont
+jamais supprimés : tout fichier JSON absent du manifest est lu directement
+depuis le dossier (la « queue » non compactée), de même qu'une source réécrite
+depuis sa compaction, jusqu'à ce que la compaction suivante la sorte de son
+ancien segment pour la recompacter.
+"""
+import gzip
+import os
+import threading
+import time
+
+from .. import codec, instrumentation
+
+SEGMENT_DIR = '.segments'
+MANIFEST_NAME = 'manifest.json'
+SEGMENT_FORMAT = 'lake-segment'
+SEGMENT_FORMAT_VERSION = 1
+DEFAULT_SEGMENT_SIZE = 10000
+
+# Certains systèmes de fichiers n'ont qu'une résolution d'une à deux secondes
+# sur le mtime : un dossier modifié trop récemment est toujours relisté.
+MTIME_GRANULARITY = 2.0
+
+# Fichiers source par dataset : {dossier: (mtime_ns du dossier, heure du relevé, {filename: (taille, mtime_ns)})}
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def segment_dir(folder_path):
+    return os.path.join(folder_path, SEGMENT_DIR)
+
+
+def list_json_files(folder_path):
+    """Liste triée des fichiers JSON d'un dataset (les noms encodent la date d'écriture)"""
+    return sorted(name for name in os.listdir(folder_path) if name.endswith('.json'))
+
+
+def scan_sources(folder_path, fresh=False):
+    """``{filename: (taille, mtime_ns)}`` des fichiers JSON du dataset.
+
+    Comme pour le cache des datasets, le relevé est réutilisé tant que le
+    mtime du dossier n'a pas changé (et qu'il n'était pas trop récent lors du
+    relevé) ; ``fresh=True`` force un nouveau relevé.
+    """
+    folder_stat = os.stat(folder_path)
+    with _sources_lock:
+        cached = _sources.get(folder_path)
+    if (not fresh and cached is not None and cached[0] == folder_stat.st_mtime_ns
+            and cached[1] - folder_stat.st_mtime > MTIME_GRANULARITY):
+        return cached[2]
+    checked_at = time.time()
+    sources = {}
+    with os.scandir(folder_path) as it:
+        for item in it:
+            if not item.name.endswith('.json'):
+                continue
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            sources[item.name] = (stat.st_size, stat.st_mtime_ns)
+    with _sources_lock:
+        _sources[folder_path] = (folder_stat.st_mtime_ns, checked_at, sources)
+    return sources
+
+
+def _is_rewritten(sources, filename, stamp):
+    """Vrai si la source d'un fichier compacté existe et n'a plus la taille/le mtime relevés à la compaction"""
+    current = sources.get(filename)
+    return stamp is not None and current is not None and tuple(current) != tuple(stamp)
+
+
+def read_json_file(file_path):
+    """Lit un fichier du lake et retourne toujours une liste d'enregistrements"""
+    content = codec.load_file(file_path)
+    return content if isinstance(content, list) else [content]
+
+
+def read_manifest(folder_path):
+    """Retourne le manifest du dataset, ou None s'il n'a jamais été compacté"""
+    manifest_path = os.path.join(segment_dir(folder_path), MANIFEST_NAME)
+    try:
+        manifest = codec.load_file(manifest_path)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != SEGMENT_FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def write_atomic(path, payload, opener=open):
+    """Écrit ``payload`` en JSON dans ``path`` via un fichier temporaire propre à l'écrivain.
+
+    Un lecteur voit l'ancien contenu ou le nouveau, jamais un fichier partiel ;
+    deux écrivains concurrents ne partagent pas leur fichier temporaire.
+    """
+    tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        with opener(tmp_path, 'wb') as f:
+            f.write(codec.dumps(payload))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def encode_segment(files, counts, records):
+    """Transforme une liste d'enregistrements en segment colonnaire"""
+    columns = {}
+    for record in records:
+        for key in record:
+            if key not in columns:
+                columns[key] = []
+
+    missing = {}
+    for key, values in columns.items():
+        for index, record in enumerate(records):
+            if key in record:
+                values.append(record[key])
+            else:
+                values.append(None)
+                missing.setdefault(key, []).append(index)
+
+    return {
+        'format': SEGMENT_FORMAT,
+        'version': SEGMENT_FORMAT_VERSION,
+        'files': files,
+        'counts': counts,
+        'records': len(records),
+        'columns': columns,
+        'missing': missing,
+    }
+
+
+def decode_segment(segment, fields=None, start=0, stop=None):
+    """Reconstruit les enregistrements ``[start:stop]`` d'un segment.
+
+    ``fields`` permet de ne matérialiser qu'une partie des colonnes.
+    """
+    if stop is None:
+        stop = segment['records']
+    columns = segment['columns']
+    names = [name for name in columns if fields is None or name in fields]
+    missing = {name: set(segment['missing'].get(name, ())) for name in names}
+    records = []
+    for index in range(start, stop):
+        record = {}
+        for name in names:
+            if index not in missing[name]:
+                record[name] = columns[name][index]
+        records.append(record)
+    return records
+
+
+def read_segment(folder_path, segment_name):
+    segment_path = os.path.join(segment_dir(folder_path), segment_name)
+    with instrumentation.phase('io'):
+        with open(segment_path, 'rb') as f:
+            data = f.read()
+    instrumentation.record_file(len(data))
+    with instrumentation.phase('parse'):
+        segment = codec.loads(gzip.decompress(data))
+    if segment.get('format') != SEGMENT_FORMAT or segment.get('version') != SEGMENT_FORMAT_VERSION:
+        raise ValueError(f"Segment {segment_path} au format inconnu")
+    return segment
+
+
+def list_entries(folder_path, manifest=None, fresh=False):
+    """Liste ordonnée des fichiers logiques du dataset.
+
+    Chaque entrée est un tuple ``(filename, segment_name, count)`` : les
+    fichiers compactés (dans l'ordre des segments) puis la queue de fichiers
+    JSON non compactés, pour lesquels ``segment_name`` et ``count`` valent None.
+    Un fichier compacté dont la source a été réécrite depuis garde sa place
+    mais est lu depuis la source (``segment_name`` à None). ``fresh`` : voir
+    ``scan_sources``.
+    """
+    if manifest is None:
+        manifest = read_manifest(folder_path)
+    sources = scan_sources(folder_path, fresh=fresh)
+
+    entries = []
+    compacted = set()
+    if manifest:
+        for segment in manifest['segments']:
+            stamps = segment.get('stamps') or [None] * len(segment['files'])
+            for filename, count, stamp in zip(segment['files'], segment['counts'], stamps):
+                if _is_rewritten(sources, filename, stamp):
+                    entries.append((filename, None, None))
+                else:
+                    entries.append((filename, segment['name'], count))
+                compacted.add(filename)
+
+    for filename in sorted(sources):
+        if filename not in compacted:
+            entries.append((filename, None, None))
+    return entries
+
+
+def file_stamps(folder_path, entries, manifest=None):
+    """``{filename: (taille, mtime_ns)}`` identifiant le contenu de chaque entrée de ``list_entries``.
+
+    Le relevé de la source si elle existe ; pour un fichier compacté dont la
+    source a été supprimée, celui enregistré dans le manifest à la compaction,
+    à défaut celui du fichier segment (qui change si le segment est
+    reconstruit). Les entrées dont le segment a disparu sont omises.
+    """
+    sources = scan_sources(folder_path)
+    stamps = {}
+    recorded = None
+    segment_stamps = {}
+    for filename, segment_name, _count in entries:
+        if filename in sources:
+            stamps[filename] = tuple(sources[filename])
+            continue
+        if segment_name is None:
+            continue
+        if recorded is None:
+            if manifest is None:
+                manifest = read_manifest(folder_path) or {'segments': []}
+            recorded = {}
+            for segment in manifest['segments']:
+                for name, stamp in zip(segment['files'], segment.get('stamps') or ()):
+                    if stamp is not None:
+                        recorded[name] = tuple(stamp)
+        if filename in recorded:
+            stamps[filename] = recorded[filename]
+            continue
+        if segment_name not in segment_stamps:
+            try:
+                stat = os.stat(os.path.join(segment_dir(folder_path), segment_name))
+                segment_stamps[segment_name] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                segment_stamps[segment_name] = None
+        if segment_stamps[segment_name] is not None:
+            stamps[filename] = segment_stamps[segment_name]
+    return stamps
+
+
+def read_entries(folder_path, entries, fields=None):
+    """Charge les enregistrements des entrées données, fichier par fichier.
+
+    Retourne une liste de ``(filename, records)`` dans l'ordre des entrées.
+    Chaque segment n'est lu qu'une seule fois. Les fichiers illisibles sont
+    ignorés, comme dans l'ancienne lecture directe du dossier.
+    """
+    wanted_segments = {}
+    for filename, segment_name, _count in entries:
+        if segment_name is not None:
+            wanted_segments.setdefault(segment_name, set()).add(filename)
+
+    by_file = {}
+    for segment_name, filenames in wanted_segments.items():
+        try:
+            segment = read_segment(folder_path, segment_name)
+        except (OSError, ValueError):
+            continue
+        offset = 0
+        for filename, count in zip(segment['files'], segment['counts']):
+            if filename in filenames:
+                by_file[filename] = decode_segment(segment, fields=fields, start=offset, stop=offset + count)
+            offset += count
+
+    result = []
+    for filename, segment_name, _count in entries:
+        if segment_name is not None:
+            if filename in by_file:
+                result.append((filename, by_file[filename]))
+            continue
+        try:
+            records = read_json_file(os.path.join(folder_path, filename))
+        except Exception:
+            continue
+        if fields is not None:
+            records = [{k: v for k, v in record.items() if k in fields} for record in records]
+        result.append((filename, records))
+    return result
+
+
+def scan_entries(folder_path, entries, query):
+    """Comme ``read_entries`` mais en appliquant un ``LakeQuery`` pendant la lecture.
+
+    Retourne une liste de ``(filename, [(position dans le fichier, enregistrement)])``
+    ne contenant que les enregistrements retenus, déjà projetés. Dans les
+    segments, seules les colonnes utiles sont parcourues.
+    """
+    wanted_segments = {}
+    for filename, segment_name, _count in entries:
+        if segment_name is not None:
+            wanted_segments.setdefault(segment_name, set()).add(filename)
+
+    by_file = {}
+    for segment_name, filenames in wanted_segments.items():
+        try:
+            segment = read_segment(folder_path, segment_name)
+        except (OSError, ValueError):
+            continue
+        offset = 0
+        for filename, count in zip(segment['files'], segment['counts']):
+            if filename in filenames:
+                by_file[filename] = query.scan_segment(segment, offset, offset + count)
+            offset += count
+
+    result = []
+    for filename, segment_name, _count in entries:
+        if segment_name is not None:
+            if filename in by_file:
+                result.append((filename, by_file[filename]))
+            continue
+        try:
+            records = read_json_file(os.path.join(folder_path, filename))
+        except Exception:
+            continue
+        result.append((filename, query.apply(records)))
+    return result
+
+
+def iter_entries(folder_path, entries=None, batch_size=500):
+    """Parcourt le dataset par paquets de fichiers, sans le charger entièrement en mémoire.
+
+    Produit des ``(filename, records)`` dans l'ordre de ``list_entries``. Un
+    segment est lu en une fois ; les fichiers non compactés par ``batch_size``.
+    """
+    if entries is None:
+        entries = list_entries(folder_path)
+    batch = []
+    for entry in entries:
+        if batch and (entry[1] != batch[-1][1] or (entry[1] is None and len(batch) >= batch_size)):
+            yield from read_entries(folder_path, batch)
+            batch = []
+        batch.append(entry)
+    if batch:
+        yield from read_entries(folder_path, batch)
+
+
+def load_dataset(folder_path):
+    """Charge tout le dataset : segments compactés puis queue de fichiers JSON"""
+    data = []
+    for _filename, records in read_entries(folder_path, list_entries(folder_path)):
+        data.extend(records)
+    return data
+
+
+def compact_dataset(folder_path, segment_size=DEFAULT_SEGMENT_SIZE, rebuild=False):
+    """Compacte les fichiers JSON non encore compactés d'un dataset.
+
+    Les nouveaux fichiers sont ajoutés dans de nouveaux segments ; les segments
+    existants ne sont pas réécrits, sauf avec ``rebuild=True``. Retourne le
+    nombre de fichiers compactés.
+    """
+    seg_dir = segment_dir(folder_path)
+    os.makedirs(seg_dir, exist_ok=True)
+
+    manifest = None if rebuild else read_manifest(folder_path)
+    if manifest is None:
+        manifest = {'version': SEGMENT_FORMAT_VERSION, 'segments': []}
+
+    # Sources réécrites depuis leur compaction : retirées de leur segment pour être recompactées
+    sources = scan_sources(folder_path, fresh=True)
+    changed = False
+    for segment in manifest['segments']:
+        stamps = segment.get('stamps') or [None] * len(segment['files'])
+        kept = [
+            (filename, count, stamp)
+            for filename, count, stamp in zip(segment['files'], segment['counts'], stamps)
+            if not _is_rewritten(sources, filename, stamp)
+        ]
+        if len(kept) != len(segment['files']):
+            segment['files'] = [filename for filename, _count, _stamp in kept]
+            segment['counts'] = [count for _filename, count, _stamp in kept]
+            segment['stamps'] = [stamp for _filename, _count, stamp in kept]
+            segment['records'] = sum(segment['counts'])
+            changed = True
+    manifest['segments'] = [segment for segment in manifest['segments'] if segment['files']]
+
+    compacted = {name for segment in manifest['segments'] for name in segment['files']}
+    pending = [name for name in sorted(sources) if name not in compacted]
+    if not pending and not changed:
+        return 0
+
+    next_id = 1 + max((segment['id'] for segment in manifest['segments']), default=0)
+    old_segments = {name for name in os.listdir(seg_dir) if name.startswith('seg-')}
+    written = 0
+
+    files, counts, stamps, records = [], [], [], []
+
+    def flush():
+        nonlocal next_id
+        if not files:
+            return
+        name = f'seg-{next_id:06d}.json.gz'
+        write_atomic(os.path.join(seg_dir, name), encode_segment(files, counts, records),
+                      opener=gzip.open)
+        manifest['segments'].append({
+            'id': next_id,
+            'name': name,
+            'files': list(files),
+            'counts': list(counts),
+            'stamps': list(stamps),
+            'records': len(records),
+        })
+        next_id += 1
+        files.clear()
+        counts.clear()
+        stamps.clear()
+        records.clear()
+
+    for filename in pending:
+        try:
+            content = read_json_file(os.path.join(folder_path, filename))
+        except Exception:
+            # Fichier en cours d'écriture ou corrompu : il reste dans la queue
+            continue
+        files.append(filename)
+        counts.append(len(content))
+        # Relevé fait avant la lecture : une réécriture pendant la compaction sera détectée
+        stamps.append(list(sources[filename]))
+        records.extend(content)
+        written += 1
+        if len(records) >= segment_size:
+            flush()
+    flush()
+
+    write_atomic(os.path.join(seg_dir, MANIFEST_NAME), manifest)
+
+    if rebuild:
+        # Supprimer les segments qui ne sont plus référencés
+        current = {segment['name'] for segment in manifest['segments']}
+        for name in old_segments - current:
+            try:
+                os.remove(os.path.join(seg_dir, name))
+            except OSError:
+                pass
+    return written
@@ -0,0 +1,76 @@
+"""Index temporel des datasets : plage de TIMESTAMP de chaque fichier.
+
+Les requêtes bornées dans le temps (``?from=`` / ``?to=``) n'ont besoin que
+des fichiers dont la plage ``[min, max]`` de TIMESTAMP recoupe la fenêtre :
+``DatasetPager`` écarte les autres avant de les ouvrir ou de les compter.
+
+Les plages viennent du catalogue (``CatalogFile``, tenu à jour par
+``scan_lake`` et ``watch_lake``), gardé en mémoire par processus et rechargé
+quand le catalogue du dataset est rescanné. Les fichiers non compactés absents
+du catalogue sont lus une fois pour être comptés (voir ``paging.py``) : leur
+plage est mémorisée en même temps. Un fichier dont la plage est inconnue n'est
+jamais écarté, ses enregistrements sont filtrés à la lecture.
+
+Les fichiers du sink ne sont écrits qu'une fois : une plage connue pour un nom
+de fichier reste valable.
+"""
+import threading
+
+from django.db.models import Max
+
+from ..models import CatalogDataset, CatalogFile
+
+
+class TimeIndex:
+    """Plages ``(min, max)`` de TIMESTAMP connues des fichiers d'un dataset"""
+
+    def __init__(self, ranges=None):
+        self.ranges = ranges or {}
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def get(self, filename):
+        """``(min, max)`` du fichier, ``(None, None)`` s'il n'a aucun TIMESTAMP, None si inconnu"""
+        return self.ranges.get(filename)
+
+
+EMPTY_INDEX = TimeIndex()
+
+# {(chemin de la version, dataset): (date du dernier scan, TimeIndex)}
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_time_index(base_path, dataset_name):
+    """Index temporel d'un dataset d'après le catalogue des versions stockées à ``base_path``.
+
+    Une seule requête légère (date du dernier scan) tant que le catalogue du
+    dataset n'a pas changé ; les plages sont rechargées sinon.
+    """
+    key = (base_path, dataset_name)
+    scanned_at = CatalogDataset.objects.filter(
+        version__path=base_path, dataset_name=dataset_name
+    ).aggregate(last=Max('scanned_at'))['last']
+    if scanned_at is None:
+        with _indexes_lock:
+            _indexes.pop(key, None)
+        return EMPTY_INDEX
+
+    with _indexes_lock:
+        cached = _indexes.get(key)
+    if cached is not None and cached[0] == scanned_at:
+        return cached[1]
+
+    rows = CatalogFile.objects.filter(
+        version__path=base_path, dataset_name=dataset_name
+    ).values_list('filename', 'min_timestamp', 'max_timestamp')
+    index = TimeIndex({filename: (low, high) for filename, low, high in rows.iterator(chunk_size=5000)})
+    with _indexes_lock:
+        _indexes[key] = (scanned_at, index)
+    return index
+
+
+def clear():
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,164 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from myapp import benchmark, codec, views
+from myapp.access_log import get_access_log_writer
+from myapp.lake import keyindex, segments
+from myapp.lake.cache import get_dataset_cache
+from myapp.models import AccessRight, DataLakeVersion, Transaction
+from rest_framework.test import APIClient
+import base64
+import django
+import json
+import platform
+import shutil
+import tempfile
+import time
+
+def route_names(patterns):
+    """Noms des routes déclarées dans ``myapp/urls.py`` (routeur compris)"""
+    names = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names.extend(route_names(pattern.url_patterns))
+        elif isinstance(pattern, URLPattern) and pattern.name and pattern.name not in names:
+            names.append(pattern.name)
+    return names
+
+class Command(BaseCommand):
+    help = 'Benchmark every API route against a synthetic data lake and database (runs in a throwaway test database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=10000, help='Records per synthetic dataset')
+        parser.add_argument('--db-records', type=int, help='Rows in the Transaction table (default: --records)')
+        parser.add_argument('--datasets', nargs='+', default=benchmark.DEFAULT_DATASETS, help='Synthetic datasets to create')
+        parser.add_argument('--segment-size', type=int, default=segments.DEFAULT_SEGMENT_SIZE, help='Records per compacted segment')
+        parser.add_argument('--tail-files', type=int, default=100, help='Records per dataset left as single JSON files')
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per case')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per case')
+        parser.add_argument('--routes', nargs='+', help='Only benchmark these route names')
+        parser.add_argument('--lake-dir', help='Write the synthetic lake here and keep it (default: temporary directory)')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+        parser.add_argument('--compare', help='Previous JSON results to compare against')
+        parser.add_argument('--threshold', type=float, default=1.2, help='p50 ratio above which a case is reported as a regression')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = route_names(get_resolver('myapp.urls').url_patterns)
+        if options['routes']:
+            unknown = set(options['routes']) - set(names)
+            if unknown:
+                raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}')
+            names = [name for name in names if name in options['routes']]
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], 'rb') as f:
+                baseline = json.loads(f.read())
+
+        lake_dir = options['lake_dir'] or tempfile.mkdtemp(prefix='bench-lake-')
+        db_records = options['db_records'] if options['db_records'] is not None else options['records']
+
+        setup_test_environment()
+        # Les vues async authentifient chaque requête en Basic : un hachage rapide évite de mesurer PBKDF2
+        fast_hashing = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+        fast_hashing.enable()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        old_lake_path = views.DATA_LAKE_PATH
+        try:
+            started = time.perf_counter()
+            self.stdout.write(f'Writing {options["records"]} records x {len(options["datasets"])} datasets to {lake_dir}')
+            benchmark.write_synthetic_lake(
+                lake_dir, options['records'], datasets=options['datasets'],
+                segment_size=options['segment_size'], tail_files=options['tail_files'], seed=options['seed']
+            )
+            self.stdout.write(f'Inserting {db_records} transactions')
+            benchmark.populate_transactions(db_records, seed=options['seed'])
+
+            version = DataLakeVersion.objects.create(name='BENCH', path=lake_dir)
+            self.stdout.write('Indexing lake keys')
+            keyindex.index_version(version)
+            setup_seconds = time.perf_counter() - started
+            user = User.objects.create_user('benchmark', password='benchmark', is_staff=True)
+            for dataset_name in options['datasets']:
+                AccessRight.objects.create(user=user, dataset_name=dataset_name, can_access_all_versions=True)
+            views.DATA_LAKE_PATH = lake_dir
+
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user)
+            client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'benchmark:benchmark').decode('ascii'))
+            first = Transaction.objects.order_by('id').values_list('id', flat=True).first() or 1
+            cases = benchmark.route_cases(
+                options['datasets'][0], version.name, first, options['records'] * len(options['datasets'])
+            )
+
+            results = []
+            for name in names:
+                if name not in cases:
+                    self.stdout.write(self.style.WARNING(f'No benchmark case for route {name}'))
+                    continue
+                for case, url, params, headers in cases[name]:
+                    result = benchmark.measure(client, url, params, headers,
+                                               iterations=options['iterations'], warmup=options['warmup'])
+                    result.update({'route': name, 'case': case, 'url': url, 'params': params})
+                    results.append(result)
+                    self.stdout.write(
+                        f'{name:<24} {case:<18} p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms  '
+                        f'{result["throughput_rps"]:8.1f} req/s  {result["status_codes"]}'
+                    )
+        finally:
+            views.DATA_LAKE_PATH = old_lake_path
+            get_access_log_writer().shutdown()
+            get_dataset_cache().invalidate(lake_dir)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            fast_hashing.disable()
+            teardown_test_environment()
+            if not options['lake_dir']:
+                shutil.rmtree(lake_dir, ignore_errors=True)
+
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'records_per_dataset': options['records'],
+                'datasets': options['datasets'],
+                'db_records': db_records,
+                'segment_size': options['segment_size'],
+                'tail_files': options['tail_files'],
+                'iterations': options['iterations'],
+                'setup_seconds': setup_seconds,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'json_codec': codec.get_codec().name,
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                f.write(json.dumps(report, indent=2).encode('utf-8'))
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            self.compare(baseline, results, options['threshold'])
+
+        self.stdout.write(self.style.SUCCESS(f'Benchmarked {len(results)} cases'))
+
+    def compare(self, baseline, results, threshold):
+        previous = {(row['route'], row['case']): row for row in baseline.get('results', [])}
+        regressions = 0
+        for row in results:
+            old = previous.get((row['route'], row['case']))
+            if not old or not old.get('p50_ms'):
+                continue
+            ratio = row['p50_ms'] / old['p50_ms']
+            line = f'{row["route"]:<24} {row["case"]:<18} p50 {old["p50_ms"]:8.2f} -> {row["p50_ms"]:8.2f} ms (x{ratio:.2f})'
+            if ratio > threshold:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            self.stdout.write(self.style.WARNING(f'{regressions} case(s) slower than x{threshold} the baseline'))
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from myapp import codec
+from myapp.lake import segments
+from myapp.models import DataLakeVersion
+from rest_framework.renderers import JSONRenderer
+import json
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Measure per-record JSON parse and render cost of each codec on the TRANSACTIONS_* datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lake-version', dest='version_name', help='Read this DataLakeVersion (default: DATA_LAKE_PATH)')
+        parser.add_argument('--prefix', default='TRANSACTIONS_', help='Benchmark the datasets whose name starts with this prefix')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measure (the best one is kept)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def read_samples(self, base_path, prefix):
+        """Contenu brut (bytes) de chaque fichier JSON non compacté des datasets visés"""
+        samples = []
+        for dataset_name in sorted(os.listdir(base_path)):
+            folder_path = os.path.join(base_path, dataset_name)
+            if not dataset_name.startswith(prefix) or not os.path.isdir(folder_path):
+                continue
+            for filename in segments.list_json_files(folder_path):
+                with open(os.path.join(folder_path, filename), 'rb') as f:
+                    samples.append(f.read())
+        return samples
+
+    def best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        base_path = settings.DATA_LAKE_PATH
+        if options['version_name']:
+            version = DataLakeVersion.objects.filter(name=options['version_name']).first()
+            if version is None:
+                raise CommandError(f'Version {options["version_name"]} not found')
+            base_path = version.path
+        if not os.path.isdir(base_path):
+            raise CommandError(f'Data lake not found: {base_path}')
+
+        samples = self.read_samples(base_path, options['prefix'])
+        if not samples:
+            raise CommandError(f'No {options["prefix"]}* records found in {base_path}')
+        records = [json.loads(sample) for sample in samples]
+        repeat = max(1, options['repeat'])
+        total_bytes = sum(len(sample) for sample in samples)
+
+        results = []
+        for name, codec_class in sorted(codec.CODECS.items()):
+            instance = codec_class()
+            parse = self.best_of(repeat, lambda: [instance.loads(sample) for sample in samples])
+            render = self.best_of(repeat, lambda: [instance.dumps(record) for record in records])
+            render_page = self.best_of(repeat, lambda: instance.dumps({'results': records}))
+            results.append({
+                'codec': name,
+                'records': len(records),
+                'bytes': total_bytes,
+                'parse_us_per_record': parse / len(records) * 1e6,
+                'render_us_per_record': render / len(records) * 1e6,
+                'render_page_us_per_record': render_page / len(records) * 1e6,
+                'parse_mb_per_second': total_bytes / parse / 1e6 if parse else None,
+            })
+
+        # Référence : le rendu par défaut de DRF, utilisé avant FastJSONRenderer
+        renderer = JSONRenderer()
+        render_page = self.best_of(repeat, lambda: renderer.render({'results': records}))
+        results.append({
+            'codec': 'drf-json-renderer',
+            'records': len(records),
+            'bytes': total_bytes,
+            'parse_us_per_record': None,
+            'render_us_per_record': None,
+            'render_page_us_per_record': render_page / len(records) * 1e6,
+            'parse_mb_per_second': None,
+        })
+
+        if options['json']:
+            self.stdout.write(json.dumps({'active_codec': codec.get_codec().name, 'results': results}, indent=2))
+            return
+
+        self.stdout.write(f'{len(records)} records ({total_bytes} bytes) from {options["prefix"]}* in {base_path}')
+        self.stdout.write(f'{"codec":<20} {"parse us/rec":>14} {"render us/rec":>14} {"page us/rec":>12}')
+        for row in results:
+            cells = [
+                f'{row[key]:.2f}' if row[key] is not None else '-'
+                for key in ('parse_us_per_record', 'render_us_per_record', 'render_page_us_per_record')
+            ]
+            self.stdout.write(f'{row["codec"]:<20} {cells[0]:>14} {cells[1]:>14} {cells[2]:>12}')
+        self.stdout.write(self.style.SUCCESS(f'Active codec: {codec.get_codec().name}'))
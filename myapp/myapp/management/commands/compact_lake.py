@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.lake import segments
+from myapp.models import DataLakeVersion
+import os
+
+class Command(BaseCommand):
+    help = 'Compact the JSON files of each data lake dataset into columnar segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lake-version', dest='version_name', help='Only compact this DataLakeVersion (by name)')
+        parser.add_argument('--dataset', help='Only compact this dataset')
+        parser.add_argument(
+            '--segment-size', type=int,
+            default=getattr(settings, 'DATA_LAKE_SEGMENT_SIZE', segments.DEFAULT_SEGMENT_SIZE),
+            help='Maximum number of records per segment'
+        )
+        parser.add_argument('--rebuild', action='store_true', help='Rewrite all segments from the JSON files')
+
+    def handle(self, *args, **options):
+        versions = DataLakeVersion.objects.all()
+        if options['version_name']:
+            versions = versions.filter(name=options['version_name'])
+
+        total = 0
+        for version in versions:
+            if not os.path.isdir(version.path):
+                self.stdout.write(self.style.WARNING(f'Path not found for version {version.name}: {version.path}'))
+                continue
+
+            self.stdout.write(f'Processing version: {version.name}')
+            for dataset_name in sorted(os.listdir(version.path)):
+                if options['dataset'] and dataset_name != options['dataset']:
+                    continue
+                dataset_path = os.path.join(version.path, dataset_name)
+                if not os.path.isdir(dataset_path):
+                    continue
+
+                try:
+                    count = segments.compact_dataset(
+                        dataset_path,
+                        segment_size=options['segment_size'],
+                        rebuild=options['rebuild']
+                    )
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error compacting {dataset_path}: {str(e)}'))
+                    continue
+
+                total += count
+                self.stdout.write(f'  {dataset_name}: {count} file(s) compacted')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully compacted {total} file(s)'))
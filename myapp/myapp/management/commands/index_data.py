@@ -1,73 +1,60 @@
-from django.core.management.base import BaseCommand
-from myapp.documents import TransactionDocument, init_elasticsearch
+from django.core.management.base import BaseCommand, CommandError
+from myapp.indexing import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS, RebuildFailed, bulk_index, delete_removed_files, ensure_index,
+    incremental_tasks, list_datasets, rebuild_index, record_indexed_files, removed_files
+)
 from myapp.models import DataLakeVersion
-import os
-import json
-from datetime import datetime
 
 class Command(BaseCommand):
     help = 'Index all data from the data lake into Elasticsearch'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Documents per bulk request')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Threads reading dataset files in parallel')
+        parser.add_argument('--incremental', action='store_true', help='Only index files changed since the last run')
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild into a new index and swap the alias atomically')
+        parser.add_argument('--keep-old', action='store_true', help='With --rebuild, keep the previous index instead of deleting it')
+
     def handle(self, *args, **options):
-        # Initialiser l'index Elasticsearch
-        init_elasticsearch()
-        self.stdout.write('Initialized Elasticsearch index')
+        if options['incremental'] and options['rebuild']:
+            raise CommandError('--incremental and --rebuild are mutually exclusive')
 
-        # Parcourir toutes les versions du data lake
         versions = DataLakeVersion.objects.all()
-        for version in versions:
-            self.stdout.write(f'Processing version: {version.name}')
-            
-            # Parcourir tous les datasets dans cette version
-            base_path = version.path
-            for dataset_name in os.listdir(base_path):
-                dataset_path = os.path.join(base_path, dataset_name)
-                if not os.path.isdir(dataset_path):
-                    continue
-
-                self.stdout.write(f'Indexing dataset: {dataset_name}')
-                
-                # Parcourir tous les fichiers JSON dans le dataset
-                for filename in os.listdir(dataset_path):
-                    if not filename.endswith('.json'):
-                        continue
-
-                    file_path = os.path.join(dataset_path, filename)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            if isinstance(data, list):
-                                items = data
-                            else:
-                                items = [data]
-
-                            # Indexer chaque transaction
-                            for item in items:
-                                # Convertir le timestamp si présent
-                                timestamp = item.get('TIMESTAMP')
-                                if timestamp:
-                                    timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
-
-                                # Créer le document Elasticsearch
-                                doc = TransactionDocument(
-                                    meta={'id': f"{version.name}_{dataset_name}_{item.get('TRANSACTION_ID', '')}"},
-                                    transaction_id=item.get('TRANSACTION_ID', ''),
-                                    payment_method=item.get('PAYMENT_METHOD', ''),
-                                    country=item.get('LOCATION', {}).get('COUNTRY', ''),
-                                    product_category=item.get('PRODUCT_CATEGORY', ''),
-                                    status=item.get('STATUS', ''),
-                                    amount=float(item.get('AMOUNT', 0)),
-                                    customer_rating=item.get('CUSTOMER_RATING', 0),
-                                    timestamp=timestamp,
-                                    user_id=item.get('USER_ID', ''),
-                                    user_name=item.get('USER_NAME', ''),
-                                    product_id=item.get('PRODUCT_ID', ''),
-                                    dataset_source=dataset_name,
-                                    version=version.name
-                                )
-                                doc.save()
-
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f'Error processing file {file_path}: {str(e)}'))
 
-        self.stdout.write(self.style.SUCCESS('Successfully indexed all data'))
+        if options['rebuild']:
+            tasks = list_datasets(versions)
+            self.stdout.write(f'Rebuilding index from {len(tasks)} datasets with {options["workers"]} workers')
+            try:
+                new_index, stats = rebuild_index(
+                    tasks,
+                    chunk_size=options['chunk_size'],
+                    workers=options['workers'],
+                    keep_old=options['keep_old']
+                )
+            except RebuildFailed as e:
+                for error in e.stats.error_samples:
+                    self.stdout.write(self.style.ERROR(f'Error: {error}'))
+                raise CommandError(str(e))
+            record_indexed_files(stats.succeeded_files, reset=True)
+            self.stdout.write(f'Alias now points to {new_index}')
+        else:
+            # Initialiser l'index Elasticsearch
+            ensure_index()
+            self.stdout.write('Initialized Elasticsearch index')
+
+            tasks = incremental_tasks(versions) if options['incremental'] else list_datasets(versions)
+            self.stdout.write(f'Indexing {len(tasks)} datasets with {options["workers"]} workers')
+            stats = bulk_index(tasks, chunk_size=options['chunk_size'], workers=options['workers'])
+            record_indexed_files(stats.succeeded_files)
+
+            removed = removed_files(versions)
+            if removed:
+                deleted = delete_removed_files(removed)
+                self.stdout.write(f'Removed {deleted} documents from {len(removed)} deleted files')
+
+        for dataset, count in sorted(stats.by_dataset.items()):
+            self.stdout.write(f'  {dataset}: {count} records')
+        for error in stats.error_samples:
+            self.stdout.write(self.style.ERROR(f'Error: {error}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully indexed {stats}'))
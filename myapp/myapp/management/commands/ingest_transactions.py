@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from myapp.ingestion import DEFAULT_BATCH_SIZE, TRANSACTIONS_DATASET, ingest_transactions
+from myapp.models import DataLakeVersion
+
+class Command(BaseCommand):
+    help = 'Incrementally load new or changed data lake files into the Transaction table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lake-version', dest='version_name', help='Only ingest this DataLakeVersion (default: all active versions)')
+        parser.add_argument('--dataset', default=TRANSACTIONS_DATASET, help='Dataset to import')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per bulk_create chunk')
+
+    def handle(self, *args, **options):
+        versions = DataLakeVersion.objects.filter(is_active=True)
+        if options['version_name']:
+            versions = DataLakeVersion.objects.filter(name=options['version_name'])
+            if not versions.exists():
+                raise CommandError(f"Version {options['version_name']} not found")
+
+        for version in versions:
+            self.stdout.write(f"Ingesting {options['dataset']} from version {version.name}")
+            try:
+                stats = ingest_transactions(version, options['dataset'], batch_size=options['batch_size'])
+            except FileNotFoundError as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(f'Successfully ingested {stats}'))
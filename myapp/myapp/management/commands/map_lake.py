@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from myapp.lake import mapped
+from myapp.models import DataLakeVersion
+import os
+
+class Command(BaseCommand):
+    help = 'Write the memory-mapped columnar store of hot data lake datasets, shared by all worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lake-version', dest='version_name', help='Only map this DataLakeVersion (by name)')
+        parser.add_argument('--dataset', action='append', dest='datasets',
+                            help='Map this dataset (repeatable, default: DATA_LAKE_MAPPED_DATASETS)')
+        parser.add_argument('--all', action='store_true', help='Map every dataset')
+        parser.add_argument('--remove', action='store_true', help='Delete the mapped stores instead of writing them')
+
+    def handle(self, *args, **options):
+        versions = DataLakeVersion.objects.all()
+        if options['version_name']:
+            versions = versions.filter(name=options['version_name'])
+        wanted = options['datasets'] or getattr(settings, 'DATA_LAKE_MAPPED_DATASETS', [])
+
+        total = 0
+        for version in versions:
+            if not os.path.isdir(version.path):
+                self.stdout.write(self.style.WARNING(f'Path not found for version {version.name}: {version.path}'))
+                continue
+
+            self.stdout.write(f'Processing version: {version.name}')
+            for dataset_name in sorted(os.listdir(version.path)):
+                if not options['all'] and dataset_name not in wanted:
+                    continue
+                dataset_path = os.path.join(version.path, dataset_name)
+                if not os.path.isdir(dataset_path):
+                    continue
+
+                if options['remove']:
+                    if mapped.remove_store(dataset_path):
+                        total += 1
+                        self.stdout.write(f'  {dataset_name}: mapped store removed')
+                    continue
+
+                try:
+                    records, size = mapped.build_store(dataset_path)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error mapping {dataset_path}: {str(e)}'))
+                    continue
+
+                total += 1
+                self.stdout.write(f'  {dataset_name}: {records} record(s), {size / 1024:.0f} KiB')
+
+        action = 'removed' if options['remove'] else 'wrote'
+        self.stdout.write(self.style.SUCCESS(f'Successfully {action} {total} mapped store(s)'))
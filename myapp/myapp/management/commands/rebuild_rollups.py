@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from myapp.rollups import rebuild_rollups
+
+class Command(BaseCommand):
+    help = 'Recompute the statistics rollup tables from the Transaction table'
+
+    def handle(self, *args, **options):
+        users, products = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {users} user rollups and {products} product rollups'))
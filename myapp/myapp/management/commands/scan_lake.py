@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from myapp.lake import catalog
+from myapp.models import DataLakeVersion
+
+class Command(BaseCommand):
+    help = 'Refresh the data lake metadata catalog (files, record counts, sizes, TIMESTAMP range, schema)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lake-version', dest='version_name', help='Only scan this DataLakeVersion (default: all active versions)')
+        parser.add_argument('--dataset', action='append', dest='datasets', help='Only scan this dataset (repeatable)')
+        parser.add_argument('--rebuild', action='store_true', help='Re-read every file instead of only new or changed ones')
+
+    def handle(self, *args, **options):
+        versions = DataLakeVersion.objects.filter(is_active=True)
+        if options['version_name']:
+            versions = DataLakeVersion.objects.filter(name=options['version_name'])
+            if not versions.exists():
+                raise CommandError(f"Version {options['version_name']} not found")
+
+        for version in versions:
+            self.stdout.write(f'Scanning version {version.name}')
+            try:
+                stats = catalog.scan_version(version, dataset_names=options['datasets'], rebuild=options['rebuild'])
+            except FileNotFoundError as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(f'Successfully scanned {stats}'))
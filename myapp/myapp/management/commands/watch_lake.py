@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from myapp import watcher
+
+class Command(BaseCommand):
+    help = 'Watch the active data lake versions and push new files to the catalog, the Transaction table, Elasticsearch and caches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', nargs='+', choices=sorted(watcher.CONSUMERS), help='Consumers to feed (default: LAKE_WATCHER_CONSUMERS)')
+        parser.add_argument('--poll', action='store_true', help='Poll the folders instead of using inotify')
+        parser.add_argument('--interval', type=float, help='Polling interval in seconds')
+        parser.add_argument('--batch-size', type=int, help='Deliver as soon as this many files are pending')
+        parser.add_argument('--batch-delay', type=float, help='Deliver pending files after this many seconds')
+        parser.add_argument('--once', action='store_true', help='Deliver a full catch-up of every dataset, then exit')
+
+    def handle(self, *args, **options):
+        try:
+            lake_watcher = watcher.LakeWatcher(
+                consumers=options['consumers'],
+                polling=options['poll'],
+                poll_interval=options['interval'],
+                batch_size=options['batch_size'],
+                batch_delay=options['batch_delay'],
+                log=lambda message: self.stdout.write(message),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        consumers = ', '.join(lake_watcher.consumers)
+        self.stdout.write(f'Watching with {lake_watcher.source.name} for: {consumers} (status in {lake_watcher.status_path})')
+        try:
+            lake_watcher.run(once=options['once'])
+        except KeyboardInterrupt:
+            lake_watcher.stop()
+
+        for name, state in lake_watcher.consumers.items():
+            self.stdout.write(f'  {name}: {state.delivered_batches} batches, {state.delivered_files} files, '
+                              f'{state.pending_files} pending, {state.failures} failures')
+        self.stdout.write(self.style.SUCCESS(f'Watched {len(lake_watcher.datasets)} datasets'))
@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:40
+
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def _signature(user_id, product_id, payment_method, amount, timestamp):
+    return (user_id, product_id, payment_method, Decimal(str(amount)).quantize(Decimal('0.01')), timestamp)
+
+
+def _lake_records(folder_path):
+    """Enregistrements lus par l'ancien import paresseux : fichiers JSON à la racine du dossier"""
+    for filename in sorted(os.listdir(folder_path)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        yield from data if isinstance(data, list) else [data]
+
+
+def backfill_transaction_ids(apps, schema_editor):
+    """Rattache les lignes de l'ancien import paresseux à leur TRANSACTION_ID.
+
+    Ces lignes n'ont pas de ``transaction_id`` : sans lui, le premier
+    ``ingest_transactions`` les réinsérerait toutes. Chaque enregistrement du
+    lake est apparié à une ligne de mêmes utilisateur, produit, moyen de
+    paiement, montant et TIMESTAMP (converti comme le faisait l'ancien
+    import). Les lignes en trop pour un même enregistrement (import lancé deux
+    fois) ou pour un TRANSACTION_ID déjà attribué sont des doublons et sont
+    supprimées. Les lignes sans correspondance (créées par l'API) sont
+    laissées telles quelles.
+    """
+    Transaction = apps.get_model('myapp', 'Transaction')
+    legacy = Transaction.objects.filter(transaction_id__isnull=True)
+    folder_path = os.path.join(getattr(settings, 'DATA_LAKE_PATH', ''), 'TRANSACTIONS_COMPLETED')
+    if not legacy.exists() or not os.path.isdir(folder_path):
+        return
+
+    rows = {}
+    for row in legacy.values_list('id', 'user_id', 'product_id', 'payment_method', 'amount', 'timestamp').iterator():
+        rows.setdefault(_signature(*row[1:]), []).append(row[0])
+
+    default_timezone = timezone.get_default_timezone()
+    assigned, duplicates, seen, matched = [], [], set(), set()
+    for item in _lake_records(folder_path):
+        try:
+            timestamp = timezone.make_aware(
+                datetime.strptime(item['TIMESTAMP'], "%Y-%m-%dT%H:%M:%S.%fZ"), default_timezone
+            )
+            key = _signature(item.get('USER_ID', 'Unknown'), item.get('PRODUCT_ID', 'Unknown'),
+                             item.get('PAYMENT_METHOD', 'Unknown'), float(item.get('AMOUNT', 0)), timestamp)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            continue
+        transaction_id = item.get('TRANSACTION_ID')
+        candidates = rows.get(key)
+        if not transaction_id or not candidates:
+            continue
+        row_id = candidates.pop(0)
+        matched.add(key)
+        if transaction_id in seen:
+            duplicates.append(row_id)
+        else:
+            seen.add(transaction_id)
+            assigned.append(Transaction(id=row_id, transaction_id=str(transaction_id)[:50]))
+
+    for key in matched:
+        duplicates.extend(rows[key])
+
+    Transaction.objects.bulk_update(assigned, ['transaction_id'], batch_size=1000)
+    for start in range(0, len(duplicates), 500):
+        Transaction.objects.filter(id__in=duplicates[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0002_datalakeversion_accessright_can_access_all_versions_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='transaction_id',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='IngestedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_name', models.CharField(max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('rows', models.IntegerField(default=0)),
+                ('ingested_at', models.DateTimeField(auto_now=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.datalakeversion')),
+            ],
+            options={
+                'unique_together': {('version', 'dataset_name', 'filename')},
+            },
+        ),
+        migrations.RunPython(backfill_transaction_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_transaction_id_ingestedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_name', models.CharField(max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.datalakeversion')),
+            ],
+            options={
+                'unique_together': {('version', 'dataset_name', 'filename')},
+            },
+        ),
+    ]
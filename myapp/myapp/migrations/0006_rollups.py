@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+def rebuild_rollups(apps, schema_editor):
+    # Agrégats initiaux d'une base existante, sans attendre la commande rebuild_rollups
+    from myapp.rollups import rebuild_rollups
+    rebuild_rollups(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_access_log_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(blank=True, max_length=50)),
+                ('product_category', models.CharField(max_length=100)),
+                ('total_bought', models.IntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-total_bought'], name='product_rollup_bought_idx')],
+                'unique_together': {('product_id', 'product_category')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserSpendingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(blank=True, max_length=50)),
+                ('status', models.CharField(max_length=50)),
+                ('payment_method', models.CharField(max_length=50)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('transaction_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('user_id', 'status', 'payment_method')},
+            },
+        ),
+        migrations.RunPython(rebuild_rollups, migrations.RunPython.noop),
+    ]
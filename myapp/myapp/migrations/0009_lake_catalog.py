@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_transaction_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogDataset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_name', models.CharField(max_length=100)),
+                ('files', models.IntegerField(default=0)),
+                ('records', models.BigIntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('min_timestamp', models.DateTimeField(null=True)),
+                ('max_timestamp', models.DateTimeField(null=True)),
+                ('schema_fingerprint', models.CharField(blank=True, max_length=64)),
+                ('schemas', models.JSONField(default=dict)),
+                ('scanned_at', models.DateTimeField(auto_now=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_datasets', to='myapp.datalakeversion')),
+            ],
+            options={
+                'unique_together': {('version', 'dataset_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_name', models.CharField(max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('segment_name', models.CharField(blank=True, max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('records', models.IntegerField(default=0)),
+                ('min_timestamp', models.DateTimeField(null=True)),
+                ('max_timestamp', models.DateTimeField(null=True)),
+                ('schema_fingerprint', models.CharField(blank=True, max_length=64)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.datalakeversion')),
+            ],
+            options={
+                'unique_together': {('version', 'dataset_name', 'filename')},
+            },
+        ),
+    ]
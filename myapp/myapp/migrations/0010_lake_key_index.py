@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_lake_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyIndexedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_name', models.CharField(max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('keys', models.IntegerField(default=0)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.datalakeversion')),
+            ],
+            options={
+                'unique_together': {('version', 'dataset_name', 'filename')},
+            },
+        ),
+        migrations.CreateModel(
+            name='LakeKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_name', models.CharField(max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('offset', models.IntegerField()),
+                ('field', models.CharField(choices=[('TRANSACTION_ID', 'TRANSACTION_ID'), ('USER_ID', 'USER_ID'), ('PRODUCT_ID', 'PRODUCT_ID')], max_length=20)),
+                ('value', models.CharField(max_length=100)),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myapp.datalakeversion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['field', 'value'], name='lake_key_lookup_idx'), models.Index(fields=['version', 'dataset_name', 'filename'], name='lake_key_file_idx')],
+            },
+        ),
+    ]
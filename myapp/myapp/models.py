@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from rest_framework import serializers
 
@@ -32,17 +33,18 @@ class AccessRightSerializer(serializers.ModelSerializer):
 
 class AccessLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Horodaté à la requête : l'écriture en base peut être différée (voir access_log.py)
+    timestamp = models.DateTimeField(default=timezone.now)
     request_path = models.CharField(max_length=255)
     request_method = models.CharField(max_length=10)
     request_body = models.TextField(blank=True)
 
 class DetailedAccessLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     dataset_name = models.CharField(max_length=100)
     version = models.ForeignKey(DataLakeVersion, on_delete=models.SET_NULL, null=True)
-    access_type = models.CharField(max_length=20)  # 'read', 'list', 'version_check'
+    access_type = models.CharField(max_length=20)  # 'read', 'list', 'version_check', 'export'
     success = models.BooleanField(default=True)
     error_message = models.TextField(blank=True)
 
@@ -50,20 +52,176 @@ class DetailedAccessLog(models.Model):
         return f"{self.user.username} - {self.dataset_name} ({self.version})"
 
 class Transaction(models.Model):
+    transaction_id = models.CharField(max_length=50, unique=True, null=True, blank=True)
     payment_method = models.CharField(max_length=50)
     country = models.CharField(max_length=100)
     product_category = models.CharField(max_length=100)
     status = models.CharField(max_length=50)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     customer_rating = models.IntegerField(null=True)
-    timestamp = models.DateTimeField()
+    timestamp = models.DateTimeField(db_index=True)
     user_id = models.CharField(max_length=50, null=True, blank=True)
     user_name = models.CharField(max_length=100, null=True, blank=True)
     product_id = models.CharField(max_length=50, null=True, blank=True)
 
+    class Meta:
+        # Index alignés sur TransactionFilter et TransactionViewSet.ordering_fields
+        # (les filtres icontains et la recherche ne peuvent pas utiliser d'index B-tree).
+        # Le plan de chaque combinaison est vérifié dans tests.py.
+        indexes = [
+            models.Index(fields=['payment_method', 'country'], name='transaction_payment_idx'),
+            models.Index(fields=['country', 'timestamp'], name='transaction_country_idx'),
+            models.Index(fields=['product_category', 'timestamp'], name='transaction_category_idx'),
+            models.Index(fields=['status', 'timestamp'], name='transaction_status_idx'),
+            models.Index(fields=['user_id', 'timestamp'], name='transaction_user_idx'),
+            models.Index(fields=['product_id', 'timestamp'], name='transaction_product_idx'),
+            models.Index(fields=['user_name'], name='transaction_user_name_idx'),
+            models.Index(fields=['amount'], name='transaction_amount_idx'),
+            models.Index(fields=['customer_rating'], name='transaction_rating_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user_name or 'Unknown'} - {self.product_category} - {self.amount} ({self.status})"
 
+class UserSpendingRollup(models.Model):
+    """Agrégat des transactions par utilisateur, statut et méthode de paiement (voir rollups.py)"""
+    # Clés non nulles : un user_id absent est stocké comme '' pour que l'upsert le retrouve
+    user_id = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=50)
+    payment_method = models.CharField(max_length=50)
+    total_spent = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    transaction_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user_id', 'status', 'payment_method')
+
+class ProductRollup(models.Model):
+    """Agrégat des transactions par produit (voir rollups.py)"""
+    product_id = models.CharField(max_length=50, blank=True)
+    product_category = models.CharField(max_length=100)
+    total_bought = models.IntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('product_id', 'product_category')
+        indexes = [models.Index(fields=['-total_bought'], name='product_rollup_bought_idx')]
+
+class SpendingChange(models.Model):
+    """Variation des montants dépensés à un TIMESTAMP, journalisée à chaque écriture sur Transaction (voir streaming.py)"""
+    timestamp = models.DateTimeField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+class IngestedFile(models.Model):
+    """Fichier du data lake déjà importé dans la table Transaction"""
+    version = models.ForeignKey(DataLakeVersion, on_delete=models.CASCADE)
+    dataset_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    sha256 = models.CharField(max_length=64)
+    rows = models.IntegerField(default=0)
+    ingested_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('version', 'dataset_name', 'filename')
+
+    def __str__(self):
+        return f"{self.version.name} - {self.dataset_name}/{self.filename}"
+
+class IndexedFile(models.Model):
+    """Fichier du data lake déjà indexé dans Elasticsearch"""
+    version = models.ForeignKey(DataLakeVersion, on_delete=models.CASCADE)
+    dataset_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('version', 'dataset_name', 'filename')
+
+    def __str__(self):
+        return f"{self.version.name} - {self.dataset_name}/{self.filename}"
+
+class CatalogDataset(models.Model):
+    """Métadonnées d'un dataset d'une version du lake, tenues à jour par ``lake/catalog.py``"""
+    version = models.ForeignKey(DataLakeVersion, on_delete=models.CASCADE, related_name='catalog_datasets')
+    dataset_name = models.CharField(max_length=100)
+    files = models.IntegerField(default=0)
+    records = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)  # octets des fichiers JSON source
+    min_timestamp = models.DateTimeField(null=True)
+    max_timestamp = models.DateTimeField(null=True)
+    schema_fingerprint = models.CharField(max_length=64, blank=True)
+    schemas = models.JSONField(default=dict)  # empreinte -> liste triée des champs
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('version', 'dataset_name')
+
+    def __str__(self):
+        return f"{self.version.name} - {self.dataset_name}"
+
+class CatalogFile(models.Model):
+    """Fichier d'un dataset dans le catalogue : nombre d'enregistrements, taille, plage de TIMESTAMP"""
+    version = models.ForeignKey(DataLakeVersion, on_delete=models.CASCADE)
+    dataset_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    segment_name = models.CharField(max_length=100, blank=True)  # vide si le fichier n'est pas compacté
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    records = models.IntegerField(default=0)
+    min_timestamp = models.DateTimeField(null=True)
+    max_timestamp = models.DateTimeField(null=True)
+    schema_fingerprint = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        unique_together = ('version', 'dataset_name', 'filename')
+
+    def __str__(self):
+        return f"{self.version.name} - {self.dataset_name}/{self.filename}"
+
+class LakeKey(models.Model):
+    """Emplacement d'un enregistrement du lake par clé (index secondaire de ``lake/keyindex.py``)"""
+    FIELD_CHOICES = [
+        ('TRANSACTION_ID', 'TRANSACTION_ID'),
+        ('USER_ID', 'USER_ID'),
+        ('PRODUCT_ID', 'PRODUCT_ID'),
+    ]
+
+    version = models.ForeignKey(DataLakeVersion, on_delete=models.CASCADE)
+    dataset_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    offset = models.IntegerField()  # position de l'enregistrement dans le fichier
+    field = models.CharField(max_length=20, choices=FIELD_CHOICES)
+    value = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['field', 'value'], name='lake_key_lookup_idx'),
+            models.Index(fields=['version', 'dataset_name', 'filename'], name='lake_key_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.field}={self.value} -> {self.version.name} - {self.dataset_name}/{self.filename}#{self.offset}"
+
+class KeyIndexedFile(models.Model):
+    """Fichier du lake dont les clés sont dans ``LakeKey`` (pour l'indexation incrémentale)"""
+    version = models.ForeignKey(DataLakeVersion, on_delete=models.CASCADE)
+    dataset_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    keys = models.IntegerField(default=0)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('version', 'dataset_name', 'filename')
+
+    def __str__(self):
+        return f"{self.version.name} - {self.dataset_name}/{self.filename}"
+
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
@@ -0,0 +1,230 @@
+"""Pagination par curseur (keyset) de ``/myapp/transactions/``.
+
+Une page est lue avec ``WHERE (tri, id) > (dernière valeur, dernier id)
+ORDER BY tri, id LIMIT n`` au lieu d'un ``OFFSET`` : le coût ne dépend plus de
+la profondeur de la page et les index de tri (voir ``Transaction.Meta``) sont
+utilisés. ``id`` départage les valeurs égales, ce qui rend l'ordre stable.
+
+Le tri vient du paramètre ``ordering`` (un seul champ parmi
+``ordering_fields`` du viewset, ``-`` pour décroissant), ``id`` par défaut.
+Le curseur est opaque et lié à ce tri : changer ``ordering`` en gardant le
+curseur donne une erreur 404 ``Invalid cursor``, comme la pagination par
+curseur de DRF.
+
+``?count=`` choisit le total renvoyé : ``exact`` (``COUNT(*)``),
+``estimate`` (statistiques de la base sans filtre, sinon comptage borné à
+``TRANSACTION_COUNT_ESTIMATE_LIMIT``) ou ``none``.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+DEFAULT_ESTIMATE_LIMIT = 10000
+
+
+def encode_cursor(ordering, value, pk, reverse=False):
+    payload = json.dumps({'o': ordering, 'v': value, 'i': pk, 'r': int(reverse)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return payload['o'], payload['v'], int(payload['i']), bool(payload['r'])
+    except (ValueError, TypeError, KeyError):
+        raise NotFound('Invalid cursor')
+
+
+def estimated_count(queryset, limit):
+    """``(count, estimé ?)`` sans ``COUNT(*)`` complet"""
+    if not queryset.query.where:
+        table = queryset.model._meta.db_table
+        try:
+            # Savepoint : une requête en échec ne doit pas casser la transaction en cours
+            with transaction.atomic(), connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+                elif connection.vendor == 'sqlite':
+                    # sqlite_stat1 n'existe qu'après ANALYZE. Chaque ligne d'un index
+                    # commence par le nombre de lignes de la table ; la ligne
+                    # ``idx IS NULL`` n'est écrite que pour une table sans index.
+                    cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s ORDER BY idx IS NULL LIMIT 1', [table])
+                else:
+                    cursor.execute('SELECT NULL WHERE 1 = 0')
+                row = cursor.fetchone()
+        except DatabaseError:
+            row = None
+        rows = _leading_integer(row[0]) if row else None
+        if rows is not None and rows >= 0:
+            return rows, True
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, True
+    return count, False
+
+
+def _leading_integer(value):
+    try:
+        return int(str(value).split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+class TransactionCursorPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_ordering = 'id'
+    tiebreaker = 'id'
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'Expected an integer'})
+        if size <= 0:
+            raise ValidationError({self.page_size_query_param: 'Expected a positive integer'})
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        """Premier champ de ``ordering`` validé par ``OrderingFilter``"""
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or [self.default_ordering]
+        return ordering[0]
+
+    def get_count_mode(self, request):
+        mode = request.query_params.get(
+            self.count_query_param, getattr(settings, 'TRANSACTION_COUNT_MODE', 'exact')
+        )
+        if mode not in COUNT_MODES:
+            raise ValidationError({self.count_query_param: f"Expected one of {', '.join(COUNT_MODES)}"})
+        return mode
+
+    def _order_by(self, field_name, descending, nullable):
+        if not nullable:
+            return '-' + field_name if descending else field_name
+        # Les NULL sont en tête dans l'ordre croissant, à la fin dans l'ordre décroissant
+        if descending:
+            return F(field_name).desc(nulls_last=True)
+        return F(field_name).asc(nulls_first=True)
+
+    def _after(self, field_name, descending, nullable, value, pk):
+        """Condition des lignes situées après ``(value, pk)`` dans l'ordre de lecture"""
+        op = 'lt' if descending else 'gt'
+        after_pk = Q(**{f'{self.tiebreaker}__{op}': pk})
+        if value is None:
+            ties = Q(**{f'{field_name}__isnull': True}) & after_pk
+            return ties if descending else ties | Q(**{f'{field_name}__isnull': False})
+        condition = Q(**{f'{field_name}__{op}': value}) | (Q(**{field_name: value}) & after_pk)
+        if nullable and descending:
+            condition |= Q(**{f'{field_name}__isnull': True})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        descending = self.ordering.startswith('-')
+        field_name = self.ordering.lstrip('-')
+        field = queryset.model._meta.get_field(field_name)
+        nullable = field.null
+
+        self.count = None
+        self.count_estimated = False
+        mode = self.get_count_mode(request)
+        if mode == 'exact':
+            self.count = queryset.order_by().count()
+        elif mode == 'estimate':
+            self.count, self.count_estimated = estimated_count(
+                queryset, getattr(settings, 'TRANSACTION_COUNT_ESTIMATE_LIMIT', DEFAULT_ESTIMATE_LIMIT)
+            )
+
+        reverse = False
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            ordering, value, pk, reverse = decode_cursor(cursor)
+            if ordering != self.ordering:
+                raise NotFound('Invalid cursor')
+            try:
+                value = None if value is None else field.to_python(value)
+            except Exception:
+                raise NotFound('Invalid cursor')
+            # Une page précédente se lit dans l'ordre inverse puis est retournée
+            read_descending = descending != reverse
+            queryset = queryset.filter(self._after(field_name, read_descending, nullable, value, pk))
+        read_descending = descending != reverse
+
+        queryset = queryset.order_by(
+            self._order_by(field_name, read_descending, nullable),
+            '-' + self.tiebreaker if read_descending else self.tiebreaker,
+        )
+        rows = list(queryset[:self.page_size_value + 1])
+        has_more = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else bool(cursor)
+        self.field_name = field_name
+        return rows
+
+    def _link(self, obj, reverse):
+        url = self.request.build_absolute_uri()
+        value = getattr(obj, self.field_name)
+        if value is not None and not isinstance(value, (int, float, str)):
+            value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            encode_cursor(self.ordering, value, getattr(obj, self.tiebreaker), reverse)
+        )
+
+    def get_next_link(self):
+        if not self.page or not self.has_next:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count
+            response['count_estimated'] = self.count_estimated
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'count_estimated': {'type': 'boolean'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
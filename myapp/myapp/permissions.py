@@ -0,0 +1,105 @@
+"""Droits d'accès compilés par utilisateur.
+
+Les ``AccessRight`` d'un utilisateur sont chargés en une seule requête et
+compilés en un ensemble ``dataset -> versions autorisées``. Le résultat est
+gardé sur l'objet utilisateur pour la durée de la requête et dans le cache
+Django entre les requêtes, sous une clé qui inclut un compteur de génération
+global et un compteur par utilisateur. Les signaux de ``signals.py``
+incrémentent ces compteurs quand un ``AccessRight`` ou une ``DataLakeVersion``
+change, ce qui rend les anciennes entrées inaccessibles.
+
+Avec le cache par défaut (``LocMemCache``), l'invalidation ne touche que le
+processus qui a fait la modification : les autres processus gardent au plus
+``DATASET_PERMISSIONS_CACHE_TIMEOUT`` secondes une version périmée. Configurer
+un cache partagé (Redis, Memcached) dans ``CACHES`` pour une invalidation
+immédiate partout.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import AccessRight
+
+DEFAULT_TIMEOUT = 60
+GENERATION_KEY = 'dataset_permissions:generation'
+
+
+class DatasetPermissions:
+    def __init__(self, rights):
+        # {dataset_name: (can_access_all_versions, frozenset(version ids))}
+        self.rights = rights
+
+    @property
+    def datasets(self):
+        return sorted(self.rights)
+
+    def can_access(self, dataset_name):
+        return dataset_name in self.rights
+
+    def can_access_version(self, dataset_name, version_id):
+        right = self.rights.get(dataset_name)
+        if right is None:
+            return False
+        all_versions, version_ids = right
+        return all_versions or version_id in version_ids
+
+
+def compile_permissions(user):
+    """Charge les droits de l'utilisateur en une requête"""
+    rights = {}
+    rows = AccessRight.objects.filter(user=user).values_list(
+        'dataset_name', 'can_access_all_versions', 'allowed_versions__id'
+    )
+    for dataset_name, all_versions, version_id in rows:
+        _all, version_ids = rights.get(dataset_name, (all_versions, set()))
+        if version_id is not None:
+            version_ids.add(version_id)
+        rights[dataset_name] = (all_versions, version_ids)
+    return DatasetPermissions({
+        name: (all_versions, frozenset(version_ids))
+        for name, (all_versions, version_ids) in rights.items()
+    })
+
+
+def _user_generation_key(user_id):
+    return f'dataset_permissions:user_generation:{user_id}'
+
+
+def _cache_key(user_id):
+    """Clé des droits compilés ; elle change à chaque invalidation globale ou de l'utilisateur"""
+    user_key = _user_generation_key(user_id)
+    generations = cache.get_many([GENERATION_KEY, user_key])
+    return f'dataset_permissions:{generations.get(GENERATION_KEY, 0)}:{generations.get(user_key, 0)}:{user_id}'
+
+
+def get_permissions(user):
+    """Droits compilés de l'utilisateur (mémorisés sur l'objet et dans le cache Django)"""
+    key = _cache_key(user.pk)
+    memo = getattr(user, '_dataset_permissions', None)
+    if memo is not None and memo[0] == key:
+        return memo[1]
+
+    rights = cache.get(key)
+    if rights is None:
+        permissions = compile_permissions(user)
+        cache.set(key, permissions.rights, getattr(settings, 'DATASET_PERMISSIONS_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    else:
+        permissions = DatasetPermissions(rights)
+
+    user._dataset_permissions = (key, permissions)
+    return permissions
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate_user(user_id):
+    _bump(_user_generation_key(user_id))
+
+
+def invalidate_all():
+    """Invalide les droits de tous les utilisateurs (changement de génération)"""
+    _bump(GENERATION_KEY)
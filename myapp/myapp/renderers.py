@@ -0,0 +1,19 @@
+from rest_framework.renderers import JSONRenderer
+
+from . import codec, instrumentation
+
+
+class FastJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` qui sérialise avec le codec du projet (orjson s'il est installé).
+
+    Les réponses indentées (``Accept: application/json; indent=4``) passent
+    par le rendu standard de DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with instrumentation.phase('render'):
+            if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+                return super().render(data, accepted_media_type, renderer_context)
+            return codec.dumps(data)
@@ -0,0 +1,180 @@
+"""Tables d'agrégats pour les routes de statistiques.
+
+``total_spent_by_user_type`` et ``top_products`` lisaient toute la table
+Transaction avec un GROUP BY à chaque appel. Les agrégats sont maintenant
+tenus à jour dans ``UserSpendingRollup`` et ``ProductRollup`` :
+
+- à chaque paquet importé, ``apply_batch`` retire la contribution des lignes
+  remplacées par l'upsert et ajoute celle des nouvelles lignes, dans la même
+  transaction que l'import ;
+- les créations, modifications et suppressions unitaires (API
+  ``/myapp/transactions/``, admin) passent par les signaux ``pre_save`` /
+  ``post_save`` / ``post_delete`` de Transaction (voir ``signals.py``) ;
+- ``rebuild_rollups`` (commande ``rebuild_rollups``, et la migration 0006)
+  recalcule tout depuis la table Transaction.
+
+Les variations sont appliquées par ``UPDATE ... SET total = total + delta`` :
+deux imports concurrents qui touchent la même ligne d'agrégat s'additionnent
+au lieu de s'écraser. Les écritures en masse qui contournent ces chemins
+(``QuerySet.update()``, ``bulk_create`` hors import) doivent être suivies de
+``rebuild_rollups``.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+
+from . import streaming
+from .models import ProductRollup, Transaction, UserSpendingRollup
+
+CENT = Decimal('0.01')
+
+
+def _amount(value):
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def _user_key(user_id, status, payment_method):
+    return (user_id or '', status, payment_method)
+
+
+def _product_key(product_id, product_category):
+    return (product_id or '', product_category)
+
+
+def _add(deltas, key, amount, count):
+    total, number = deltas.get(key, (Decimal('0'), 0))
+    deltas[key] = (total + amount, number + count)
+
+
+def compute_deltas(old_rows, new_objects):
+    """Variations des agrégats ``(user_deltas, product_deltas)``.
+
+    ``old_rows`` sont les valeurs (dicts) des transactions qui vont être
+    écrasées, ``new_objects`` les ``Transaction`` qui vont être écrites.
+    """
+    user_deltas, product_deltas = {}, {}
+    for row in old_rows:
+        amount = _amount(row['amount'])
+        _add(user_deltas, _user_key(row['user_id'], row['status'], row['payment_method']), -amount, -1)
+        _add(product_deltas, _product_key(row['product_id'], row['product_category']), -amount, -1)
+    for obj in new_objects:
+        amount = _amount(obj.amount)
+        _add(user_deltas, _user_key(obj.user_id, obj.status, obj.payment_method), amount, 1)
+        _add(product_deltas, _product_key(obj.product_id, obj.product_category), amount, 1)
+    return user_deltas, product_deltas
+
+
+def _apply_deltas(model, key_fields, total_field, count_field, deltas):
+    """Ajoute ``deltas`` (``{clé: (montant, nombre)}``) aux lignes de ``model`` sans lecture-modification-écriture"""
+    if not deltas:
+        return
+    # Les lignes manquantes sont créées à zéro ; une création concurrente est ignorée
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in deltas],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    first_keys = {key[0] for key in deltas}
+    ids = {
+        tuple(row[:-1]): row[-1]
+        for row in model.objects.filter(**{f'{key_fields[0]}__in': first_keys}).values_list(*key_fields, 'id')
+    }
+    changes = [(ids[key], amount, count) for key, (amount, count) in deltas.items()]
+    for start in range(0, len(changes), 500):
+        chunk = changes[start:start + 500]
+        model.objects.filter(id__in=[row_id for row_id, _amount, _count in chunk]).update(**{
+            total_field: F(total_field) + Case(
+                *[When(id=row_id, then=Value(amount)) for row_id, amount, _count in chunk],
+                output_field=DecimalField(max_digits=16, decimal_places=2),
+            ),
+            count_field: F(count_field) + Case(
+                *[When(id=row_id, then=Value(count)) for row_id, _amount, count in chunk],
+                output_field=IntegerField(),
+            ),
+        })
+    model.objects.filter(**{f'{key_fields[0]}__in': first_keys, f'{count_field}__lte': 0}).delete()
+
+
+def apply_changes(old_rows, new_objects):
+    """Met à jour les agrégats : retire ``old_rows`` (dicts) et ajoute ``new_objects`` (``Transaction``).
+
+    Les mêmes variations sont journalisées pour la fenêtre glissante des
+    dépenses (``streaming.record_changes``).
+    """
+    user_deltas, product_deltas = compute_deltas(old_rows, new_objects)
+    with transaction.atomic():
+        streaming.record_changes(old_rows, new_objects)
+        _apply_deltas(UserSpendingRollup, ['user_id', 'status', 'payment_method'],
+                      'total_spent', 'transaction_count', user_deltas)
+        _apply_deltas(ProductRollup, ['product_id', 'product_category'],
+                      'total_spent', 'total_bought', product_deltas)
+
+
+ROLLUP_SOURCE_FIELDS = [
+    'transaction_id', 'user_id', 'status', 'payment_method', 'product_id', 'product_category', 'amount', 'timestamp',
+]
+
+
+def apply_batch(new_objects):
+    """Met à jour les agrégats pour un paquet de transactions sur le point d'être upserté.
+
+    À appeler dans la transaction de l'import, avant l'upsert, pour que les
+    anciennes valeurs des transactions remplacées soient encore lisibles.
+    """
+    transaction_ids = [obj.transaction_id for obj in new_objects if obj.transaction_id]
+    old_rows = []
+    for start in range(0, len(transaction_ids), 500):
+        old_rows.extend(
+            Transaction.objects.filter(transaction_id__in=transaction_ids[start:start + 500])
+            .values(*ROLLUP_SOURCE_FIELDS)
+        )
+    apply_changes(old_rows, new_objects)
+
+
+def source_values(obj):
+    """Valeurs d'une ``Transaction`` qui comptent dans les agrégats, au format de ``compute_deltas``"""
+    return {field: getattr(obj, field) for field in ROLLUP_SOURCE_FIELDS}
+
+
+def rebuild_rollups(apps=None):
+    """Recalcule entièrement les agrégats depuis la table Transaction.
+
+    ``apps`` (registre d'une migration) permet de travailler sur les modèles
+    historiques.
+    """
+    transaction_model, user_model, product_model = Transaction, UserSpendingRollup, ProductRollup
+    if apps is not None:
+        transaction_model = apps.get_model('myapp', 'Transaction')
+        user_model = apps.get_model('myapp', 'UserSpendingRollup')
+        product_model = apps.get_model('myapp', 'ProductRollup')
+
+    with transaction.atomic():
+        user_model.objects.all().delete()
+        product_model.objects.all().delete()
+
+        users = {}
+        for stat in transaction_model.objects.values('user_id', 'status', 'payment_method').annotate(
+            total=Sum('amount'), count=Count('id')
+        ):
+            _add(users, _user_key(stat['user_id'], stat['status'], stat['payment_method']),
+                 _amount(stat['total']), stat['count'])
+        user_model.objects.bulk_create([
+            user_model(user_id=key[0], status=key[1], payment_method=key[2],
+                               total_spent=total, transaction_count=count)
+            for key, (total, count) in users.items()
+        ], batch_size=1000)
+
+        products = {}
+        for stat in transaction_model.objects.values('product_id', 'product_category').annotate(
+            total=Sum('amount'), count=Count('id')
+        ):
+            _add(products, _product_key(stat['product_id'], stat['product_category']),
+                 _amount(stat['total']), stat['count'])
+        product_model.objects.bulk_create([
+            product_model(product_id=key[0], product_category=key[1],
+                          total_bought=count, total_spent=total)
+            for key, (total, count) in products.items()
+        ], batch_size=1000)
+
+    return len(users), len(products)
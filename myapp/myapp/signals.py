@@ -0,0 +1,50 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import rollups
+from .models import AccessRight, DataLakeVersion, Transaction
+from .permissions import invalidate_all, invalidate_user
+
+
+@receiver([post_save, post_delete], sender=AccessRight)
+def access_right_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(m2m_changed, sender=AccessRight.allowed_versions.through)
+def allowed_versions_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Modification depuis une DataLakeVersion : plusieurs utilisateurs concernés
+        invalidate_all()
+    else:
+        invalidate_user(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=DataLakeVersion)
+def data_lake_version_changed(sender, instance, **kwargs):
+    invalidate_all()
+
+
+@receiver(pre_save, sender=Transaction)
+def transaction_saving(sender, instance, raw=False, **kwargs):
+    # Anciennes valeurs, à retirer des agrégats une fois la ligne enregistrée
+    previous = None
+    if instance.pk is not None and not raw:
+        previous = Transaction.objects.filter(pk=instance.pk).values(*rollups.ROLLUP_SOURCE_FIELDS).first()
+    instance._rollup_previous = previous
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    rollups.apply_changes([previous] if previous else [], [instance])
+    instance._rollup_previous = None
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    rollups.apply_changes([rollups.source_values(instance)], [])
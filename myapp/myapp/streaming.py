@@ -0,0 +1,267 @@
+"""Fenêtre glissante en mémoire des montants dépensés, pour ``last_5_minutes_spent``.
+
+Les montants sont rangés dans un buffer circulaire de cases d'une seconde
+(sur ``SPENDING_WINDOW_HORIZON`` secondes, 24 h par défaut) indexées par le
+TIMESTAMP de la transaction. Un total sur une fenêtre glissante est une somme
+de cases, sans requête SQL.
+
+Le buffer est amorcé une fois avec les transactions de l'horizon, puis suit
+le journal ``SpendingChange`` : chaque écriture sur Transaction (import,
+API, admin, voir ``rollups.apply_changes``) y ajoute ``-ancien montant`` à
+l'ancien TIMESTAMP et ``+nouveau montant`` au nouveau. Les modifications et
+suppressions sont donc reportées comme les créations.
+
+Les identifiants du journal ne sont pas attribués dans l'ordre des commits
+(deux imports concurrents sur Postgres) : une ligne d'``id`` inférieur au
+dernier vu peut devenir visible plus tard. À chaque lecture, les lignes
+écrites depuis moins de ``SPENDING_SYNC_MARGIN`` secondes sont donc relues
+et celles déjà appliquées sont reconnues à leur ``id``. Une transaction
+d'écriture plus longue que cette marge peut être manquée jusqu'au prochain
+amorçage.
+
+Tant que l'amorçage n'est pas terminé, les totaux viennent d'une requête SQL
+sur ``timestamp`` (indexé). Le journal est purgé au-delà de l'horizon ; un
+processus resté plus longtemps sans lire le journal se réamorce.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import FloatField, Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import SpendingChange, Transaction
+
+DEFAULT_HORIZON = 24 * 3600
+DEFAULT_SYNC_MARGIN = 60
+# Tolérance pour des horloges légèrement en avance chez le producteur
+FUTURE_SKEW = 60
+# Intervalle minimal entre deux purges du journal (secondes)
+PRUNE_INTERVAL = 300
+
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+UNIT_NAMES = {'s': 'second', 'm': 'minute', 'h': 'hour'}
+
+
+def parse_window(value):
+    """``'5m'`` -> ``(300, '5 minutes')`` ; lève ValueError si invalide"""
+    value = (value or '').strip().lower()
+    if len(value) < 2 or value[-1] not in WINDOW_UNITS or not value[:-1].isdigit():
+        raise ValueError(f"Invalid window '{value}'")
+    count = int(value[:-1])
+    if count <= 0:
+        raise ValueError(f"Invalid window '{value}'")
+    name = UNIT_NAMES[value[-1]] + ('s' if count > 1 else '')
+    return count * WINDOW_UNITS[value[-1]], f"{count} {name}"
+
+
+def record_changes(old_rows, new_objects):
+    """Journalise les variations de montant d'une écriture sur Transaction.
+
+    ``old_rows`` sont les valeurs (dicts avec ``timestamp`` et ``amount``) des
+    lignes remplacées ou supprimées, ``new_objects`` les ``Transaction``
+    écrites. À appeler dans la transaction de l'écriture.
+    """
+    changes = [
+        SpendingChange(timestamp=row['timestamp'], amount=-(row['amount'] or 0))
+        for row in old_rows if row['timestamp'] is not None
+    ]
+    changes += [
+        SpendingChange(timestamp=obj.timestamp, amount=obj.amount or 0)
+        for obj in new_objects if obj.timestamp is not None
+    ]
+    SpendingChange.objects.bulk_create(changes, batch_size=2000)
+
+
+class SpendingWindow:
+    def __init__(self, horizon=DEFAULT_HORIZON, margin=DEFAULT_SYNC_MARGIN):
+        self.horizon = horizon
+        self.margin = margin
+        self._amounts = [0.0] * horizon
+        self._head = None  # dernière seconde (epoch) couverte par le buffer
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.last_seen_id = 0
+        # Lignes du journal déjà appliquées dans la marge : {id: created_at}
+        self._applied = {}
+        self.synced_at = None
+        self._pruned_at = 0.0
+        self.warm = False
+        self._warming = False
+
+    def _advance(self, second):
+        """Fait avancer la tête jusqu'à ``second`` en vidant les cases recyclées"""
+        if self._head is None:
+            self._head = second
+            return
+        if second <= self._head:
+            return
+        if second - self._head >= self.horizon:
+            self._amounts = [0.0] * self.horizon
+        else:
+            for sec in range(self._head + 1, second + 1):
+                self._amounts[sec % self.horizon] = 0.0
+        self._head = second
+
+    def add_rows(self, rows, now=None):
+        """Ajoute des ``(timestamp, montant)`` (négatif pour un retrait) ; ignore ce qui sort de l'horizon"""
+        now_second = int((now or timezone.now()).timestamp())
+        with self._lock:
+            self._advance(now_second)
+            for moment, amount in rows:
+                second = int(moment.timestamp())
+                if second > now_second + FUTURE_SKEW:
+                    continue
+                if second > self._head:
+                    self._advance(second)
+                if second <= self._head - self.horizon:
+                    continue
+                self._amounts[second % self.horizon] += float(amount or 0)
+
+    def total(self, seconds, now=None):
+        """Somme des montants sur les ``seconds`` dernières secondes, en O(cases)"""
+        now_second = int((now or timezone.now()).timestamp())
+        seconds = min(seconds, self.horizon)
+        with self._lock:
+            self._advance(now_second)
+            start = (now_second - seconds + 1) % self.horizon
+            stop = now_second % self.horizon + 1
+            if start < stop:
+                return sum(self._amounts[start:stop])
+            return sum(self._amounts[start:]) + sum(self._amounts[:stop])
+
+    def reset(self):
+        with self._lock:
+            self._amounts = [0.0] * self.horizon
+            self._head = None
+            self.last_seen_id = 0
+            self._applied = {}
+            self.synced_at = None
+            self.warm = False
+
+    def _apply_changes(self, rows, now):
+        """Applique les lignes ``(id, timestamp, montant, created_at)`` du journal pas encore vues"""
+        since = now - timedelta(seconds=self.margin)
+        fresh = []
+        for row_id, moment, amount, created_at in rows:
+            if row_id in self._applied or (row_id <= self.last_seen_id and created_at < since):
+                continue
+            fresh.append((moment, amount))
+            self._applied[row_id] = created_at
+            self.last_seen_id = max(self.last_seen_id, row_id)
+        self._applied = {row_id: created_at for row_id, created_at in self._applied.items() if created_at >= since}
+        self.add_rows(fresh, now=now)
+
+    def sync(self, now=None):
+        """Applique les variations journalisées depuis la dernière synchronisation"""
+        now = now or timezone.now()
+        with self._sync_lock:
+            if self.synced_at is not None and now - self.synced_at > timedelta(seconds=self.horizon):
+                # Le journal a pu être purgé depuis : repartir de la table
+                self.reset()
+                self.warm_up(locked=True)
+                return
+            since = now - timedelta(seconds=self.margin)
+            changes = SpendingChange.objects.filter(id__gt=self.last_seen_id).values_list(
+                'id', 'timestamp', 'amount', 'created_at'
+            )
+            recent = SpendingChange.objects.filter(id__lte=self.last_seen_id, created_at__gte=since).values_list(
+                'id', 'timestamp', 'amount', 'created_at'
+            )
+            self._apply_changes(list(recent) + list(changes.order_by('id').iterator(chunk_size=2000)), now)
+            self.synced_at = now
+        self.prune(now)
+
+    def prune(self, now=None):
+        """Purge le journal au-delà de l'horizon (au plus une fois par ``PRUNE_INTERVAL``)"""
+        if time.monotonic() - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = time.monotonic()
+        limit = (now or timezone.now()) - timedelta(seconds=self.horizon + self.margin)
+        SpendingChange.objects.filter(created_at__lt=limit).delete()
+
+    def warm_up(self, locked=False):
+        """Amorce le buffer avec les transactions de l'horizon, puis suit le journal.
+
+        Les lignes du journal déjà présentes (et celles de la marge) sont
+        considérées comme reflétées par la table au moment de sa lecture.
+        """
+        if not locked:
+            with self._sync_lock:
+                return self.warm_up(locked=True)
+        now = timezone.now()
+        since = now - timedelta(seconds=self.horizon)
+        with transaction.atomic():
+            last_id = SpendingChange.objects.aggregate(last=Max('id'))['last'] or 0
+            recent = SpendingChange.objects.filter(
+                created_at__gte=now - timedelta(seconds=self.margin), id__lte=last_id
+            ).values_list('id', 'created_at')
+            applied = dict(recent)
+            rows = Transaction.objects.filter(timestamp__gte=since).values_list('timestamp', 'amount')
+            self.add_rows(rows.iterator(chunk_size=2000), now=now)
+        with self._lock:
+            self.last_seen_id = max(self.last_seen_id, last_id)
+            self._applied.update(applied)
+        self.synced_at = now
+        self.warm = True
+
+    def start_warm_up(self):
+        with self._lock:
+            if self.warm or self._warming:
+                return
+            self._warming = True
+
+        def run():
+            try:
+                self.warm_up()
+            except Exception as e:
+                print(f"Erreur lors de l'amorçage de la fenêtre glissante: {str(e)}")
+            finally:
+                self._warming = False
+                close_old_connections()
+
+        threading.Thread(target=run, name='spending-window-warm-up', daemon=True).start()
+
+
+def database_total(start):
+    return Transaction.objects.filter(timestamp__gte=start).aggregate(
+        total=Coalesce(Sum('amount', output_field=FloatField()), 0.0, output_field=FloatField())
+    )['total']
+
+
+_window = None
+_window_lock = threading.Lock()
+
+
+def get_spending_window():
+    global _window
+    if _window is None:
+        with _window_lock:
+            if _window is None:
+                _window = SpendingWindow(
+                    getattr(settings, 'SPENDING_WINDOW_HORIZON', DEFAULT_HORIZON),
+                    getattr(settings, 'SPENDING_SYNC_MARGIN', DEFAULT_SYNC_MARGIN),
+                )
+    return _window
+
+
+def trailing_spent(seconds, now=None):
+    """Total dépensé sur les ``seconds`` dernières secondes.
+
+    Réponse depuis le buffer s'il est amorcé, sinon requête SQL (et amorçage
+    lancé en arrière-plan). Les fenêtres plus longues que l'horizon passent
+    toujours par la base.
+    """
+    now = now or timezone.now()
+    window = get_spending_window()
+    if seconds > window.horizon:
+        return database_total(now - timedelta(seconds=seconds))
+    if not window.warm:
+        window.start_warm_up()
+        return database_total(now - timedelta(seconds=seconds))
+    window.sync(now=now)
+    # Les cases sont des flottants : arrondir au centime comme la colonne amount
+    return round(window.total(seconds, now=now), 2)
@@ -1,3 +1,1570 @@
-from django.test import TestCase
+"""Tests de l'application.
 
-# Create your tests here.
+- ``TransactionQueryPlanTests`` : chaque combinaison filtre/tri supportée par
+  ``TransactionViewSet`` est exécutée contre une table Transaction générée, et
+  son plan ``EXPLAIN`` ne doit contenir aucun parcours complet de la table.
+  Les filtres ``icontains`` et le paramètre ``search`` ne sont pas couverts :
+  ils ne peuvent pas utiliser d'index B-tree.
+- ``TransactionCursorPaginationTests`` : pagination par curseur de
+  ``/myapp/transactions/``.
+- ``AccessLogWriterTests`` : écriture groupée des journaux d'accès.
+- ``DatasetPermissionsTests`` : cache des droits compilés et son invalidation.
+- ``JSONCodecTests`` : choix du codec JSON et repli sur le module ``json``.
+- ``TransactionIndexingTests`` : indexation Elasticsearch contre un transport
+  simulé en mémoire (``FakeElasticsearch``).
+- Les classes ``Lake*Tests`` travaillent sur un lake synthétique temporaire
+  (voir ``LakeTestCase``) : lectures sync et async, pagination, compaction,
+  projection et filtres, mesures de performance, catalogue, fenêtres de temps, index des clés, fichier projeté et watcher.
+"""
+import base64
+import gzip
+import importlib
+import csv
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, TransportApiResponse
+from elasticsearch import Elasticsearch
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from . import benchmark, codec, export, indexing, ingestion, instrumentation, rollups, streaming, views, watcher
+from .lake import catalog, executor, fanout, keyindex, mapped, paging, segments, timeindex
+from .lake.cache import DatasetCache, get_dataset_cache
+from .lake.paging import DatasetPager, InvalidCursor, decode_cursor, encode_cursor, paginate, tail_stats_path
+from .lake.query import InvalidQuery, LakeQuery, TimeWindow, parse_moment
+from .access_log import AccessLogWriter
+from .permissions import get_permissions
+from .models import (
+    AccessLog, AccessRight, CatalogDataset, CatalogFile, DataLakeVersion, DetailedAccessLog, IndexedFile, IngestedFile,
+    LakeKey, ProductRollup, SpendingChange, Transaction, UserSpendingRollup,
+)
+from .views import TransactionViewSet
+
+TABLE_SIZE = 20000
+
+EXACT_FILTERS = {
+    'payment_method': 'card_7',
+    'country': 'country_12',
+    'product_category': 'category_3',
+    'status': 'completed',
+    'user_id': 'user_42',
+    'user_name': 'name_42',
+    'product_id': 'product_99',
+}
+RANGE_FILTERS = {
+    'amount_gt': '900',
+    'amount_lt': '10',
+    'amount_exact': '123.45',
+    'rating_gt': '4',
+    'rating_lt': '2',
+    'rating_exact': '3',
+}
+# Combinaisons documentées dans le readme
+COMBINED_FILTERS = [
+    {'payment_method': 'card_7', 'country': 'country_12'},
+]
+ORDERINGS = ['amount', '-amount', 'customer_rating', '-customer_rating', 'timestamp', '-timestamp']
+
+
+def full_scans(plan, table):
+    """Lignes du plan qui parcourent toute la table (sans index)"""
+    lines = plan.splitlines()
+    if connection.vendor == 'postgresql':
+        return [line for line in lines if f'Seq Scan on {table}' in line]
+    return [line for line in lines if f'SCAN {table}' in line and 'USING' not in line]
+
+
+def table_scans(plan, table):
+    """Lignes du plan qui parcourent toute la table, même dans l'ordre d'un index"""
+    lines = plan.splitlines()
+    if connection.vendor == 'postgresql':
+        if 'Index Cond' in plan:
+            return full_scans(plan, table)
+        return [line for line in lines if f'Scan on {table}' in line]
+    return [line for line in lines if f'SCAN {table}' in line]
+
+
+class TransactionQueryPlanTests(TestCase):
+    table = Transaction._meta.db_table
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('analyst', password='analyst')
+        AccessRight.objects.create(user=cls.user, dataset_name='TRANSACTIONS_COMPLETED', can_access_all_versions=True)
+
+        rng = random.Random(0)
+        now = timezone.now()
+        statuses = ['completed', 'cancelled', 'pending', 'refunded', 'failed']
+        Transaction.objects.bulk_create([
+            Transaction(
+                transaction_id=f'tx_{i}',
+                payment_method=f'card_{rng.randrange(20)}',
+                country=f'country_{rng.randrange(50)}',
+                product_category=f'category_{rng.randrange(30)}',
+                status=rng.choice(statuses),
+                amount=Decimal(rng.randrange(100000)) / 100,
+                customer_rating=rng.randrange(1, 6),
+                timestamp=now - timedelta(seconds=rng.randrange(30 * 24 * 3600)),
+                user_id=f'user_{rng.randrange(2000)}',
+                user_name=f'name_{rng.randrange(2000)}',
+                product_id=f'product_{rng.randrange(1000)}',
+            )
+            for i in range(TABLE_SIZE)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queryset(self, params):
+        factory = APIRequestFactory()
+        view = TransactionViewSet()
+        view.request = Request(factory.get('/myapp/transactions/', params))
+        view.request.user = self.user
+        view.format_kwarg = None
+        view.action = 'list'
+        return view.filter_queryset(view.get_queryset())
+
+    def explain(self, params):
+        return self.queryset(params).explain()
+
+    def assertNoFullScan(self, params, plan):
+        self.assertEqual(full_scans(plan, self.table), [], f'{params}\n{plan}')
+
+    def filter_combinations(self):
+        combinations = [{name: value} for name, value in EXACT_FILTERS.items()]
+        combinations += [{name: value} for name, value in RANGE_FILTERS.items()]
+        combinations += COMBINED_FILTERS
+        return combinations
+
+    def test_filters_use_an_index(self):
+        for params in self.filter_combinations():
+            with self.subTest(params=params):
+                plan = self.explain(params)
+                self.assertEqual(table_scans(plan, self.table), [], f'{params}\n{plan}')
+
+    def test_filters_with_ordering_use_an_index(self):
+        for params in self.filter_combinations():
+            for ordering in ORDERINGS:
+                query = dict(params, ordering=ordering)
+                with self.subTest(params=query):
+                    self.assertNoFullScan(query, self.explain(query))
+
+    def test_ordering_reads_an_index(self):
+        for ordering in ORDERINGS:
+            params = {'ordering': ordering}
+            with self.subTest(params=params):
+                self.assertNoFullScan(params, self.explain(params))
+
+    def test_filters_return_matching_rows(self):
+        # Les plans n'ont de sens que si les filtres restent appliqués
+        qs = self.queryset({'status': 'completed', 'ordering': '-amount'})
+        expected = Transaction.objects.filter(status='completed').count()
+        self.assertEqual(qs.count(), expected)
+        amounts = list(qs.values_list('amount', flat=True)[:50])
+        self.assertEqual(amounts, sorted(amounts, reverse=True))
+
+
+@override_settings(ACCESS_LOG_ASYNC=False)
+class TransactionCursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('analyst', password='analyst')
+        AccessRight.objects.create(user=cls.user, dataset_name='TRANSACTIONS_COMPLETED', can_access_all_versions=True)
+
+        rng = random.Random(1)
+        now = timezone.now()
+        # Beaucoup d'égalités et des NULL pour éprouver le départage par id
+        Transaction.objects.bulk_create([
+            Transaction(
+                transaction_id=f'tx_{i}',
+                payment_method='card',
+                country='France',
+                product_category='books',
+                status='completed',
+                amount=Decimal(rng.randrange(5)),
+                customer_rating=rng.choice([None, 1, 2, 3]),
+                timestamp=now - timedelta(seconds=rng.randrange(10)),
+            )
+            for i in range(57)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def walk(self, ordering):
+        ids, pages = [], []
+        url = f'/myapp/transactions/?page_size=7&ordering={ordering}'
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            ids += pages[-1]
+            url = data['next']
+        previous_pages = []
+        url = data['previous']
+        while url:
+            data = self.client.get(url).json()
+            previous_pages.insert(0, [row['id'] for row in data['results']])
+            url = data['previous']
+        return ids, pages[:-1], previous_pages
+
+    def test_pages_follow_ordering_with_stable_tiebreaker(self):
+        for ordering in ORDERINGS:
+            with self.subTest(ordering=ordering):
+                field = ordering.lstrip('-')
+                expected = sorted(
+                    Transaction.objects.values_list('id', field),
+                    key=lambda row: (row[1] is not None, row[1] or 0, row[0]),
+                    reverse=ordering.startswith('-'),
+                )
+                ids, pages, previous_pages = self.walk(ordering)
+                self.assertEqual(ids, [row[0] for row in expected])
+                self.assertEqual(previous_pages, pages)
+
+    def test_count_modes(self):
+        data = self.client.get('/myapp/transactions/?count=none').json()
+        self.assertNotIn('count', data)
+        data = self.client.get('/myapp/transactions/?count=estimate&status=completed').json()
+        self.assertEqual((data['count'], data['count_estimated']), (57, False))
+        self.assertEqual(self.client.get('/myapp/transactions/?count=bad').status_code, 400)
+
+    def test_unfiltered_estimate_uses_table_statistics(self):
+        # Base jamais analysée : pas de sqlite_stat1, comptage borné
+        with override_settings(TRANSACTION_COUNT_ESTIMATE_LIMIT=20):
+            data = self.client.get('/myapp/transactions/?count=estimate').json()
+            self.assertEqual((data['count'], data['count_estimated']), (20, True))
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        data = self.client.get('/myapp/transactions/?count=estimate').json()
+        self.assertEqual((data['count'], data['count_estimated']), (57, True))
+
+    def test_cursor_is_bound_to_ordering(self):
+        data = self.client.get('/myapp/transactions/?ordering=amount').json()
+        url = data['next'].replace('ordering=amount', 'ordering=timestamp')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class AccessLogWriterTests(TestCase):
+    """Journaux d'accès groupés : paquets par modèle, débordement de la file, erreurs d'écriture.
+
+    Le thread de fond n'est pas démarré : ``flush`` écrit dans le thread du test.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('logger')
+
+    def writer(self, **options):
+        writer = AccessLogWriter(**options)
+        patcher = mock.patch.object(writer, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return writer
+
+    def entry(self, index):
+        return AccessLog(user=self.user, request_path=f'/myapp/{index}/', request_method='GET')
+
+    def test_entries_are_written_in_batches(self):
+        writer = self.writer(batch_size=3)
+        for index in range(7):
+            writer.enqueue(self.entry(index))
+        writer.enqueue(DetailedAccessLog(user=self.user, dataset_name='TRANSACTIONS_COMPLETED', access_type='read'))
+        self.assertEqual(AccessLog.objects.count(), 0)
+
+        writer.flush()
+        self.assertEqual((AccessLog.objects.count(), DetailedAccessLog.objects.count()), (7, 1))
+        self.assertEqual(writer.stats(), {
+            'enqueued': 8, 'written': 8, 'dropped': 0, 'errors': 0, 'flushes': 3, 'pending': 0,
+        })
+
+    def test_full_queue_drops_or_blocks_then_drops(self):
+        for overflow in ('drop', 'block'):
+            with self.subTest(overflow=overflow):
+                writer = self.writer(queue_size=2, overflow=overflow, block_timeout=0.01)
+                for index in range(3):
+                    writer.enqueue(self.entry(index))
+                self.assertEqual((writer.enqueued, writer.dropped), (2, 1))
+
+    def test_write_errors_are_counted(self):
+        writer = self.writer()
+        writer.enqueue(self.entry(0))
+        with mock.patch.object(AccessLog.objects, 'bulk_create', side_effect=RuntimeError('database is locked')), \
+                mock.patch('builtins.print'):
+            writer.flush()
+        self.assertEqual((writer.written, writer.errors), (0, 1))
+
+
+class DatasetPermissionsTests(TestCase):
+    """Droits compilés : mis en cache entre les requêtes, invalidés par les signaux"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('reader')
+        self.v1 = DataLakeVersion.objects.create(name='V1', path='/tmp/v1')
+        self.v2 = DataLakeVersion.objects.create(name='V2', path='/tmp/v2')
+        self.right = AccessRight.objects.create(user=self.user, dataset_name='TRANSACTIONS_COMPLETED')
+        self.right.allowed_versions.add(self.v1)
+
+    def permissions(self):
+        # Nouvel objet utilisateur, comme à chaque requête
+        return get_permissions(User.objects.get(pk=self.user.pk))
+
+    def test_compiled_rights_are_cached(self):
+        permissions = self.permissions()
+        self.assertTrue(permissions.can_access_version('TRANSACTIONS_COMPLETED', self.v1.pk))
+        self.assertFalse(permissions.can_access_version('TRANSACTIONS_COMPLETED', self.v2.pk))
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_permissions(user).rights, permissions.rights)
+            self.assertIs(get_permissions(user), get_permissions(user))
+
+    def test_changes_invalidate_the_cached_rights(self):
+        self.permissions()
+        AccessRight.objects.create(user=self.user, dataset_name='TRANSACTIONS_PENDING', can_access_all_versions=True)
+        self.assertEqual(self.permissions().datasets, ['TRANSACTIONS_COMPLETED', 'TRANSACTIONS_PENDING'])
+
+        self.right.allowed_versions.add(self.v2)
+        self.assertTrue(self.permissions().can_access_version('TRANSACTIONS_COMPLETED', self.v2.pk))
+
+        # Depuis la version : tous les utilisateurs sont invalidés
+        self.v2.accessright_set.remove(self.right)
+        self.assertFalse(self.permissions().can_access_version('TRANSACTIONS_COMPLETED', self.v2.pk))
+
+        self.v1.delete()
+        self.assertEqual(self.permissions().rights['TRANSACTIONS_COMPLETED'], (False, frozenset()))
+
+
+class JSONCodecTests(TestCase):
+    """``codec`` : choix par ``JSON_CODEC`` et même sortie qu'avec le module ``json``"""
+
+    payload = {
+        'amount': Decimal('12.50'),
+        'label': gettext_lazy('Name'),
+        'nested': [{'id': 1, 'ok': True, 'none': None}, 'é'],
+    }
+
+    def setUp(self):
+        patcher = mock.patch.object(codec, '_codec', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_json_codec_setting(self):
+        default = 'orjson' if codec.orjson is not None else 'json'
+        for setting, expected in ((None, default), ('json', 'json'), ('unknown', 'json')):
+            with self.subTest(setting=setting), override_settings(JSON_CODEC=setting):
+                codec._codec = None
+                self.assertEqual(codec.get_codec().name, expected)
+
+    def test_fallback_encoding(self):
+        expected = b'{"amount":12.5,"label":"Name","nested":[{"id":1,"ok":true,"none":null},"\xc3\xa9"]}'
+        self.assertEqual(codec.JSONCodec().dumps(self.payload), expected)
+        self.assertEqual(codec.JSONCodec().loads(expected)['nested'][1], 'é')
+
+    @skipUnless(codec.orjson is not None, 'orjson non installé')
+    def test_orjson_matches_json(self):
+        fallback, fast = codec.JSONCodec(), codec.OrjsonCodec()
+        self.assertEqual(fast.dumps(self.payload), fallback.dumps(self.payload))
+        # Ce que orjson refuse passe par le module json
+        for value in ({1: 'a', 'b': 2}, {'big': 2 ** 70}):
+            with self.subTest(value=value):
+                self.assertEqual(fast.dumps(value), fallback.dumps(value))
+
+    def test_lazy_records_are_encoded_in_batches(self):
+        class Batches(codec.LazyRecords):
+            def __init__(self, *batches):
+                self.batches = batches
+
+            def iter_batches(self):
+                return iter(self.batches)
+
+        for name in codec.CODECS:
+            with self.subTest(codec=name), override_settings(JSON_CODEC=name):
+                codec._codec = None
+                self.assertEqual(
+                    codec.dumps({'count': 3, 'data': Batches([{'id': 1}], [], [{'id': 2}, {'id': Decimal('3')}]),
+                                 'empty': Batches()}),
+                    b'{"count":3,"data":[{"id":1},{"id":2},{"id":3.0}],"empty":[]}',
+                )
+
+
+class SpendingWindowTests(TestCase):
+    """Buffer circulaire de ``last_5_minutes_spent`` et suivi du journal ``SpendingChange``"""
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+
+    def ago(self, seconds):
+        return self.now - timedelta(seconds=seconds)
+
+    def create(self, amount, seconds_ago):
+        return Transaction.objects.create(
+            payment_method='card', country='France', product_category='books', status='completed',
+            amount=Decimal(amount), timestamp=self.ago(seconds_ago),
+        )
+
+    def test_ring_buffer_sums_and_recycles_slots(self):
+        window = streaming.SpendingWindow(horizon=10)
+        window.add_rows([(self.ago(0), 1), (self.ago(2), 2), (self.ago(5), 4), (self.ago(9), 8), (self.ago(10), 16)], now=self.now)
+        self.assertEqual(window.total(3, now=self.now), 3)
+        # Hors horizon (10 s) ou trop loin dans le futur : ignorés
+        window.add_rows([(self.ago(-streaming.FUTURE_SKEW - 5), 100), (self.ago(30), 100)], now=self.now)
+        self.assertEqual(window.total(10, now=self.now), 15)
+        self.assertEqual(window.total(60, now=self.now), 15)
+
+        # La tête avance : les cases recyclées sont vidées, y compris à travers la fin du tableau
+        later = self.now + timedelta(seconds=4)
+        self.assertEqual(window.total(10, now=later), 7)
+        window.add_rows([(later, -1), (self.ago(1), 32)], now=later)
+        self.assertEqual(window.total(10, now=later), 38)
+        self.assertEqual(window.total(10, now=self.now + timedelta(seconds=30)), 0)
+
+    def test_sync_follows_updates_deletes_and_late_commits(self):
+        kept = self.create('10.00', 30)
+        removed = self.create('5.00', 20)
+        window = streaming.SpendingWindow(horizon=3600, margin=60)
+        window.warm_up()
+        self.assertEqual(window.total(300, now=self.now), 15)
+
+        self.create('2.50', 10)
+        kept.amount = Decimal('1.00')
+        kept.save()
+        removed.delete()
+        window.sync(now=self.now)
+        self.assertEqual(round(window.total(300, now=self.now), 2), 3.5)
+        self.assertEqual(round(window.total(300, now=self.now), 2), float(streaming.database_total(self.ago(300))))
+
+        # Ligne d'id inférieur au dernier vu, validée après la lecture (commits dans le désordre)
+        first_id = window.last_seen_id
+        SpendingChange.objects.create(id=first_id + 2, timestamp=self.ago(5), amount=Decimal('3.00'))
+        window.sync(now=self.now)
+        self.assertEqual(window.last_seen_id, first_id + 2)
+        SpendingChange.objects.create(id=first_id + 1, timestamp=self.ago(5), amount=Decimal('4.00'))
+        window.sync(now=self.now)
+        window.sync(now=self.now)
+        self.assertEqual(round(window.total(300, now=self.now), 2), 10.5)
+
+        # Hors de la marge, une ligne déjà appliquée n'est plus relue
+        window.sync(now=self.now + timedelta(seconds=120))
+        self.assertEqual(round(window.total(600, now=self.now + timedelta(seconds=120)), 2), 10.5)
+
+
+READER_AUTH = {'Authorization': 'Basic ' + base64.b64encode(b'reader:reader').decode('ascii')}
+
+
+@override_settings(ACCESS_LOG_ASYNC=False, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LakeTestCase(TestCase):
+    """Lake synthétique temporaire (servi par les vues), version ``V1`` et lecteur ``reader``.
+
+    Les sous-classes règlent la taille du lake et les datasets autorisés au
+    lecteur ; ``auth`` est l'en-tête Basic de ce lecteur.
+    """
+    lake_records = 30
+    lake_datasets = None
+    segment_size = 10
+    tail_files = 5
+    granted = ('TRANSACTIONS_COMPLETED',)
+    auth = READER_AUTH
+
+    def setUp(self):
+        self.lake_dir = tempfile.mkdtemp(prefix='test-lake-')
+        self.addCleanup(shutil.rmtree, self.lake_dir, ignore_errors=True)
+        self.addCleanup(get_dataset_cache().invalidate, self.lake_dir)
+        self.addCleanup(timeindex.clear)
+        benchmark.write_synthetic_lake(
+            self.lake_dir, self.lake_records, datasets=self.lake_datasets,
+            segment_size=self.segment_size, tail_files=self.tail_files,
+        )
+        patcher = mock.patch.object(views, 'DATA_LAKE_PATH', self.lake_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.version = DataLakeVersion.objects.create(name='V1', path=self.lake_dir)
+        self.user = User.objects.create_user('reader', password='reader')
+        for dataset_name in self.granted:
+            AccessRight.objects.create(user=self.user, dataset_name=dataset_name, can_access_all_versions=True)
+
+
+class LakeReadViewsTests(LakeTestCase):
+    """Lectures du lake : routes ``/myapp/async/...`` et ouverture en parallèle de ``retrieve_all``"""
+    lake_records = 40
+    granted = ('TRANSACTIONS_COMPLETED', 'TRANSACTIONS_CANCELLED')
+
+    async def assertSameResponse(self, path):
+        sync_response = await AsyncClient().get(f'/myapp/{path}', headers=self.auth)
+        async_response = await AsyncClient().get(f'/myapp/async/{path}', headers=self.auth)
+        self.assertEqual(async_response.status_code, sync_response.status_code, path)
+        self.assertEqual(async_response.json(), sync_response.json(), path)
+
+    async def test_same_responses_as_sync_views(self):
+        for path in (
+            'retrieve_all/',
+            'retrieve_all/?page=4',
+            'retrieve_all/?page=0',
+            'retrieve_projection/TRANSACTIONS_COMPLETED/?fields=TRANSACTION_ID,AMOUNT&where=AMOUNT>=500',
+            'retrieve_projection/TRANSACTIONS_COMPLETED/?where=AMOUNT~1',
+            'retrieve_projection/TRANSACTIONS_PENDING/',
+            'data_lake/resources/',
+            'data_lake/TRANSACTIONS_CANCELLED/version/V1/',
+            'data_lake/TRANSACTIONS_CANCELLED/version/V2/',
+            'data_lake/TRANSACTIONS_PENDING/version/V1/',
+        ):
+            with self.subTest(path=path):
+                await self.assertSameResponse(path)
+
+    async def test_requires_basic_authentication(self):
+        response = await AsyncClient().get('/myapp/async/retrieve_all/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="api"')
+        response = await AsyncClient().post('/myapp/async/retrieve_all/', headers=self.auth)
+        self.assertEqual(response.status_code, 405)
+
+    def test_retrieve_all_merges_in_dataset_order(self):
+        data = self.client.get('/myapp/retrieve_all/?page=4', headers=self.auth).json()
+        self.assertEqual(data['total'], 80)
+        self.assertNotIn('skipped_datasets', data)
+        # 40 enregistrements par dataset : la page 4 est la fin de TRANSACTIONS_CANCELLED
+        self.assertEqual({record['STATUS'] for record in data['results']}, {'cancelled'})
+        data = self.client.get('/myapp/retrieve_all/?page=5', headers=self.auth).json()
+        self.assertEqual({record['STATUS'] for record in data['results']}, {'completed'})
+
+    def test_benchmark_last_page_case_is_in_range(self):
+        cases = {case: (url, params) for case, url, params, _headers in
+                 benchmark.route_cases('TRANSACTIONS_COMPLETED', 'V1', 1, 80)['retrieve-all']}
+        url, params = cases['last-page']
+        data = self.client.get(url, params, headers=self.auth).json()
+        self.assertEqual((data['page'], len(data['results'])), (8, 10))
+
+    def test_retrieve_all_skips_datasets_past_deadline(self):
+        open_pager = fanout.open_pager
+
+        def slow_open_pager(base_path, dataset_name):
+            if dataset_name == 'TRANSACTIONS_CANCELLED':
+                time.sleep(1)
+            return open_pager(base_path, dataset_name)
+
+        with override_settings(LAKE_FANOUT_DEADLINE=0.2), mock.patch.object(fanout, 'open_pager', slow_open_pager):
+            data = self.client.get('/myapp/retrieve_all/', headers=self.auth).json()
+            self.assertEqual(data['skipped_datasets'], ['TRANSACTIONS_CANCELLED'])
+            self.assertEqual(data['total'], 40)
+            self.assertEqual({record['STATUS'] for record in data['results']}, {'completed'})
+
+            cursor = encode_cursor('TRANSACTIONS_CANCELLED', '20250101_000000000000.json', 0)
+            response = self.client.get(f'/myapp/retrieve_all/?cursor={cursor}', headers=self.auth)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+
+    async def test_retrieve_all_skips_datasets_that_fail_to_open(self):
+        open_pager = fanout.open_pager
+
+        def failing_open_pager(base_path, dataset_name):
+            if dataset_name == 'TRANSACTIONS_CANCELLED':
+                raise ValueError('segment illisible')
+            return open_pager(base_path, dataset_name)
+
+        with mock.patch.object(fanout, 'open_pager', failing_open_pager):
+            for path in ('/myapp/retrieve_all/', '/myapp/async/retrieve_all/'):
+                with self.subTest(path=path):
+                    response = await AsyncClient().get(path, headers=self.auth)
+                    self.assertEqual(response.status_code, 200)
+                    data = response.json()
+                    self.assertEqual(data['skipped_datasets'], ['TRANSACTIONS_CANCELLED'])
+                    self.assertEqual(data['total'], 40)
+
+
+class LakePagingTests(LakeTestCase):
+    """``DatasetPager`` : total sans relire la queue, pages par curseur"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+
+    def test_tail_counts_are_persisted(self):
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').total, 30)
+        self.assertEqual(len(codec.load_file(tail_stats_path(folder_path))['files']), 5)
+
+        # Les relevés servent aussi aux autres processus : aucun fichier n'est relu
+        paging._tail_counts.clear()
+        with mock.patch.object(segments, 'read_json_file', side_effect=AssertionError('tail file read')):
+            self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').total, 30)
+
+        tail = sorted(name for name in os.listdir(folder_path) if name.endswith('.json'))[-1]
+        with open(f'{folder_path}/{tail}', 'w') as f:
+            f.write('[{"TRANSACTION_ID": "TXN-A"}, {"TRANSACTION_ID": "TXN-B"}]')
+        self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').total, 31)
+
+    def test_unchanged_folder_skips_tail_stats(self):
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        os.makedirs(segments.segment_dir(folder_path), exist_ok=True)
+        past = time.time() - 60
+        os.utime(folder_path, (past, past))
+        # Première ouverture : vérification complète, enregistrée avec le mtime du dossier
+        self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').total, 30)
+        self.assertEqual(codec.load_file(tail_stats_path(folder_path))['folder_mtime_ns'], os.stat(folder_path).st_mtime_ns)
+
+        tail = [name for name in os.listdir(folder_path) if name.endswith('.json')]
+        with mock.patch.object(paging.os, 'stat', wraps=os.stat) as stat:
+            self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').total, 30)
+        self.assertFalse([call for call in stat.call_args_list if os.path.basename(str(call.args[0])) in tail])
+
+        # Un fichier ajouté change le mtime du dossier : la queue est revérifiée
+        with open(f'{folder_path}/29990101_000000000000.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW"}')
+        self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').total, 31)
+
+    def test_cursors_walk_the_dataset_once(self):
+        expected = segments.load_dataset(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+        pagers = [DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED')]
+        records, cursor = paginate(pagers, 7)
+        while cursor is not None:
+            page, cursor = paginate(pagers, 7, cursor=cursor)
+            records.extend(page)
+        self.assertEqual(records, expected)
+
+        cursor = encode_cursor('TRANSACTIONS_COMPLETED', 'a.json', 3)
+        self.assertEqual(decode_cursor(cursor), ('TRANSACTIONS_COMPLETED', 'a.json', 3))
+        for invalid in ('???', encode_cursor('TRANSACTIONS_COMPLETED', 'a.json', 0)[:-4]):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(invalid)
+        with self.assertRaises(InvalidCursor):
+            paginate(pagers, 7, cursor=cursor)
+
+
+class TransactionIngestionTests(LakeTestCase):
+    """``ingest_transactions`` : upsert sur TRANSACTION_ID, registre des fichiers et reprise des lignes de l'ancien import"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+    tail_files = 30
+
+    def test_reingesting_never_duplicates(self):
+        stats = ingestion.ingest_transactions(self.version, batch_size=7)
+        self.assertEqual((stats.files, stats.rows), (30, 30))
+        IngestedFile.objects.all().delete()
+        ingestion.ingest_transactions(self.version)
+        self.assertEqual(Transaction.objects.count(), 30)
+        self.assertEqual(Transaction.objects.filter(transaction_id__isnull=True).count(), 0)
+
+    def test_ledger_only_rereads_changed_files(self):
+        ingestion.ingest_transactions(self.version)
+        self.assertEqual(IngestedFile.objects.count(), 30)
+        stats = ingestion.ingest_transactions(self.version)
+        self.assertEqual((stats.files, stats.skipped_files), (0, 30))
+
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        first, second = sorted(name for name in os.listdir(folder_path) if name.endswith('.json'))[:2]
+        # mtime changé mais même contenu : seul le registre est mis à jour
+        os.utime(f'{folder_path}/{first}', (time.time() + 10, time.time() + 10))
+        record = segments.read_json_file(f'{folder_path}/{second}')[0]
+        record['AMOUNT'] = 12.5
+        with open(f'{folder_path}/{second}', 'wb') as f:
+            f.write(codec.dumps(record))
+
+        stats = ingestion.ingest_transactions(self.version)
+        self.assertEqual((stats.files, stats.rows), (1, 1))
+        self.assertEqual(IngestedFile.objects.get(filename=first).mtime, os.stat(f'{folder_path}/{first}').st_mtime)
+        self.assertEqual(Transaction.objects.get(transaction_id=record['TRANSACTION_ID']).amount, Decimal('12.50'))
+        self.assertEqual(Transaction.objects.count(), 30)
+
+    def test_migration_backfills_rows_of_the_lazy_import(self):
+        migration = importlib.import_module('myapp.migrations.0003_transaction_id_ingestedfile')
+        records = segments.load_dataset(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+        # Lignes telles que les créait l'ancien import paresseux : sans transaction_id, l'une en double
+        for item in records + records[:1]:
+            Transaction.objects.create(
+                payment_method=item['PAYMENT_METHOD'], country=item['LOCATION']['COUNTRY'],
+                product_category=item['PRODUCT_CATEGORY'], status=item['STATUS'], amount=float(item['AMOUNT']),
+                customer_rating=item.get('CUSTOMER_RATING') or 0, user_id=item['USER_ID'],
+                user_name=item['USER_NAME'], product_id=item['PRODUCT_ID'],
+                timestamp=timezone.make_aware(datetime.strptime(item['TIMESTAMP'], '%Y-%m-%dT%H:%M:%S.%fZ')),
+            )
+        manual = Transaction.objects.create(
+            payment_method='cash', country='France', product_category='books', status='completed',
+            amount=1, timestamp=timezone.now(), user_id='USER-API', product_id='PROD-API',
+        )
+
+        with override_settings(DATA_LAKE_PATH=self.lake_dir):
+            migration.backfill_transaction_ids(apps, None)
+        self.assertEqual(
+            sorted(Transaction.objects.exclude(pk=manual.pk).values_list('transaction_id', flat=True)),
+            sorted(record['TRANSACTION_ID'] for record in records),
+        )
+        self.assertIsNone(Transaction.objects.get(pk=manual.pk).transaction_id)
+
+        ingestion.ingest_transactions(self.version)
+        self.assertEqual(Transaction.objects.count(), 31)
+
+
+class FakeElasticsearch:
+    """Client ``Elasticsearch`` dont le transport est simulé en mémoire : index, alias, réglages et bulk.
+
+    Les documents dont l'``_id`` est dans ``failing_ids`` sont refusés par le bulk.
+    """
+
+    def __init__(self, failing_ids=()):
+        self.indices = {}  # nom -> {'settings': {}, 'docs': {}}
+        self.aliases = {}  # alias -> set des index
+        self.failing_ids = set(failing_ids)
+        self.client = Elasticsearch('http://localhost:9200')
+        self.client.transport.perform_request = self.perform_request
+
+    def add_index(self, name, alias=None, **settings):
+        self.indices[name] = {'settings': dict(settings), 'docs': {}}
+        if alias is not None:
+            self.aliases.setdefault(alias, set()).add(name)
+
+    def resolve(self, name):
+        return sorted(self.aliases[name]) if name in self.aliases else [name]
+
+    def perform_request(self, method, target, headers=None, body=None, **kwargs):
+        parts = target.split('?')[0].strip('/').split('/')
+        if isinstance(body, (bytes, str)):
+            body = codec.loads(body)
+        status, payload = self.handle(method, parts, body)
+        meta = ApiResponseMeta(
+            status=status, http_version='1.1', headers=HttpHeaders({'x-elastic-product': 'Elasticsearch'}),
+            duration=0.0, node=NodeConfig('http', 'localhost', 9200),
+        )
+        return TransportApiResponse(meta, payload)
+
+    def handle(self, method, parts, body):
+        if parts == ['_bulk']:
+            return 200, self.bulk(body)
+        if parts == ['_aliases']:
+            for action in body['actions']:
+                (kind, args), = action.items()
+                if kind == 'add':
+                    self.aliases.setdefault(args['alias'], set()).add(args['index'])
+                elif kind == 'remove':
+                    self.aliases[args['alias']].discard(args['index'])
+                else:
+                    del self.indices[args['index']]
+            return 200, {'acknowledged': True}
+        if parts[0] == '_alias':
+            if parts[1] not in self.aliases:
+                return 404, {}
+            return 200, {name: {'aliases': {parts[1]: {}}} for name in self.aliases[parts[1]]}
+        if len(parts) > 1 and parts[1] == '_settings':
+            names = self.resolve(parts[0])
+            if method == 'PUT':
+                for name in names:
+                    for key, value in body['index'].items():
+                        if value is None:
+                            self.indices[name]['settings'].pop(key, None)
+                        else:
+                            self.indices[name]['settings'][key] = value
+                return 200, {'acknowledged': True}
+            return 200, {name: {'settings': {'index': dict(self.indices[name]['settings'])}} for name in names}
+        if len(parts) > 1 and parts[1] == '_refresh':
+            return 200, {'_shards': {}}
+        if len(parts) > 1 and parts[1] == '_delete_by_query':
+            deleted = 0
+            for name in self.resolve(parts[0]):
+                docs = self.indices[name]['docs']
+                for doc_id in [doc_id for doc_id, source in docs.items() if self.matches(source, body['query'])]:
+                    del docs[doc_id]
+                    deleted += 1
+            return 200, {'deleted': deleted}
+        name = parts[0]
+        if method == 'HEAD':
+            return (200 if name in self.indices or name in self.aliases else 404), None
+        if method == 'DELETE':
+            del self.indices[name]
+            for members in self.aliases.values():
+                members.discard(name)
+            return 200, {'acknowledged': True}
+        if name in self.indices:
+            return 400, {'error': {'type': 'resource_already_exists_exception'}, 'status': 400}
+        self.add_index(name)
+        return 200, {'acknowledged': True, 'index': name}
+
+    def matches(self, source, query):
+        """Requêtes ``bool``/``filter`` de ``term`` et ``terms`` seulement"""
+        for clause in query['bool']['filter']:
+            (kind, condition), = clause.items()
+            (field, expected), = condition.items()
+            if source.get(field) not in (expected if kind == 'terms' else [expected]):
+                return False
+        return True
+
+    def bulk(self, lines):
+        lines = [codec.loads(line) if isinstance(line, (bytes, str)) else line for line in lines]
+        items = []
+        for header, source in zip(lines[::2], lines[1::2]):
+            (op, meta), = header.items()
+            if meta['_id'] in self.failing_ids:
+                items.append({op: {'_index': meta['_index'], '_id': meta['_id'], 'status': 400,
+                                   'error': {'type': 'mapper_parsing_exception'}}})
+                continue
+            for name in self.resolve(meta['_index']):
+                self.indices[name]['docs'][meta['_id']] = source
+            items.append({op: {'_index': meta['_index'], '_id': meta['_id'], 'status': 201}})
+        return {'errors': any(item[op]['status'] >= 300 for item in items), 'items': items}
+
+
+class TransactionIndexingTests(LakeTestCase):
+    """Indexation Elasticsearch (``indexing.py``) contre un transport simulé"""
+    lake_records = 10
+    tail_files = 2
+
+    def setUp(self):
+        super().setUp()
+        self.es = FakeElasticsearch()
+        self.tasks = indexing.list_datasets([self.version])
+
+    def test_parallel_bulk_attributes_failures_to_their_file(self):
+        self.es.add_index('transactions-1', alias='transactions')
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        failed_file = sorted(name for name in os.listdir(folder_path) if name.endswith('.json'))[-1]
+        self.es.failing_ids.add('V1_TRANSACTIONS_COMPLETED_TXN-0000000009')
+
+        stats = indexing.bulk_index(self.tasks, client=self.es.client, chunk_size=4, workers=3)
+        self.assertEqual((stats.indexed, stats.errors, stats.files), (29, 1, 30))
+        self.assertEqual(set(stats.by_dataset.values()), {10})
+        self.assertEqual(len(self.es.indices['transactions-1']['docs']), 29)
+        self.assertEqual([source[1:] for source in stats.failed_files], [('TRANSACTIONS_COMPLETED', failed_file)])
+
+        # Seuls les fichiers indexés sans erreur sont enregistrés : le suivant renverra le fichier en échec
+        indexing.record_indexed_files(stats.succeeded_files)
+        pending = indexing.incremental_tasks([self.version])
+        self.assertEqual([(task[1], [entry[0] for entry in task[2]]) for task in pending],
+                         [('TRANSACTIONS_COMPLETED', [failed_file])])
+
+    def test_incremental_indexing_follows_compacted_and_deleted_files(self):
+        self.es.add_index('transactions-1', alias='transactions')
+        stats = indexing.bulk_index(indexing.incremental_tasks([self.version]), client=self.es.client)
+        # Les fichiers compactés sans source sont enregistrés comme les autres
+        indexing.record_indexed_files(stats.succeeded_files)
+        self.assertEqual(IndexedFile.objects.count(), 30)
+        self.assertEqual(indexing.incremental_tasks([self.version]), [])
+
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        deleted_file = sorted(name for name in os.listdir(folder_path) if name.endswith('.json'))[-1]
+        os.remove(f'{folder_path}/{deleted_file}')
+        removed = indexing.removed_files([self.version])
+        self.assertEqual([source[1:] for source in removed], [('TRANSACTIONS_COMPLETED', deleted_file)])
+        self.assertEqual(indexing.delete_removed_files(removed, client=self.es.client), 1)
+        docs = self.es.indices['transactions-1']['docs']
+        self.assertEqual(len(docs), 29)
+        self.assertNotIn(deleted_file, {source['lake_file'] for source in docs.values()
+                                        if source['dataset_source'] == 'TRANSACTIONS_COMPLETED'})
+        self.assertEqual(indexing.removed_files([self.version]), [])
+
+    def test_bulk_index_restores_the_previous_refresh_interval(self):
+        self.es.add_index('transactions-old', alias='transactions', refresh_interval='30s')
+        stats = indexing.bulk_index(self.tasks, client=self.es.client, chunk_size=7)
+        self.assertEqual((stats.indexed, stats.errors), (30, 0))
+        self.assertEqual(self.es.indices['transactions-old']['settings'], {'refresh_interval': '30s'})
+
+    def test_rebuild_swaps_the_alias(self):
+        self.es.add_index('transactions-old', alias='transactions')
+        new_index, stats = indexing.rebuild_index(self.tasks, client=self.es.client, chunk_size=7)
+        self.assertEqual(self.es.aliases['transactions'], {new_index})
+        self.assertEqual(list(self.es.indices), [new_index])
+        self.assertEqual(len(self.es.indices[new_index]['docs']), 30)
+        # Le nouvel index revient au rafraîchissement par défaut
+        self.assertEqual(self.es.indices[new_index]['settings'], {})
+
+    def test_rebuild_with_errors_leaves_the_alias_in_place(self):
+        self.es.add_index('transactions-old', alias='transactions')
+        self.es.failing_ids.add('V1_TRANSACTIONS_COMPLETED_TXN-0000000003')
+        with self.assertRaises(indexing.RebuildFailed) as raised:
+            indexing.rebuild_index(self.tasks, client=self.es.client, chunk_size=7)
+        self.assertEqual(raised.exception.stats.errors, 1)
+        self.assertEqual(self.es.aliases['transactions'], {'transactions-old'})
+        self.assertEqual(list(self.es.indices), ['transactions-old'])
+
+    def test_rebuilds_in_the_same_instant_get_distinct_indices(self):
+        moment = timezone.now()
+        with mock.patch.object(indexing.timezone, 'now', return_value=moment):
+            first, _stats = indexing.rebuild_index(self.tasks, client=self.es.client, keep_old=True)
+            second, _stats = indexing.rebuild_index(self.tasks, client=self.es.client, keep_old=True)
+        self.assertNotEqual(first, second)
+        self.assertEqual(set(self.es.indices), {first, second})
+        self.assertEqual(self.es.aliases['transactions'], {second})
+
+
+class TransactionRollupTests(LakeTestCase):
+    """Les agrégats suivent l'import et l'API, et restent égaux à un recalcul complet"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+    tail_files = 30
+
+    def snapshot(self):
+        return (
+            sorted(UserSpendingRollup.objects.values_list('user_id', 'status', 'payment_method', 'total_spent', 'transaction_count')),
+            sorted(ProductRollup.objects.values_list('product_id', 'product_category', 'total_spent', 'total_bought')),
+        )
+
+    def assertMatchesRebuild(self):
+        maintained = self.snapshot()
+        rollups.rebuild_rollups()
+        self.assertEqual(maintained, self.snapshot())
+
+    def test_ingestion_and_api_writes_keep_rollups_exact(self):
+        ingestion.ingest_transactions(self.version, batch_size=7)
+        self.assertEqual(UserSpendingRollup.objects.aggregate(n=Sum('transaction_count'))['n'], 30)
+        self.assertMatchesRebuild()
+
+        self.client.force_login(self.user)
+        created = self.client.post('/myapp/transactions/', {
+            'transaction_id': 'TXN-API', 'payment_method': 'cash', 'country': 'France',
+            'product_category': 'books', 'status': 'completed', 'amount': '12.50',
+            'timestamp': '2025-01-01T00:00:00Z', 'user_id': 'USER-API', 'product_id': 'PROD-API',
+        })
+        self.assertEqual(created.status_code, 201)
+        self.assertMatchesRebuild()
+
+        row = Transaction.objects.exclude(transaction_id='TXN-API').first()
+        response = self.client.patch(
+            f'/myapp/transactions/{row.pk}/', {'amount': '999.99', 'status': 'refunded'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertMatchesRebuild()
+
+        self.assertEqual(self.client.delete(f"/myapp/transactions/{created.json()['id']}/").status_code, 204)
+        self.assertFalse(ProductRollup.objects.filter(product_id='PROD-API').exists())
+        self.assertMatchesRebuild()
+
+    def test_stats_render_missing_keys_as_null(self):
+        Transaction.objects.create(
+            transaction_id='TXN-ANON', payment_method='cash', country='France', product_category='books',
+            status='completed', amount=Decimal('5.00'), timestamp=timezone.now(),
+        )
+        self.assertTrue(UserSpendingRollup.objects.filter(user_id='').exists())
+        users = self.client.get('/myapp/stats/total_by_user/', headers=self.auth).json()['users']
+        self.assertEqual([user['total_spent'] for user in users if user['user_id'] is None], [5.0])
+        products = self.client.get('/myapp/stats/top_products/', headers=self.auth).json()['products']
+        self.assertEqual([product['product_id'] for product in products], [None])
+
+    def test_reingested_rows_replace_their_contribution(self):
+        ingestion.ingest_transactions(self.version)
+        tail = sorted(os.listdir(f'{self.lake_dir}/TRANSACTIONS_COMPLETED'))[-1]
+        path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED/{tail}'
+        record = export.codec.load_file(path)
+        record.update(AMOUNT=0.01, PAYMENT_METHOD='voucher')
+        with open(path, 'wb') as f:
+            f.write(export.codec.dumps(record))
+        ingestion.ingest_transactions(self.version)
+        self.assertEqual(Transaction.objects.count(), 30)
+        self.assertTrue(UserSpendingRollup.objects.filter(payment_method='voucher', transaction_count=1).exists())
+        self.assertMatchesRebuild()
+
+
+class PerformanceInstrumentationTests(LakeTestCase):
+    """Profil par requête : tâches des pools du lake mesurées à part puis fusionnées,
+    en-tête ``Server-Timing`` et agrégats de ``/myapp/metrics/``
+    """
+
+    def test_parallel_tasks_measure_in_their_own_profile(self):
+        def read(delay):
+            with instrumentation.phase('io'):
+                time.sleep(delay)
+                instrumentation.record_file(10)
+
+        profile = instrumentation.RequestProfile()
+        token = instrumentation._current.set(profile)
+        try:
+            futures = [executor.submit_to_lake_executor(read, 0.05) for _ in range(3)]
+            late = executor.submit_to_lake_executor(read, 0.3, pool=fanout.FANOUT_POOL)
+            for future in futures:
+                future.result()
+        finally:
+            instrumentation._current.reset(token)
+        # Une phase en cours dans un thread ne masque pas celle des autres
+        self.assertEqual(profile.phases['io'][1], 3)
+        self.assertEqual((profile.files, profile.bytes_read), (3, 30))
+
+        # La réponse est partie : la tâche abandonnée n'écrit plus dans le profil
+        profile.close()
+        late.result()
+        self.assertEqual((profile.phases['io'][1], profile.files), (3, 3))
+
+    def test_abandoned_opens_are_cancelled_or_left_in_the_fanout_pool(self):
+        open_pager = fanout.open_pager
+        started = []
+
+        def slow_open_pager(base_path, dataset_name):
+            started.append(dataset_name)
+            time.sleep(0.3)
+            return open_pager(base_path, dataset_name)
+
+        names = [f'DATASET_{index}' for index in range(10)]
+        with mock.patch.object(fanout, 'open_pager', slow_open_pager):
+            pagers, skipped = fanout.open_pagers(self.lake_dir, names, deadline=0.05)
+            self.assertEqual((pagers, skipped), ([], names))
+            # Le pool des lectures async reste disponible pendant ce temps
+            self.assertEqual(executor.submit_to_lake_executor(len, 'abc').result(timeout=0.2), 3)
+            time.sleep(0.4)
+        # Seules les ouvertures déjà commencées ont continué, les autres ont été annulées
+        self.assertLessEqual(len(started), executor.get_lake_executor(fanout.FANOUT_POOL)._max_workers)
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get('/myapp/data_lake/TRANSACTIONS_COMPLETED/version/V1/', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        timing = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', ') if ';' in metric)
+        self.assertIn('io', timing)
+        self.assertIn('parse', timing)
+        self.assertIn('render', timing)
+        # Manifest, trois segments et cinq fichiers de queue lus pour ce dataset
+        self.assertEqual(timing['files'], 'desc="9"')
+
+        with override_settings(PERF_SERVER_TIMING=False):
+            response = self.client.get('/myapp/data_lake/resources/', headers=self.auth)
+            self.assertNotIn('Server-Timing', response)
+
+        # Réservé au staff
+        self.assertEqual(self.client.get('/myapp/metrics/', headers=self.auth).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/myapp/metrics/', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        route = 'myapp/data_lake/<str:dataset_name>/version/<str:version_name>/'
+        body = response.content.decode()
+        self.assertIn(f'myapp_requests_total{{route="{route}",method="GET",status="200"}}', body)
+        self.assertIn(f'myapp_request_duration_seconds_bucket{{route="{route}",method="GET",le="+Inf"}}', body)
+        self.assertIn(f'myapp_lake_files_opened_total{{route="{route}"}}', body)
+
+
+class LakeExportTests(LakeTestCase):
+    """Export en flux : plages ``Range: records=`` et colonnes du CSV"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+    granted = ('TRANSACTIONS_COMPLETED', 'TRANSACTIONS_EMPTY')
+
+    def export(self, dataset_name, query='', **headers):
+        response = self.client.get(
+            f'/myapp/data_lake/{dataset_name}/version/V1/export/?{query}', headers={**self.auth, **headers}
+        )
+        body = b''.join(response.streaming_content) if response.streaming else b''
+        return response, body.decode('utf-8')
+
+    def test_parse_range(self):
+        cases = [
+            ((None, None, 30), (0, 30, False)),
+            (('records=10-', None, 30), (10, 30, True)),
+            (('records=10-14', None, 30), (10, 15, True)),
+            (('records=25-99', None, 30), (25, 30, True)),
+            ((None, '29', 30), (29, 30, True)),
+            # Dataset vide : seule la position 0 est satisfaisable, et la réponse est complète
+            ((None, None, 0), (0, 0, False)),
+            (('records=0-', None, 0), (0, 0, False)),
+            ((None, '0', 0), (0, 0, False)),
+        ]
+        for args, expected in cases:
+            with self.subTest(args=args):
+                self.assertEqual(export.parse_range(*args), expected)
+        for args in (('records=30-', None, 30), ('records=5-2', None, 30), ('bytes=0-', None, 30),
+                     (None, '-1', 30), (None, '5', 0), ('records=3-7', None, 0)):
+            with self.subTest(args=args), self.assertRaises(export.InvalidRange):
+                export.parse_range(*args)
+
+    def test_empty_dataset(self):
+        os.makedirs(f'{self.lake_dir}/TRANSACTIONS_EMPTY')
+        response, body = self.export('TRANSACTIONS_EMPTY')
+        self.assertEqual((response.status_code, body), (200, ''))
+        response, body = self.export('TRANSACTIONS_EMPTY', Range='records=0-')
+        self.assertEqual((response.status_code, body), (200, ''))
+        response, _body = self.export('TRANSACTIONS_EMPTY', 'offset=5')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'records */0'))
+
+    def test_resume_from_range(self):
+        records = segments.load_dataset(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+        response, body = self.export('TRANSACTIONS_COMPLETED', Range='records=20-24')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'records 20-24/30'))
+        self.assertEqual([export.codec.loads(line) for line in body.splitlines()], records[20:25])
+
+    def test_csv_columns_are_the_union_of_all_records(self):
+        with open(f'{self.lake_dir}/TRANSACTIONS_COMPLETED/29990101_000000000000.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW", "LOCATION": null, "COUPON": "SPRING"}')
+        response, body = self.export('TRANSACTIONS_COMPLETED', 'output=csv')
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(rows), 31)
+        self.assertIn('LOCATION.COUNTRY', rows[0])
+        self.assertEqual((rows[-1]['COUPON'], rows[-1]['LOCATION'], rows[0]['COUPON']), ('SPRING', '', ''))
+        self.assertTrue(rows[0]['LOCATION.COUNTRY'])
+
+
+class LakeCacheTests(LakeTestCase):
+    """Cache de datasets : revalidation par mtime, chargement incrémental, éviction LRU"""
+
+    def test_fresh_entry_is_served_without_listing_the_folder(self):
+        cache = DatasetCache()
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        entry = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertEqual(list(entry.records), segments.load_dataset(folder_path))
+
+        # Dossier inchangé depuis longtemps : aucun accès au disque à part le stat
+        old = time.time() - 60
+        os.utime(folder_path, (old, old))
+        cache.invalidate()
+        loaded = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        with mock.patch.object(segments, 'list_entries', side_effect=AssertionError('folder listed')):
+            self.assertIs(cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED'), loaded)
+            self.assertIs(cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED'), loaded)
+        self.assertEqual((cache.misses, cache.hits), (2, 2))
+
+    def test_new_files_are_loaded_incrementally(self):
+        cache = DatasetCache()
+        before = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        with open(f'{self.lake_dir}/TRANSACTIONS_COMPLETED/29990101_000000000000.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW"}')
+        with mock.patch.object(segments, 'read_segment', side_effect=AssertionError('segment reread')):
+            after = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertEqual(cache.incremental_loads, 1)
+        self.assertEqual((len(before.records), len(after.records)), (30, 31))
+        self.assertEqual(after.records[-1], {'TRANSACTION_ID': 'TXN-NEW'})
+
+        # Un fichier disparu impose un rechargement complet
+        os.remove(f'{self.lake_dir}/TRANSACTIONS_COMPLETED/29990101_000000000000.json')
+        self.assertEqual(len(cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED').records), 30)
+        self.assertEqual(cache.misses, 2)
+
+    def test_least_recently_used_dataset_is_evicted(self):
+        names = ['TRANSACTIONS_COMPLETED', 'TRANSACTIONS_CANCELLED', 'TRANSACTIONS_PENDING']
+        sizes = {name: DatasetCache().get_entry(self.lake_dir, name).nbytes for name in names}
+
+        cache = DatasetCache(max_bytes=sum(sizes.values()) - 1)
+        cache.get_entry(self.lake_dir, names[0])
+        cache.get_entry(self.lake_dir, names[1])
+        cache.get_entry(self.lake_dir, names[0])
+        cache.get_entry(self.lake_dir, names[2])
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual([key[1] for key in cache._entries], [names[0], names[2]])
+        self.assertEqual(cache.bytes, sizes[names[0]] + sizes[names[2]])
+
+        # Un dataset plus gros que tout le budget est servi sans être gardé
+        small = DatasetCache(max_bytes=1)
+        self.assertEqual(len(small.get_entry(self.lake_dir, names[0]).records), 30)
+        self.assertEqual(small.stats()['entries'], 0)
+
+
+class LakeSegmentTests(LakeTestCase):
+    """Compaction en segments (``compact_dataset``) : mêmes enregistrements, seuls les nouveaux fichiers ajoutés"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+
+    def setUp(self):
+        super().setUp()
+        self.folder_path = f'{self.lake_dir}/RAW'
+        os.makedirs(self.folder_path)
+        self.records = [{'ID': index, 'AMOUNT': index * 1.5} for index in range(7)]
+        self.records[3] = {'ID': 3, 'NOTE': 'sans montant'}
+        for index, record in enumerate(self.records):
+            self.write(f'2025010{index}_000000000000.json', record)
+
+    def write(self, name, content):
+        with open(f'{self.folder_path}/{name}', 'wb') as f:
+            f.write(codec.dumps(content))
+
+    def test_compaction_keeps_records_and_order(self):
+        self.assertEqual(segments.compact_dataset(self.folder_path, segment_size=3), 7)
+        manifest = segments.read_manifest(self.folder_path)
+        self.assertEqual([segment['records'] for segment in manifest['segments']], [3, 3, 1])
+        self.assertEqual(segments.load_dataset(self.folder_path), self.records)
+
+        # Projection dans les segments : seules les colonnes demandées sont reconstruites
+        entries = segments.list_entries(self.folder_path)
+        self.assertEqual(segments.read_entries(self.folder_path, entries[3:4], fields={'AMOUNT'}),
+                         [('20250103_000000000000.json', [{}])])
+
+    def test_only_new_files_are_compacted(self):
+        segments.compact_dataset(self.folder_path, segment_size=3)
+        self.write('20250201_000000000000.json', [{'ID': 7}, {'ID': 8}])
+        # Un fichier de la queue est lu directement jusqu'à la prochaine compaction
+        self.assertEqual(segments.list_entries(self.folder_path)[-1], ('20250201_000000000000.json', None, None))
+        self.assertEqual(segments.compact_dataset(self.folder_path, segment_size=3), 1)
+        self.assertEqual(segments.compact_dataset(self.folder_path, segment_size=3), 0)
+        self.assertEqual(segments.load_dataset(self.folder_path), self.records + [{'ID': 7}, {'ID': 8}])
+
+        self.assertEqual(segments.compact_dataset(self.folder_path, segment_size=100, rebuild=True), 8)
+        self.assertEqual(
+            sorted(name for name in os.listdir(segments.segment_dir(self.folder_path)) if name.startswith('seg-')),
+            ['seg-000001.json.gz'],
+        )
+        self.assertEqual(len(segments.load_dataset(self.folder_path)), 9)
+
+    def test_rewritten_source_is_not_served_from_its_segment(self):
+        segments.compact_dataset(self.folder_path, segment_size=3)
+        self.write('20250101_000000000000.json', [{'ID': 1, 'AMOUNT': 99.0}, {'ID': 10}])
+        # Lu depuis la source à sa place, jusqu'à la prochaine compaction
+        self.assertEqual(segments.list_entries(self.folder_path)[1], ('20250101_000000000000.json', None, None))
+        expected = self.records[:1] + [{'ID': 1, 'AMOUNT': 99.0}, {'ID': 10}] + self.records[2:]
+        self.assertEqual(segments.load_dataset(self.folder_path), expected)
+
+        self.assertEqual(segments.compact_dataset(self.folder_path, segment_size=3), 1)
+        manifest = segments.read_manifest(self.folder_path)
+        self.assertEqual(manifest['segments'][0]['files'], ['20250100_000000000000.json', '20250102_000000000000.json'])
+        self.assertEqual(manifest['segments'][-1]['files'], ['20250101_000000000000.json'])
+        self.assertEqual(segments.list_entries(self.folder_path)[-1][:2], ('20250101_000000000000.json', manifest['segments'][-1]['name']))
+        self.assertEqual(sorted(map(str, segments.load_dataset(self.folder_path))), sorted(map(str, expected)))
+        self.assertEqual(segments.compact_dataset(self.folder_path, segment_size=3), 0)
+
+
+class LakeCatalogTests(LakeTestCase):
+    def test_scan_records_counts_and_timestamps(self):
+        stats = catalog.scan_version(self.version)
+        self.assertEqual((stats.datasets, stats.files, stats.records), (3, 90, 90))
+
+        dataset = CatalogDataset.objects.get(version=self.version, dataset_name='TRANSACTIONS_COMPLETED')
+        records = segments.load_dataset(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+        timestamps = sorted(record['TIMESTAMP'] for record in records)
+        self.assertEqual((dataset.files, dataset.records), (30, 30))
+        self.assertEqual(dataset.min_timestamp.strftime('%Y-%m-%dT%H:%M:%S.%fZ'), timestamps[0])
+        self.assertEqual(dataset.max_timestamp.strftime('%Y-%m-%dT%H:%M:%S.%fZ'), timestamps[-1])
+        self.assertEqual(len(dataset.schemas), 1)
+        self.assertEqual(CatalogFile.objects.filter(dataset_name='TRANSACTIONS_COMPLETED').exclude(segment_name='').count(), 25)
+
+    def test_rescan_only_reads_changed_files(self):
+        catalog.scan_version(self.version)
+        self.assertEqual(catalog.scan_version(self.version).read_files, 0)
+
+        shutil.rmtree(f'{self.lake_dir}/TRANSACTIONS_PENDING')
+        stats = catalog.scan_version(self.version)
+        self.assertEqual(stats.removed_datasets, 1)
+        self.assertFalse(CatalogFile.objects.filter(dataset_name='TRANSACTIONS_PENDING').exists())
+
+
+class LakeQueryTests(TestCase):
+    """``?fields=`` / ``?where=`` : analyse, projection et filtres, sur des dicts comme dans les segments"""
+
+    records = [
+        {'ID': 1, 'AMOUNT': 500, 'STATUS': 'completed', 'LOCATION': {'COUNTRY': 'FR', 'CITY': 'Paris'}},
+        {'ID': 2, 'AMOUNT': '750.5', 'STATUS': 'pending', 'LOCATION': {'COUNTRY': 'BE'}},
+        {'ID': 3, 'AMOUNT': None, 'STATUS': 'completed'},
+        {'ID': 4, 'AMOUNT': True, 'STATUS': 'completed', 'LOCATION': 'FR'},
+    ]
+
+    def apply(self, fields=None, where=()):
+        query = LakeQuery.from_params(fields=fields, where=where)
+        records = query.apply(self.records)
+        # La lecture colonne par colonne d'un segment donne le même résultat
+        segment = segments.encode_segment(['a.json'], [len(self.records)], self.records)
+        self.assertEqual(query.scan_segment(segment, 0, len(self.records)), records)
+        return records
+
+    def test_projection_keeps_nested_structure(self):
+        self.assertEqual(self.apply(fields='ID, LOCATION.COUNTRY'), [
+            (0, {'ID': 1, 'LOCATION': {'COUNTRY': 'FR'}}),
+            (1, {'ID': 2, 'LOCATION': {'COUNTRY': 'BE'}}),
+            (2, {'ID': 3}),
+            (3, {'ID': 4}),
+        ])
+        query = LakeQuery.from_params(fields='ID,LOCATION.CITY', where=['STATUS=completed'])
+        self.assertEqual(query.columns, {'ID', 'LOCATION', 'STATUS'})
+        self.assertIsNone(LakeQuery.from_params().columns)
+
+    def test_predicates(self):
+        def ids(*where):
+            return [record['ID'] for _position, record in self.apply(where=where)]
+
+        self.assertEqual(ids('STATUS=completed'), [1, 3, 4])
+        # Valeur numérique : les chaînes numériques sont converties, booléens et null écartés
+        self.assertEqual(ids('AMOUNT >= 500'), [1, 2])
+        self.assertEqual(ids('AMOUNT<600'), [1])
+        self.assertEqual(ids('AMOUNT!=500'), [2])
+        self.assertEqual(ids('LOCATION.COUNTRY=FR'), [1])
+        self.assertEqual(ids('STATUS=completed', 'AMOUNT>100'), [1])
+        self.assertEqual(ids('MISSING=1'), [])
+        # Les positions sont celles des enregistrements dans le fichier
+        self.assertEqual([position for position, _record in self.apply(where=['STATUS=pending'])], [1])
+
+    def test_invalid_parameters(self):
+        for params in (
+            {'fields': ''},
+            {'fields': ' , '},
+            {'fields': 'LOCATION..COUNTRY'},
+            {'where': ['AMOUNT~1']},
+            {'where': ['=1']},
+            {'where': ['LOCATION-COUNTRY=FR']},
+        ):
+            with self.subTest(params=params):
+                with self.assertRaises(InvalidQuery):
+                    LakeQuery.from_params(**params)
+
+
+class LakeTimeWindowTests(LakeTestCase):
+    """``?from=`` / ``?to=`` : les fichiers hors de la fenêtre ne sont pas lus"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+
+    def setUp(self):
+        super().setUp()
+        records = segments.load_dataset(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+        timestamps = sorted(record['TIMESTAMP'] for record in records)
+        self.start, self.end = timestamps[10], timestamps[20]
+        self.window = TimeWindow(parse_moment(self.start), parse_moment(self.end))
+        self.expected = sorted(record['TRANSACTION_ID'] for record in records if self.start <= record['TIMESTAMP'] < self.end)
+
+    def test_catalogued_files_outside_window_are_pruned(self):
+        catalog.scan_version(self.version)
+        index = timeindex.get_time_index(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertEqual(len(index), 30)
+
+        pager = DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED', window=self.window, index=index)
+        self.assertEqual((len(pager.files), pager.pruned), (10, 20))
+
+        response = self.client.get(
+            f'/myapp/data_lake/TRANSACTIONS_COMPLETED/version/V1/?from={self.start}&to={self.end}', headers=self.auth
+        )
+        self.assertEqual(sorted(record['TRANSACTION_ID'] for record in response.json()['data']), self.expected)
+
+    def test_uncatalogued_files_are_filtered_while_read(self):
+        pager = DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED', window=self.window)
+        # Sans catalogue, seuls les fichiers non compactés (lus pour être comptés) peuvent être écartés
+        self.assertEqual(pager.pruned + len(pager.files), 30)
+        self.assertGreaterEqual(len(pager.files), 25)
+
+        data = self.client.get(
+            f'/myapp/retrieve_projection/TRANSACTIONS_COMPLETED/?fields=TRANSACTION_ID&from={self.start}&to={self.end}',
+            headers=self.auth,
+        ).json()
+        self.assertIsNone(data['total'])
+        self.assertEqual(sorted(record['TRANSACTION_ID'] for record in data['results']), self.expected)
+
+    def test_invalid_window(self):
+        for query in ('from=yesterday', f'from={self.end}&to={self.start}'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/myapp/data_lake/TRANSACTIONS_COMPLETED/version/V1/?{query}', headers=self.auth)
+                self.assertEqual(response.status_code, 400)
+
+
+class LakeKeyIndexTests(LakeTestCase):
+    """Index des clés : ``index_lake_keys`` et ``/myapp/data_lake/lookup/``"""
+
+    def setUp(self):
+        super().setUp()
+        self.records = segments.load_dataset(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+
+    def lookup(self, query):
+        return self.client.get(f'/myapp/data_lake/lookup/?{query}', headers=self.auth)
+
+    def test_lookup_reads_the_record_from_its_segment_or_file(self):
+        stats = keyindex.index_version(self.version)
+        self.assertEqual((stats.files, stats.keys), (90, 270))
+
+        # Le premier enregistrement est dans un segment, le dernier dans la queue non compactée
+        for record in (self.records[0], self.records[-1]):
+            data = self.lookup(f"transaction_id={record['TRANSACTION_ID']}").json()
+            self.assertEqual([hit['record'] for hit in data['results']], [record])
+
+        # Les identifiants synthétiques se répètent d'un dataset à l'autre : seuls ceux autorisés sont cherchés
+        transaction_id = self.records[0]['TRANSACTION_ID']
+        self.assertEqual(LakeKey.objects.filter(field='TRANSACTION_ID', value=transaction_id).count(), 3)
+        data = self.lookup(f'transaction_id={transaction_id}').json()
+        self.assertEqual([hit['dataset'] for hit in data['results']], ['TRANSACTIONS_COMPLETED'])
+        self.assertEqual(self.lookup('transaction_id=a&user_id=b').status_code, 400)
+
+    def test_reindex_only_reads_changed_files(self):
+        keyindex.index_version(self.version)
+        self.assertEqual(keyindex.index_version(self.version).read_files, 0)
+
+        with open(f'{self.lake_dir}/TRANSACTIONS_COMPLETED/29990101_000000000000.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW", "USER_ID": "USER-NEW"}')
+        stats = keyindex.index_version(self.version, dataset_names=['TRANSACTIONS_COMPLETED'])
+        self.assertEqual((stats.read_files, stats.keys), (1, 2))
+        self.assertEqual(self.lookup('transaction_id=TXN-NEW').json()['results'][0]['offset'], 0)
+
+        shutil.rmtree(f'{self.lake_dir}/TRANSACTIONS_PENDING')
+        self.assertEqual(keyindex.index_version(self.version).removed_datasets, 1)
+        self.assertFalse(LakeKey.objects.filter(dataset_name='TRANSACTIONS_PENDING').exists())
+
+    def test_rebuilt_segment_is_reindexed(self):
+        keyindex.index_version(self.version)
+        # Segment reconstruit sans les sources : mêmes fichiers, contenus permutés
+        folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+        segment_name = segments.read_manifest(folder_path)['segments'][1]['name']
+        segment = segments.read_segment(folder_path, segment_name)
+        segment_path = os.path.join(segments.segment_dir(folder_path), segment_name)
+        segments.write_atomic(segment_path,
+                              segments.encode_segment(segment['files'], segment['counts'], self.records[10:20][::-1]),
+                              opener=gzip.open)
+        later = time.time() + 10
+        os.utime(segment_path, (later, later))
+
+        stats = keyindex.index_version(self.version, dataset_names=['TRANSACTIONS_COMPLETED'])
+        self.assertEqual(stats.read_files, 10)
+        data = self.lookup(f"transaction_id={self.records[10]['TRANSACTION_ID']}&dataset=TRANSACTIONS_COMPLETED").json()
+        self.assertEqual([(hit['file'], hit['record']) for hit in data['results']],
+                         [(segment['files'][-1], self.records[10])])
+
+    def test_long_values_are_matched_on_the_full_value(self):
+        prefix = 'TXN-' + 'x' * 120
+        for index, transaction_id in enumerate((prefix + 'A', prefix + 'B')):
+            with open(f'{self.lake_dir}/TRANSACTIONS_COMPLETED/2999010{index}_000000000000.json', 'w') as f:
+                f.write(f'{{"TRANSACTION_ID": "{transaction_id}"}}')
+        keyindex.index_version(self.version, dataset_names=['TRANSACTIONS_COMPLETED'])
+
+        data = self.lookup(f'transaction_id={prefix}B').json()
+        self.assertEqual([hit['record']['TRANSACTION_ID'] for hit in data['results']], [prefix + 'B'])
+
+    def test_compacted_hit_is_read_from_the_mapped_store(self):
+        keyindex.index_version(self.version)
+        mapped.build_store(f'{self.lake_dir}/TRANSACTIONS_COMPLETED')
+        record = self.records[12]
+
+        with mock.patch.object(segments, 'read_segment', side_effect=AssertionError('segment read')):
+            data = self.lookup(f"transaction_id={record['TRANSACTION_ID']}&dataset=TRANSACTIONS_COMPLETED").json()
+        self.assertEqual([hit['record'] for hit in data['results']], [record])
+
+
+class LakeMappedStoreTests(LakeTestCase):
+    """Fichier colonnaire projeté : mêmes enregistrements que le dataset d'origine"""
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+
+    def setUp(self):
+        super().setUp()
+        self.folder_path = f'{self.lake_dir}/TRANSACTIONS_COMPLETED'
+
+    def test_round_trip_of_mixed_records(self):
+        records = [
+            {'ID': 1, 'AMOUNT': 1.5, 'STATUS': 'completed', 'LOCATION': {'COUNTRY': 'India', 'CITY': 'Pune'}, 'OK': True},
+            {'ID': 2, 'AMOUNT': None, 'STATUS': 'completed', 'LOCATION': 'unknown', 'TAGS': ['a', 'b']},
+            {'ID': 3, 'STATUS': None, 'LOCATION': {}, 'NOTE': 'é', 'OK': False},
+            {'ID': 2 ** 70, 'STATUS': 'pending', 'NOTE': 3},
+        ]
+        path = f'{self.lake_dir}/store.bin'
+        with open(path, 'wb') as f:
+            f.write(mapped.encode_store([('a.json', 4)], records))
+        rows = mapped.MappedRecords(mapped.MappedStore(path))
+        self.assertEqual(rows[:], records)
+        self.assertEqual((rows[-1], rows[1:3], list(rows)), (records[-1], records[1:3], records))
+
+    def test_cache_serves_mapped_store_and_new_files(self):
+        expected = segments.load_dataset(self.folder_path)
+        records, _size = mapped.build_store(self.folder_path)
+        self.assertEqual(records, 30)
+        kinds = {column.path: column.kind for column in mapped.open_store(self.folder_path).columns}
+        self.assertEqual((kinds[('STATUS',)], kinds[('LOCATION', 'COUNTRY')], kinds[('AMOUNT',)]), ('dict', 'dict', 'float'))
+
+        cache = get_dataset_cache()
+        self.assertEqual(list(cache.get(self.lake_dir, 'TRANSACTIONS_COMPLETED')), expected)
+        entry = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertTrue(entry.is_mapped)
+        self.assertEqual(DatasetPager(self.lake_dir, 'TRANSACTIONS_COMPLETED').read(10, 12), expected[10:13])
+        self.assertEqual([name for name in os.listdir(segments.segment_dir(self.folder_path)) if name.endswith('.tmp')], [])
+
+        # Les fichiers arrivés après la construction sont ajoutés à part
+        with open(f'{self.folder_path}/29990101_000000000000.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW"}')
+        cache.invalidate(self.lake_dir)
+        entry = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertTrue(entry.is_mapped)
+        self.assertEqual(entry.records.extra, [{'TRANSACTION_ID': 'TXN-NEW'}])
+        self.assertEqual(list(entry.records), expected + [{'TRANSACTION_ID': 'TXN-NEW'}])
+
+    def test_rewritten_source_file_disables_store(self):
+        mapped.build_store(self.folder_path)
+        tail = sorted(name for name in os.listdir(self.folder_path) if name.endswith('.json'))[-1]
+        with open(f'{self.folder_path}/{tail}', 'w') as f:
+            f.write('[{"TRANSACTION_ID": "TXN-REWRITTEN"}, {"TRANSACTION_ID": "TXN-EXTRA"}]')
+
+        entry = get_dataset_cache().get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertFalse(entry.is_mapped)
+        self.assertEqual(len(entry.records), 31)
+        self.assertTrue(mapped.needs_rebuild(self.folder_path, min_files=100, max_age=3600))
+
+    @override_settings(DATA_LAKE_MAPPED_REBUILD_FILES=2, DATA_LAKE_MAPPED_REBUILD_AGE=3600)
+    def test_watcher_rebuild_is_picked_up_by_cache(self):
+        mapped.build_store(self.folder_path)
+        cache = get_dataset_cache()
+        cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+
+        with open(f'{self.folder_path}/29990101_000000000000.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW"}')
+        # Un seul fichier non couvert : sous le seuil, pas de reconstruction
+        stamp = mapped.store_stamp(self.folder_path)
+        watcher.rebuild_mapped_store(self.version, 'TRANSACTIONS_COMPLETED', None)
+        self.assertEqual(mapped.store_stamp(self.folder_path), stamp)
+
+        with open(f'{self.folder_path}/29990101_000000000001.json', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEWER"}')
+        watcher.rebuild_mapped_store(self.version, 'TRANSACTIONS_COMPLETED', None)
+        self.assertNotEqual(mapped.store_stamp(self.folder_path), stamp)
+
+        entry = cache.get_entry(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertEqual((len(entry.records.store), entry.records.extra), (32, []))
+
+    def test_dataset_version_is_encoded_without_materializing(self):
+        expected = segments.load_dataset(self.folder_path)
+        mapped.build_store(self.folder_path)
+        rows = get_dataset_cache().get(self.lake_dir, 'TRANSACTIONS_COMPLETED')
+        self.assertEqual(codec.dumps({'data': rows, 'n': 1}), codec.dumps({'data': expected, 'n': 1}))
+
+        with mock.patch.object(mapped.MappedRecords, '__getitem__', side_effect=AssertionError('materialized')):
+            response = self.client.get('/myapp/data_lake/TRANSACTIONS_COMPLETED/version/V1/', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'], expected)
+
+
+class LakeWatcherTests(LakeTestCase):
+    lake_records = 10
+    lake_datasets = ['TRANSACTIONS_COMPLETED']
+    tail_files = 10
+
+    def setUp(self):
+        super().setUp()
+        self.deliveries = []
+        self.fail_next = 0
+
+        def flaky(version, dataset_name, filenames):
+            if self.fail_next:
+                self.fail_next -= 1
+                raise RuntimeError('unavailable')
+            self.deliveries.append((dataset_name, filenames))
+
+        self.addCleanup(watcher.CONSUMERS.pop, 'test')
+        watcher.register_consumer('test')(flaky)
+        self.watcher = watcher.LakeWatcher(
+            consumers=['catalog', 'test'], polling=True, poll_interval=0.01, batch_delay=0,
+            status_path=f'{self.lake_dir}/status.json', log=lambda message: None,
+        )
+        self.addCleanup(self.watcher.source.close)
+
+    def write_file(self, name):
+        with open(f'{self.lake_dir}/TRANSACTIONS_COMPLETED/{name}', 'w') as f:
+            f.write('{"TRANSACTION_ID": "TXN-NEW", "TIMESTAMP": "2025-04-07T16:04:01.462799Z"}')
+
+    def test_catch_up_then_new_files(self):
+        self.watcher.refresh_versions()
+        self.watcher.dispatch(force=True)
+        self.assertEqual(self.deliveries, [('TRANSACTIONS_COMPLETED', None)])
+        self.assertEqual(CatalogDataset.objects.get().files, 10)
+
+        self.write_file('20990101_000000000000.json')
+        self.watcher.run_once(timeout=0.05)
+        self.assertEqual(self.deliveries[-1], ('TRANSACTIONS_COMPLETED', ['20990101_000000000000.json']))
+        self.assertEqual(CatalogDataset.objects.get().files, 11)
+        status = watcher.codec.load_file(self.watcher.status_path)
+        self.assertEqual(status['consumers']['test']['delivered_files'], 1)
+        self.assertIn('myapp_lake_watcher_lag_seconds{consumer="test"}', watcher.render_metrics(self.watcher.status_path))
+
+    def test_failed_batches_are_retried(self):
+        self.watcher.refresh_versions()
+        self.watcher.dispatch(force=True)
+        self.fail_next = 1
+        self.write_file('20990101_000000000000.json')
+        self.watcher.run_once(timeout=0.05)
+        state = self.watcher.consumers['test']
+        self.assertEqual((state.failures, state.pending_files), (1, 1))
+        # Le consommateur qui a réussi n'est pas rejoué
+        self.assertEqual(self.watcher.consumers['catalog'].pending_files, 0)
+
+        self.write_file('20990101_000000000001.json')
+        self.watcher.handle_events(self.watcher.source.poll(0.05))
+        for batch in state.batches.values():
+            batch.next_try = 0
+        self.watcher.dispatch(force=True)
+        self.assertEqual(self.deliveries[-1], (
+            'TRANSACTIONS_COMPLETED', ['20990101_000000000000.json', '20990101_000000000001.json']
+        ))
+        self.assertEqual(state.pending_files, 0)
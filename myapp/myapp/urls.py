@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'transactions', views.TransactionViewSet, basename='transaction')
@@ -14,7 +14,16 @@ urlpatterns = [
     path('stats/total_by_user/', views.total_spent_by_user_type, name='total-by-user'),
     path('stats/top_products/', views.top_products, name='top-products'),
     path('data_lake/resources/', views.list_data_lake_resources, name='list-resources'),
+    path('data_lake/lookup/', views.lookup_lake_keys, name='lookup-lake-keys'),
+    path('data_lake/cache_stats/', views.data_lake_cache_stats, name='data-lake-cache-stats'),
+    path('metrics/', views.performance_metrics, name='performance-metrics'),
     path('data_lake/<str:dataset_name>/version/<str:version_name>/', views.get_dataset_version, name='get-dataset-version'),
+    path('data_lake/<str:dataset_name>/version/<str:version_name>/export/', views.export_dataset_version, name='export-dataset-version'),
     path('data_lake/<str:dataset_name>/access_history/', views.get_dataset_access_history, name='dataset-access-history'),
     path('search/full-text/', views.full_text_search, name='full-text-search'),
+    # Lectures du lake en async, pour un serveur ASGI (voir async_views.py)
+    path('async/retrieve_all/', async_views.retrieve_all, name='async-retrieve-all'),
+    path('async/retrieve_projection/<str:dataset_name>/', async_views.retrieve_projection, name='async-retrieve-projection'),
+    path('async/data_lake/resources/', async_views.list_data_lake_resources, name='async-list-resources'),
+    path('async/data_lake/<str:dataset_name>/version/<str:version_name>/', async_views.get_dataset_version, name='async-get-dataset-version'),
 ]
@@ -5,26 +5,30 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import viewsets, filters, status
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
 from django_filters import rest_framework
+import itertools
 import os
 import json
 from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta, datetime
-from django.db.models import Sum, Count
-from django.db.models.functions import Coalesce
-from django.db.models import FloatField, DecimalField
 from elasticsearch_dsl import Q
-from . import documents
+from . import documents, export, instrumentation, watcher
+from .access_log import log_dataset_access, log_request
+from .lake import catalog, keyindex, segments, timeindex
+from .permissions import get_permissions
+from .lake.cache import get_dataset_cache
+from .lake.fanout import open_pagers
+from .lake.paging import DatasetPager, InvalidCursor, decode_cursor, paginate
+from .lake.query import InvalidQuery, LakeQuery, TimeWindow
+from .pagination import TransactionCursorPagination
+from .streaming import parse_window, trailing_spent
 
-from .models import AccessRight, AccessRightSerializer, AccessLog, Transaction, TransactionSerializer, DataLakeVersion, DetailedAccessLog
+from .models import AccessRight, AccessRightSerializer, AccessLog, Transaction, TransactionSerializer, DataLakeVersion, DetailedAccessLog, UserSpendingRollup, ProductRollup
 
 def log_access(request):
-    AccessLog.objects.create(
-        user=request.user,
-        request_path=request.path,
-        request_method=request.method,
-        request_body=request.body.decode('utf-8') if request.body else ''
-    )
+    """Journalise l'appel ; l'écriture en base est faite en arrière-plan par paquets"""
+    log_request(request)
 
 @api_view(['GET'])
 @authentication_classes([BasicAuthentication])
@@ -37,7 +41,7 @@ def access_right_list(request):
 
 def check_dataset_access(user, dataset_name):
     """Vérifie si l'utilisateur a accès au dataset"""
-    return AccessRight.objects.filter(user=user, dataset_name=dataset_name).exists()
+    return get_permissions(user).can_access(dataset_name)
 
 @api_view(['GET'])
 @authentication_classes([BasicAuthentication])
@@ -46,34 +50,73 @@ def retrieve_all(request):
     log_access(request)
     
     # Récupérer tous les datasets auxquels l'utilisateur a accès
-    user_datasets = AccessRight.objects.filter(user=request.user).values_list('dataset_name', flat=True)
+    user_datasets = get_permissions(request.user).datasets
     if not user_datasets:
         return Response({"detail": "You don't have access to any datasets"}, status=status.HTTP_403_FORBIDDEN)
     
-    authorized_data = []
-    for dataset in user_datasets:
-        data = load_data_for_dataset(dataset)
-        if data:
-            authorized_data.extend(data if isinstance(data, list) else [data])
-    
-    # Récupérer le paramètre ?page= (int, par défaut 1)
-    page = int(request.query_params.get('page', 1))
-    start = (page - 1) * PAGE_SIZE
-    end = start + PAGE_SIZE
-    
-    # Si hors bornes, renvoyer 404 ou liste vide
-    if start >= len(authorized_data):
-        return Response({"detail": "Page out of range"}, status=status.HTTP_404_NOT_FOUND)
-    
-    page_data = authorized_data[start:end]
+    # Datasets ouverts en parallèle ; ceux qui dépassent l'échéance ou sont illisibles sont signalés dans skipped_datasets
+    pagers, skipped = open_pagers(DATA_LAKE_PATH, user_datasets)
+    error = skipped_cursor_response(request.query_params, skipped)
+    if error is not None:
+        return error
+    return paginated_lake_response(request.query_params, pagers, {"skipped_datasets": skipped} if skipped else {})
+
+def skipped_cursor_response(params, skipped):
+    """Réponse 503 si le curseur demandé pointe dans un dataset écarté par l'échéance"""
+    cursor = params.get('cursor')
+    if not skipped or not cursor:
+        return None
+    try:
+        dataset_name = decode_cursor(cursor)[0]
+    except InvalidCursor:
+        return None
+    if dataset_name not in skipped:
+        return None
+    response = Response(
+        {"detail": f"Dataset '{dataset_name}' could not be read in time, retry later"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = '1'
+    return response
+
+def paginated_lake_response(params, pagers, extra, query=None):
+    """Page de résultats à partir de ?cursor= (prioritaire) ou ?page= (int, par défaut 1).
+
+    ``params`` est le QueryDict de la requête. Avec des filtres ``where``, le
+    total n'est pas connu sans tout parcourir : il vaut None.
+    """
+    filtered = query is not None and query.filtered
+    total = None if filtered else sum(pager.total for pager in pagers)
+    cursor = params.get('cursor')
+    try:
+        if cursor:
+            page_data, next_cursor = paginate(pagers, PAGE_SIZE, cursor=cursor, query=query)
+            position = {"cursor": cursor}
+        else:
+            page = int(params.get('page', 1))
+            start = (page - 1) * PAGE_SIZE
+            # Si hors bornes, renvoyer 404
+            if start < 0 or (total is not None and start >= total):
+                return Response({"detail": "Page out of range"}, status=status.HTTP_404_NOT_FOUND)
+            page_data, next_cursor = paginate(pagers, PAGE_SIZE, offset=start, query=query)
+            if filtered and page > 1 and not page_data:
+                return Response({"detail": "Page out of range"}, status=status.HTTP_404_NOT_FOUND)
+            position = {"page": page}
+    except InvalidCursor:
+        return Response({"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({"detail": "Invalid page"}, status=status.HTTP_400_BAD_REQUEST)
+
     return Response({
-        "page": page,
+        **extra,
+        **position,
         "page_size": PAGE_SIZE,
-        "total": len(authorized_data),
+        "total": total,
+        "next_cursor": next_cursor,
         "results": page_data
     })
 
-DATA_LAKE_PATH = "C:/Users/yanis/OneDrive/Documents/M1 Data/Data integration/TP2_API/data_lake"
+DATA_LAKE_PATH = settings.DATA_LAKE_PATH
 PAGE_SIZE = 10
 
 def load_all_data():
@@ -81,45 +124,26 @@ def load_all_data():
     for folder_name in os.listdir(DATA_LAKE_PATH):
         folder_path = os.path.join(DATA_LAKE_PATH, folder_name)
         if os.path.isdir(folder_path):
-            for filename in os.listdir(folder_path):
-                if filename.endswith('.json'):
-                    file_path = os.path.join(folder_path, filename)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = json.load(f)
-                            if isinstance(content, list):
-                                all_data.extend(content)
-                            else:
-                                all_data.append(content)
-                    except Exception as e:
-                        # ignore ou log error
-                        pass
+            try:
+                all_data.extend(segments.load_dataset(folder_path))
+            except Exception as e:
+                # ignore ou log error
+                pass
     return all_data
 
 def load_data_for_dataset(dataset_name, base_path=None):
-    """Version modifiée de load_data_for_dataset qui accepte un chemin de base"""
+    """Charge un dataset (segments compactés + fichiers JSON non compactés) via le cache du processus"""
     if base_path is None:
         base_path = DATA_LAKE_PATH
         
-    folder_path = os.path.join(base_path, dataset_name)
-    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-        return None
+    with instrumentation.phase('load'):
+        return get_dataset_cache().get(base_path, dataset_name)
 
-    data = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.json'):
-            file_path = os.path.join(folder_path, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = json.load(f)
-                    if isinstance(content, list):
-                        data.extend(content)
-                    else:
-                        data.append(content)
-            except Exception:
-                # Ignorer ou logger l'erreur
-                pass
-    return data
+def load_window_for_dataset(dataset_name, window, base_path, index=None):
+    """Enregistrements d'un dataset dans une fenêtre ``from`` / ``to`` ; seuls les fichiers qui la recoupent sont lus"""
+    with instrumentation.phase('load'):
+        pager = DatasetPager(base_path, dataset_name, window=window, index=index)
+        return [record for record in pager.iter_records() if window.test(record.get('TIMESTAMP'))]
 
 @api_view(['GET'])
 @authentication_classes([BasicAuthentication])
@@ -127,32 +151,29 @@ def load_data_for_dataset(dataset_name, base_path=None):
 def retrieve_projection(request, dataset_name):
     log_access(request)
     
-    user_access = AccessRight.objects.filter(user=request.user, dataset_name=dataset_name)
-    if not user_access.exists():
+    if not check_dataset_access(request.user, dataset_name):
         return Response(
             {"detail": f"Access Denied: You don't have permission to access dataset '{dataset_name}'."}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    data = load_data_for_dataset(dataset_name)
-    if data is None:
+    if not os.path.isdir(os.path.join(DATA_LAKE_PATH, dataset_name)):
         return Response({"detail": f"Dataset '{dataset_name}' not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    page = int(request.query_params.get('page', 1))
-    start = (page - 1) * PAGE_SIZE
-    end = start + PAGE_SIZE
-
-    if start >= len(data):
-        return Response({"detail": "Page out of range"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        query = LakeQuery.from_params(
+            fields=request.query_params.get('fields'),
+            where=request.query_params.getlist('where'),
+            start=request.query_params.get('from'),
+            end=request.query_params.get('to')
+        )
+    except InvalidQuery as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    page_data = data[start:end]
-    return Response({
-        "dataset": dataset_name,
-        "page": page,
-        "page_size": PAGE_SIZE,
-        "total": len(data),
-        "results": page_data
-    })
+    # Avec from / to, les fichiers hors de la fenêtre sont écartés avant d'être ouverts
+    index = timeindex.get_time_index(DATA_LAKE_PATH, dataset_name) if query.window else None
+    pager = DatasetPager(DATA_LAKE_PATH, dataset_name, window=query.window, index=index)
+    return paginated_lake_response(request.query_params, [pager], {"dataset": dataset_name}, query=query)
 
 class TransactionFilter(FilterSet):
     amount_gt = rest_framework.NumberFilter(field_name='amount', lookup_expr='gt')
@@ -182,6 +203,7 @@ class TransactionViewSet(viewsets.ModelViewSet):
     filterset_class = TransactionFilter
     search_fields = ['payment_method', 'country', 'product_category', 'status', 'user_name']
     ordering_fields = ['amount', 'customer_rating', 'timestamp']
+    pagination_class = TransactionCursorPagination
     
     def list(self, request, *args, **kwargs):
         if not check_dataset_access(request.user, 'TRANSACTIONS_COMPLETED'):
@@ -206,71 +228,8 @@ class TransactionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if not check_dataset_access(self.request.user, 'TRANSACTIONS_COMPLETED'):
             return Transaction.objects.none()
-        
-        if not Transaction.objects.exists():
-            self.load_data_from_lake()
-        return Transaction.objects.all()
 
-    def load_data_from_lake(self):
-        if not check_dataset_access(self.request.user, 'TRANSACTIONS_COMPLETED'):
-            print("L'utilisateur n'a pas accès aux transactions complétées")
-            return
-            
-        completed_transactions_path = os.path.join(DATA_LAKE_PATH, 'TRANSACTIONS_COMPLETED')
-        
-        if not os.path.exists(completed_transactions_path):
-            print("Le dossier TRANSACTIONS_COMPLETED n'existe pas")
-            return
-
-        for filename in os.listdir(completed_transactions_path):
-            if filename.endswith('.json'):
-                file_path = os.path.join(completed_transactions_path, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        self.process_transaction_data(data)
-                except json.JSONDecodeError:
-                    print(f"Erreur lors de la lecture du fichier {filename}")
-                except Exception as e:
-                    print(f"Erreur inattendue avec le fichier {filename}: {str(e)}")
-
-    def process_transaction_data(self, data):
-        if isinstance(data, list):
-            for item in data:
-                self.create_transaction_from_data(item)
-        else:
-            self.create_transaction_from_data(data)
-
-    def create_transaction_from_data(self, item):
-        try:
-            location = item.get('LOCATION', {})
-            country = location.get('COUNTRY', 'Unknown')
-
-            customer_rating = item.get('CUSTOMER_RATING')
-            if customer_rating is None:
-                customer_rating = 0
-
-            timestamp = item.get('TIMESTAMP')
-            if timestamp:
-                from datetime import datetime
-                timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
-            else:
-                timestamp = datetime.now()
-
-            Transaction.objects.create(
-                payment_method=item.get('PAYMENT_METHOD', 'Unknown'),
-                country=country,
-                product_category=item.get('PRODUCT_CATEGORY', 'Unknown'),
-                status=item.get('STATUS', 'Unknown'),
-                amount=float(item.get('AMOUNT', 0)),
-                customer_rating=customer_rating,
-                timestamp=timestamp,
-                user_id=item.get('USER_ID', 'Unknown'),
-                user_name=item.get('USER_NAME', 'Unknown'),
-                product_id=item.get('PRODUCT_ID', 'Unknown')
-            )
-        except Exception as e:
-            print(f"Erreur lors de la création de la transaction: {str(e)}")
+        return Transaction.objects.all()
 
 @api_view(['GET'])
 @authentication_classes([BasicAuthentication])
@@ -284,17 +243,22 @@ def last_5_minutes_spent(request):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    five_minutes_ago = timezone.now() - timedelta(minutes=5)
-    total_spent = Transaction.objects.filter(
-        timestamp__gte=five_minutes_ago
-    ).aggregate(
-        total=Coalesce(Sum('amount', output_field=FloatField()), 0.0, output_field=FloatField())
-    )['total']
-    
+    try:
+        seconds, time_range = parse_window(request.query_params.get('window', '5m'))
+    except ValueError:
+        return Response(
+            {"error": "Invalid window, expected e.g. 5m, 1h or 24h"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    end_time = timezone.now()
+    start_time = end_time - timedelta(seconds=seconds)
+    total_spent = trailing_spent(seconds, now=end_time)
+
     return Response({
-        "time_range": "5 minutes",
-        "start_time": five_minutes_ago,
-        "end_time": timezone.now(),
+        "time_range": time_range,
+        "start_time": start_time,
+        "end_time": end_time,
         "total_spent": float(total_spent)
     })
 
@@ -311,24 +275,16 @@ def total_spent_by_user_type(request):
         )
     
     try:
-        # S'assurer que les données sont chargées
-        if not Transaction.objects.exists():
-            # Créer une instance du viewset pour utiliser sa méthode de chargement
-            viewset = TransactionViewSet()
-            viewset.request = request
-            viewset.load_data_from_lake()
-        
-        stats = Transaction.objects.values(
-            'user_id', 'payment_method', 'status'
-        ).annotate(
-            total_spent=Sum('amount', output_field=FloatField()),
-            transaction_count=Count('id')
+        # Agrégats maintenus par l'import (voir rollups.py) au lieu d'un GROUP BY sur Transaction
+        stats = UserSpendingRollup.objects.values(
+            'user_id', 'payment_method', 'status', 'total_spent', 'transaction_count'
         ).order_by('user_id', 'status')
         
         # Convertir les valeurs décimales en float pour la sérialisation JSON        # Organiser les statistiques par utilisateur
         user_stats = {}
         for stat in stats:
-            user_id = stat['user_id']
+            # Les agrégats stockent un user_id absent comme '' : l'API le renvoie à null comme avant
+            user_id = stat['user_id'] or None
             if user_id not in user_stats:
                 user_stats[user_id] = {
                     'user_id': user_id,
@@ -394,16 +350,13 @@ def top_products(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        top_products = Transaction.objects.values(
-            'product_id', 'product_category'
-        ).annotate(
-            total_bought=Count('id'),
-            total_spent=Sum('amount', output_field=FloatField())
+        top_products = ProductRollup.objects.values(
+            'product_id', 'product_category', 'total_bought', 'total_spent'
         ).order_by('-total_bought')[:limit]
         
         # Convertir les valeurs décimales en float pour la sérialisation JSON
         products_list = [{
-            'product_id': prod['product_id'],
+            'product_id': prod['product_id'] or None,  # '' dans ProductRollup pour un product_id absent
             'product_category': prod['product_category'],
             'total_bought': prod['total_bought'],
             'total_spent': float(prod['total_spent'] if prod['total_spent'] is not None else 0)
@@ -429,65 +382,88 @@ def list_data_lake_resources(request):
     """Liste toutes les ressources disponibles dans le data lake avec leurs versions"""
     log_access(request)
     
-    versions = DataLakeVersion.objects.all()
     resources = {}
+    for version in DataLakeVersion.objects.prefetch_related('catalog_datasets'):
+        entry = version_resources(version)
+        if entry is not None:
+            resources[version.name] = entry
     
-    for version in versions:
-        path = version.path
-        if not os.path.exists(path):
-            continue
-            
-        resources[version.name] = {
-            'version_info': {
-                'name': version.name,
-                'created_at': version.created_at,
-                'is_active': version.is_active
-            },
-            'datasets': []
+    return Response(resources)
+
+def version_resources(version):
+    """Description d'une version et de ses datasets ; None si son dossier n'existe pas.
+
+    Une version présente dans le catalogue (``scan_lake``) est décrite sans
+    accès disque, avec la taille et le nombre d'enregistrements de chaque
+    dataset ; sinon son dossier est listé. ``version.catalog_datasets`` est
+    normalement préchargé (``prefetch_related``).
+    """
+    version_info = {
+        'name': version.name,
+        'created_at': version.created_at,
+        'is_active': version.is_active
+    }
+    catalogued = sorted(version.catalog_datasets.all(), key=lambda dataset: dataset.dataset_name)
+    if catalogued:
+        return {
+            'version_info': version_info,
+            'datasets': [dataset.dataset_name for dataset in catalogued],
+            'stats': {dataset.dataset_name: catalog.dataset_summary(dataset) for dataset in catalogued}
         }
+
+    path = version.path
+    if not os.path.exists(path):
+        return None
         
+    return {
+        'version_info': version_info,
         # Liste tous les dossiers dans cette version du data lake
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            if os.path.isdir(item_path):
-                resources[version.name]['datasets'].append(item)
-    
-    return Response(resources)
+        'datasets': [item for item in os.listdir(path) if os.path.isdir(os.path.join(path, item))],
+        'stats': {}
+    }
 
-@api_view(['GET'])
-@authentication_classes([BasicAuthentication])
-@permission_classes([IsAuthenticated])
-def get_dataset_version(request, dataset_name, version_name):
-    """Obtient une version spécifique d'un dataset"""
-    log_access(request)
-    
+def resolve_dataset_version(request, dataset_name, version_name, access_type='read'):
+    """Vérifie la version, les droits et le dossier d'un dataset.
+
+    Retourne ``(version, None)`` ou ``(None, réponse d'erreur)`` ; les refus
+    sont journalisés dans DetailedAccessLog.
+    """
     try:
         version = DataLakeVersion.objects.get(name=version_name)
     except DataLakeVersion.DoesNotExist:
-        DetailedAccessLog.objects.create(
-            user=request.user,
-            dataset_name=dataset_name,
-            access_type='version_check',
+        log_dataset_access(
+            request.user,
+            dataset_name,
+            'version_check',
             success=False,
             error_message=f"Version {version_name} not found"
         )
-        return Response(
+        return None, Response(
             {"error": f"Version {version_name} not found"},
             status=status.HTTP_404_NOT_FOUND
         )
     
+    error = check_version_access(request.user, dataset_name, version, access_type)
+    if error is not None:
+        return None, error
+    return version, None
+
+def check_version_access(user, dataset_name, version, access_type='read'):
+    """Droits de l'utilisateur sur une version trouvée et présence du dossier du dataset.
+
+    Retourne None ou la réponse d'erreur ; les refus sont journalisés.
+    """
+    version_name = version.name
+
     # Vérifier les droits d'accès
-    access_right = AccessRight.objects.filter(
-        user=request.user,
-        dataset_name=dataset_name
-    ).first()
+    permissions = get_permissions(user)
     
-    if not access_right:
-        DetailedAccessLog.objects.create(
-            user=request.user,
-            dataset_name=dataset_name,
+    if not permissions.can_access(dataset_name):
+        log_dataset_access(
+            user,
+            dataset_name,
+            access_type,
             version=version,
-            access_type='read',
             success=False,
             error_message="Access denied"
         )
@@ -496,12 +472,12 @@ def get_dataset_version(request, dataset_name, version_name):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    if not (access_right.can_access_all_versions or version in access_right.allowed_versions.all()):
-        DetailedAccessLog.objects.create(
-            user=request.user,
-            dataset_name=dataset_name,
+    if not permissions.can_access_version(dataset_name, version.id):
+        log_dataset_access(
+            user,
+            dataset_name,
+            access_type,
             version=version,
-            access_type='read',
             success=False,
             error_message=f"No access to version {version_name}"
         )
@@ -513,11 +489,11 @@ def get_dataset_version(request, dataset_name, version_name):
     # Charger les données
     folder_path = os.path.join(version.path, dataset_name)
     if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-        DetailedAccessLog.objects.create(
-            user=request.user,
-            dataset_name=dataset_name,
+        log_dataset_access(
+            user,
+            dataset_name,
+            access_type,
             version=version,
-            access_type='read',
             success=False,
             error_message="Dataset not found"
         )
@@ -526,13 +502,35 @@ def get_dataset_version(request, dataset_name, version_name):
             status=status.HTTP_404_NOT_FOUND
         )
     
-    data = load_data_for_dataset(dataset_name, base_path=version.path)
-    
-    DetailedAccessLog.objects.create(
-        user=request.user,
-        dataset_name=dataset_name,
+    return None
+
+@api_view(['GET'])
+@authentication_classes([BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def get_dataset_version(request, dataset_name, version_name):
+    """Obtient une version spécifique d'un dataset"""
+    log_access(request)
+
+    version, error = resolve_dataset_version(request, dataset_name, version_name)
+    if error is not None:
+        return error
+
+    try:
+        window = TimeWindow.from_params(request.query_params.get('from'), request.query_params.get('to'))
+    except InvalidQuery as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if window is None:
+        data = load_data_for_dataset(dataset_name, base_path=version.path)
+    else:
+        index = timeindex.get_time_index(version.path, dataset_name)
+        data = load_window_for_dataset(dataset_name, window, version.path, index=index)
+    
+    log_dataset_access(
+        request.user,
+        dataset_name,
+        'read',
         version=version,
-        access_type='read',
         success=True
     )
     
@@ -542,6 +540,58 @@ def get_dataset_version(request, dataset_name, version_name):
         "data": data
     })
 
+@api_view(['GET'])
+@authentication_classes([BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def export_dataset_version(request, dataset_name, version_name):
+    """Exporte une version d'un dataset en flux NDJSON ou CSV (voir export.py)"""
+    log_access(request)
+
+    export_format = request.query_params.get('output', 'ndjson')
+    if export_format not in export.EXPORT_FORMATS:
+        return Response(
+            {"error": f"Invalid output, expected one of {', '.join(export.EXPORT_FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    version, error = resolve_dataset_version(request, dataset_name, version_name, access_type='export')
+    if error is not None:
+        return error
+
+    pager = DatasetPager(version.path, dataset_name)
+    try:
+        start, stop, partial = export.parse_range(
+            request.META.get('HTTP_RANGE'), request.query_params.get('offset'), pager.total
+        )
+    except export.InvalidRange:
+        response = Response(
+            {"error": "Invalid range, expected records=<start>-[<end>]"},
+            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        response['Content-Range'] = f"records */{pager.total}"
+        return response
+
+    log_dataset_access(request.user, dataset_name, 'export', version=version, success=True)
+
+    def open_records():
+        return itertools.islice(pager.iter_records(start), stop - start)
+
+    compress = export.accepts_gzip(request)
+    response = StreamingHttpResponse(
+        export.export_stream(open_records, export_format, compress=compress),
+        content_type=export.EXPORT_FORMATS[export_format],
+        status=status.HTTP_206_PARTIAL_CONTENT if partial else status.HTTP_200_OK
+    )
+    response['Content-Disposition'] = f'attachment; filename="{dataset_name}_{version_name}.{export_format}"'
+    response['Accept-Ranges'] = 'records'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    if partial:
+        covered = f"{start}-{stop - 1}" if stop > start else "*"
+        response['Content-Range'] = f"records {covered}/{pager.total}"
+    return response
+
 @api_view(['GET'])
 @authentication_classes([BasicAuthentication])
 @permission_classes([IsAuthenticated])
@@ -571,6 +621,91 @@ def get_dataset_access_history(request, dataset_name):
         "access_history": list(access_logs)
     })
 
+@api_view(['GET'])
+@authentication_classes([BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def lookup_lake_keys(request):
+    """Retrouve des enregistrements du lake par TRANSACTION_ID, USER_ID ou PRODUCT_ID via l'index des clés"""
+    log_access(request)
+
+    params = {field: request.query_params.getlist(field.lower()) for field in keyindex.KEY_FIELDS}
+    fields = [field for field, values in params.items() if values]
+    if len(fields) != 1:
+        return Response(
+            {"error": "Give exactly one of: " + ", ".join(field.lower() for field in keyindex.KEY_FIELDS)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    field = fields[0]
+
+    max_limit = getattr(settings, 'LAKE_LOOKUP_MAX_LIMIT', keyindex.MAX_LIMIT)
+    try:
+        limit = int(request.query_params.get('limit', getattr(settings, 'LAKE_LOOKUP_DEFAULT_LIMIT', keyindex.DEFAULT_LIMIT)))
+    except ValueError:
+        return Response({"error": "Invalid limit parameter"}, status=status.HTTP_400_BAD_REQUEST)
+    if limit <= 0 or limit > max_limit:
+        return Response({"error": f"Limit must be between 1 and {max_limit}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    version = None
+    version_name = request.query_params.get('version')
+    if version_name:
+        try:
+            version = DataLakeVersion.objects.get(name=version_name)
+        except DataLakeVersion.DoesNotExist:
+            return Response({"error": f"Version {version_name} not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # Seuls les datasets et versions autorisés sont cherchés ; seul le fichier de chaque résultat est lu
+    hits, truncated = keyindex.lookup(
+        field, params[field], get_permissions(request.user),
+        version=version, dataset_name=request.query_params.get('dataset'), limit=limit
+    )
+    with instrumentation.phase('load'):
+        resolved = keyindex.resolve(hits, params[field])
+
+    return Response({
+        "field": field,
+        "values": params[field],
+        "count": len(resolved),
+        "truncated": truncated,
+        "results": [{
+            "version": hit.version.name,
+            "dataset": hit.dataset_name,
+            "file": hit.filename,
+            "offset": hit.offset,
+            "record": record,
+        } for hit, record in resolved]
+    })
+
+@api_view(['GET'])
+@authentication_classes([BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def data_lake_cache_stats(request):
+    """Compteurs du cache de datasets (hits, misses, taille) pour le monitoring"""
+    log_access(request)
+
+    if not request.user.is_staff:
+        return Response(
+            {"error": "Only staff members can view cache statistics"},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    return Response(get_dataset_cache().stats())
+
+@api_view(['GET'])
+@authentication_classes([BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def performance_metrics(request):
+    """Agrégats de PerformanceMiddleware (processus courant) et état du watcher, au format texte de Prometheus"""
+    if not request.user.is_staff:
+        return Response(
+            {"error": "Only staff members can view performance metrics"},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    return HttpResponse(
+        instrumentation.get_metrics().render() + watcher.render_metrics(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
 @api_view(['GET'])
 @authentication_classes([BasicAuthentication])
 @permission_classes([IsAuthenticated])
@@ -0,0 +1,379 @@
+"""Surveillance du data lake : les nouveaux fichiers sont poussés vers la base, la recherche et les caches.
+
+``LakeWatcher`` (commande ``watch_lake``) suit les dossiers de toutes les
+versions actives (``lake/notify.py`` : inotify, ou scrutation périodique),
+regroupe les fichiers détectés par dataset et les transmet aux consommateurs
+enregistrés avec ``register_consumer`` :
+
+- ``catalog`` : met à jour le catalogue du lake (``lake/catalog.py``) ;
+- ``ingestion`` : importe les transactions dans la table Transaction ;
+- ``search`` : indexe les fichiers changés dans Elasticsearch ;
+- ``keys`` : met à jour l'index des clés du lake (``lake/keyindex.py``) ;
+- ``mapped`` : reconstruit le fichier projeté des datasets chauds
+  (``lake/mapped.py``) quand trop de fichiers sont arrivés depuis sa
+  construction, ou qu'il est trop ancien ;
+- ``cache`` : invalide le cache de datasets du processus qui fait tourner le
+  watcher (utile quand il est lancé dans un thread du serveur avec ``start``).
+
+La livraison est « au moins une fois » : chaque consommateur acquitte ses
+paquets séparément, un paquet en échec est retenté avec un délai croissant,
+et au démarrage (puis après un débordement de la file inotify) chaque dataset
+est repris en entier. Les consommateurs sont donc idempotents : ils s'appuient
+sur leurs propres registres (``IngestedFile``, ``IndexedFile``, ``CatalogFile``,
+``KeyIndexedFile``)
+pour ne traiter que ce qui a changé.
+
+L'état du watcher (fichiers en attente, retard, échecs par consommateur) est
+écrit dans ``LAKE_WATCHER_STATUS_FILE`` et exposé par ``/myapp/metrics/``.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import codec, indexing
+from .documents import ELASTICSEARCH_AVAILABLE
+from .ingestion import TRANSACTIONS_DATASET, ingest_transactions
+from .lake import catalog, keyindex, mapped, notify, segments
+from .lake.cache import get_dataset_cache
+from .models import DataLakeVersion
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_DELAY = 2.0  # secondes
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_MAPPED_REBUILD_FILES = 500
+DEFAULT_MAPPED_REBUILD_AGE = 600.0  # secondes
+VERSIONS_REFRESH_INTERVAL = 30.0
+MAX_RETRY_DELAY = 60.0
+
+CONSUMERS = {}
+
+
+def register_consumer(name):
+    """Enregistre ``func(version, dataset_name, filenames)`` ; ``filenames`` vaut None pour une reprise complète"""
+    def decorator(func):
+        CONSUMERS[name] = func
+        return func
+    return decorator
+
+
+@register_consumer('catalog')
+def update_catalog(version, dataset_name, filenames):
+    catalog.scan_dataset(version, dataset_name)
+
+
+@register_consumer('ingestion')
+def ingest_new_files(version, dataset_name, filenames):
+    if dataset_name in getattr(settings, 'LAKE_WATCHER_INGEST_DATASETS', [TRANSACTIONS_DATASET]):
+        ingest_transactions(version, dataset_name)
+
+
+@register_consumer('search')
+def index_new_files(version, dataset_name, filenames):
+    if not ELASTICSEARCH_AVAILABLE:
+        raise RuntimeError("Elasticsearch is not available")
+    removed = indexing.removed_files([version], dataset_name)
+    if removed:
+        indexing.delete_removed_files(removed)
+    entries = indexing.changed_files(version, dataset_name)
+    if not entries:
+        return
+    stats = indexing.bulk_index([(version, dataset_name, entries)])
+    indexing.record_indexed_files(stats.succeeded_files)
+    if stats.errors:
+        # Les fichiers en échec ne sont pas enregistrés : le prochain essai les renverra
+        raise RuntimeError(f"{stats.errors} documents failed to index")
+
+
+@register_consumer('keys')
+def update_key_index(version, dataset_name, filenames):
+    keyindex.index_dataset(version, dataset_name)
+
+
+@register_consumer('mapped')
+def rebuild_mapped_store(version, dataset_name, filenames):
+    folder_path = os.path.join(version.path, dataset_name)
+    hot = dataset_name in getattr(settings, 'DATA_LAKE_MAPPED_DATASETS', [])
+    if not hot and not os.path.exists(mapped.store_path(folder_path)):
+        return
+    min_files = getattr(settings, 'DATA_LAKE_MAPPED_REBUILD_FILES', DEFAULT_MAPPED_REBUILD_FILES)
+    max_age = getattr(settings, 'DATA_LAKE_MAPPED_REBUILD_AGE', DEFAULT_MAPPED_REBUILD_AGE)
+    if mapped.needs_rebuild(folder_path, min_files, max_age):
+        mapped.build_store(folder_path)
+
+
+@register_consumer('cache')
+def invalidate_cache(version, dataset_name, filenames):
+    get_dataset_cache().invalidate(version.path, dataset_name)
+
+
+class Batch:
+    """Fichiers d'un dataset en attente pour un consommateur"""
+
+    def __init__(self, now):
+        self.filenames = set()
+        self.full = False  # reprise complète du dataset
+        self.oldest = now  # date (epoch) du plus ancien fichier en attente
+        self.attempts = 0
+        self.next_try = 0.0
+
+    def add(self, filenames, written_at):
+        if filenames is None:
+            self.full = True
+        else:
+            self.filenames.update(filenames)
+        self.oldest = min(self.oldest, written_at)
+
+    @property
+    def size(self):
+        return len(self.filenames) or (1 if self.full else 0)
+
+
+class ConsumerState:
+    def __init__(self, name):
+        self.name = name
+        self.batches = {}  # dossier du dataset -> Batch
+        self.delivered_files = 0
+        self.delivered_batches = 0
+        self.failures = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.last_error = ''
+
+    @property
+    def pending_files(self):
+        return sum(batch.size for batch in self.batches.values())
+
+    def status(self):
+        return {
+            'pending_files': self.pending_files,
+            'delivered_files': self.delivered_files,
+            'delivered_batches': self.delivered_batches,
+            'failures': self.failures,
+            'last_lag_seconds': self.last_lag,
+            'max_lag_seconds': self.max_lag,
+            'last_error': self.last_error,
+        }
+
+
+class LakeWatcher:
+    def __init__(self, consumers=None, polling=False, poll_interval=None, batch_size=None, batch_delay=None,
+                 status_path=None, log=print):
+        names = consumers or getattr(settings, 'LAKE_WATCHER_CONSUMERS', list(CONSUMERS))
+        unknown = [name for name in names if name not in CONSUMERS]
+        if unknown:
+            raise ValueError(f"Unknown consumers: {', '.join(unknown)}")
+        self.consumers = {name: ConsumerState(name) for name in names}
+        self.poll_interval = poll_interval or getattr(settings, 'LAKE_WATCHER_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        self.batch_size = batch_size or getattr(settings, 'LAKE_WATCHER_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.batch_delay = batch_delay if batch_delay is not None else getattr(settings, 'LAKE_WATCHER_BATCH_DELAY', DEFAULT_BATCH_DELAY)
+        self.status_path = status_path or status_file()
+        self.source = notify.open_source(polling=polling, interval=self.poll_interval)
+        self.log = log
+        self.datasets = {}  # dossier du dataset -> (version, nom du dataset)
+        self.versions = {}  # dossier de la version -> version
+        self._versions_checked = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Dossiers suivis
+
+    def refresh_versions(self):
+        """Suit les versions actives et leurs datasets ; les nouveaux datasets sont repris en entier"""
+        self._versions_checked = time.monotonic()
+        for version in DataLakeVersion.objects.filter(is_active=True):
+            if version.path not in self.versions and os.path.isdir(version.path):
+                self.versions[version.path] = version
+                self._watch(self.source.watch_version, version.path)
+                for name in sorted(os.listdir(version.path)):
+                    self.add_dataset(version, name)
+
+    def add_dataset(self, version, dataset_name):
+        folder_path = os.path.join(version.path, dataset_name)
+        if folder_path in self.datasets or dataset_name.startswith('.') or not os.path.isdir(folder_path):
+            return
+        self.datasets[folder_path] = (version, dataset_name)
+        self._watch(self.source.watch_dataset, folder_path)
+        self.enqueue(folder_path, None)
+
+    def _watch(self, method, path):
+        try:
+            method(path)
+        except OSError as e:
+            if isinstance(self.source, notify.PollingSource):
+                raise
+            # Limite de watches inotify atteinte... : tout reprendre en scrutation
+            self.log(f"inotify indisponible ({e}), passage en scrutation toutes les {self.poll_interval}s")
+            self.source.close()
+            self.source = notify.PollingSource(interval=self.poll_interval)
+            for version_path in self.versions:
+                self.source.watch_version(version_path)
+            for dataset_path in self.datasets:
+                self.source.watch_dataset(dataset_path)
+            self.catch_up()
+
+    def catch_up(self):
+        """Reprise complète de tous les datasets suivis"""
+        for folder_path in self.datasets:
+            self.enqueue(folder_path, None)
+
+    # Événements et livraison
+
+    def enqueue(self, folder_path, filenames, written_at=None):
+        now = time.time()
+        for state in self.consumers.values():
+            batch = state.batches.get(folder_path)
+            if batch is None:
+                batch = state.batches[folder_path] = Batch(now)
+            batch.add(filenames, written_at or now)
+
+    def handle_events(self, events):
+        if events == notify.RESCAN:
+            self.log("File d'événements saturée : reprise complète des datasets")
+            self.catch_up()
+            return
+        files = {}
+        for folder_path, name, is_dir in events:
+            if is_dir:
+                version = self.versions.get(folder_path)
+                if version is not None:
+                    self.add_dataset(version, name)
+            elif folder_path in self.datasets:
+                files.setdefault(folder_path, []).append(name)
+        for folder_path, names in files.items():
+            self.enqueue(folder_path, names, written_at=self._written_at(folder_path, names))
+
+    @staticmethod
+    def _written_at(folder_path, names):
+        """Date d'écriture du plus ancien fichier (mtime), pour mesurer le retard de livraison"""
+        times = []
+        for name in names:
+            try:
+                times.append(os.stat(os.path.join(folder_path, name)).st_mtime)
+            except OSError:
+                pass
+        return min(times) if times else None
+
+    def _due(self, state, now):
+        if not state.batches:
+            return False
+        if state.pending_files >= self.batch_size:
+            return True
+        oldest = min(batch.oldest for batch in state.batches.values())
+        return now - oldest >= self.batch_delay or any(batch.full for batch in state.batches.values())
+
+    def dispatch(self, force=False):
+        """Livre les paquets prêts ; retourne le nombre de paquets livrés"""
+        delivered = 0
+        for name, state in self.consumers.items():
+            now = time.time()
+            if not force and not self._due(state, now):
+                continue
+            for folder_path, batch in list(state.batches.items()):
+                if batch.next_try > now:
+                    continue
+                version, dataset_name = self.datasets[folder_path]
+                filenames = None if batch.full else sorted(batch.filenames)
+                close_old_connections()
+                try:
+                    CONSUMERS[name](version, dataset_name, filenames)
+                except Exception as e:
+                    batch.attempts += 1
+                    batch.next_try = time.time() + min(MAX_RETRY_DELAY, 2 ** batch.attempts)
+                    state.failures += 1
+                    state.last_error = f"{dataset_name}: {e}"
+                    self.log(f"Échec de {name} pour {version.name}/{dataset_name} (essai {batch.attempts}) : {e}")
+                    continue
+                finally:
+                    close_old_connections()
+                # Acquitté : les fichiers arrivés pendant la livraison sont dans un nouveau paquet
+                if state.batches.get(folder_path) is batch:
+                    del state.batches[folder_path]
+                lag = max(0.0, time.time() - batch.oldest)
+                state.last_lag = lag
+                state.max_lag = max(state.max_lag, lag)
+                state.delivered_files += len(batch.filenames)
+                state.delivered_batches += 1
+                delivered += 1
+        return delivered
+
+    # Boucle principale
+
+    def run_once(self, timeout=None):
+        """Un tour de boucle : attente d'événements, livraison, état"""
+        if time.monotonic() - self._versions_checked >= VERSIONS_REFRESH_INTERVAL:
+            self.refresh_versions()
+        self.handle_events(self.source.poll(self.poll_interval if timeout is None else timeout))
+        delivered = self.dispatch()
+        self.write_status()
+        return delivered
+
+    def run(self, once=False):
+        """Boucle jusqu'à ``stop()`` ; avec ``once``, livre une reprise complète puis s'arrête"""
+        self.refresh_versions()
+        try:
+            if once:
+                # Les paquets en échec seront repris au prochain lancement (reprise complète)
+                self.dispatch(force=True)
+                self.write_status()
+                return
+            while not self._stop.is_set():
+                self.run_once()
+        finally:
+            self.source.close()
+
+    def start(self):
+        """Lance la boucle dans un thread de fond (daemon)"""
+        self._thread = threading.Thread(target=self.run, name='lake-watcher', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            'updated_at': time.time(),
+            'source': self.source.name,
+            'datasets': len(self.datasets),
+            'consumers': {name: state.status() for name, state in self.consumers.items()},
+        }
+
+    def write_status(self):
+        try:
+            # Fichier temporaire propre à l'écrivain : un ``--once`` peut tourner à côté du démon
+            segments.write_atomic(self.status_path, self.status())
+        except OSError as e:
+            self.log(f"Impossible d'écrire l'état du watcher : {e}")
+
+
+def status_file():
+    return str(getattr(settings, 'LAKE_WATCHER_STATUS_FILE', os.path.join(settings.BASE_DIR, 'lake_watcher_status.json')))
+
+
+def render_metrics(path=None):
+    """Métriques du watcher au format Prometheus (vide s'il n'a jamais tourné)"""
+    try:
+        status = codec.load_file(path or status_file())
+    except (OSError, ValueError):
+        return ''
+
+    lines = [
+        '# HELP myapp_lake_watcher_updated_seconds Last time the lake watcher wrote its status (epoch).',
+        '# TYPE myapp_lake_watcher_updated_seconds gauge',
+        f'myapp_lake_watcher_updated_seconds {status["updated_at"]:.3f}',
+    ]
+    for metric, key, kind, help_text in (
+        ('myapp_lake_watcher_pending_files', 'pending_files', 'gauge', 'Files detected but not yet delivered.'),
+        ('myapp_lake_watcher_lag_seconds', 'last_lag_seconds', 'gauge', 'Delay between a file write and its delivery (last batch).'),
+        ('myapp_lake_watcher_max_lag_seconds', 'max_lag_seconds', 'gauge', 'Largest delivery delay since the watcher started.'),
+        ('myapp_lake_watcher_delivered_files_total', 'delivered_files', 'counter', 'Files delivered.'),
+        ('myapp_lake_watcher_failures_total', 'failures', 'counter', 'Failed deliveries (retried).'),
+    ):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        for name, values in sorted(status['consumers'].items()):
+            if values.get(key) is not None:
+                lines.append(f'{metric}{{consumer="{name}"}} {values[key]}')
+    return '\n'.join(lines) + '\n'